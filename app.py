@@ -1,14 +1,38 @@
 import streamlit as st
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Date, DateTime, ForeignKey, Boolean, Index, and_, or_, func, select, insert, inspect, text, bindparam
+from sqlalchemy.orm import sessionmaker, relationship, Session, deferred, make_transient_to_detached
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import smtplib
+import sqlite3
+import csv
+import json
+import zipfile
+import tempfile
 from email.message import EmailMessage
 import base64 # NEW: Untuk menyimpan foto bengkel
 import io # NEW: Untuk membaca bytes foto
+import hashlib
+import math
+import os
+import re
+import functools
+import importlib.util
+import itertools
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
 
 # ====================================================================
 # 0. KONFIGURASI DAN UTILITY (EMAIL, BACKGROUND)
@@ -19,21 +43,35 @@ import io # NEW: Untuk membaca bytes foto
 LOGO_FILE_PATH = "logo.png" 
 
 # --- KONFIGURASI SMTP EMAIL ---
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.environ.get("MOTOCARE_SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("MOTOCARE_SMTP_PORT", "587"))
+SMTP_USE_TLS = os.environ.get("MOTOCARE_SMTP_TLS", "1") != "0" # set "0" untuk server SMTP lokal/pengujian
+SMTP_TIMEOUT = 10 # detik; koneksi lambat tidak boleh menggantung worker
 # GANTI INI DENGAN KREDENSIAL ASLI ANDA!
 SENDER_EMAIL = "motocare.app.demo@gmail.com"
-SENDER_PASSWORD = "YOUR_APP_PASSWORD"
+SENDER_PASSWORD = os.environ.get("MOTOCARE_SMTP_PASSWORD", "YOUR_APP_PASSWORD") # kosongkan untuk server SMTP tanpa login
+
+# --- KONFIGURASI OUTBOX EMAIL ---
+# Email tidak dikirim langsung dari halaman; diantrekan lalu dikirim worker latar belakang
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE_SECONDS = 30 # jeda percobaan ulang: 30 dtk, 1 mnt, 2 mnt, ...
+OUTBOX_POLL_SECONDS = 15
+# Batch yang diklaim dikunci selama ini; klaim yang habis (proses mati di tengah kirim) kembali ke pending.
+# Harus lebih lama dari waktu terburuk mengirim satu batch (OUTBOX_BATCH_SIZE x SMTP_TIMEOUT).
+OUTBOX_LEASE_SECONDS = 15 * 60
+
+# --- KONFIGURASI DIGEST PENGINGAT ---
+DIGEST_STATUSES = ("overdue",) # status due_status yang dimasukkan ke email digest
+DIGEST_OWNER_CHUNK = 500 # pemilik per chunk (satu transaksi outbox per chunk)
+DIGEST_RENDER_WORKERS = 4
 # ------------------------------
 
-def send_welcome_email(recipient_email, username):
-    """Mengirim email selamat datang kepada pengguna baru."""
-    
-    msg = EmailMessage()
-    msg['Subject'] = 'Selamat Datang di MotoCare App!'
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = recipient_email
-    
+logger = logging.getLogger("motocare")
+
+def build_welcome_email(recipient_email, username):
+    """Menyusun subjek dan isi email selamat datang kepada pengguna baru."""
+    subject = 'Selamat Datang di MotoCare App!'
     body = f"""
     Halo {username},
 
@@ -48,17 +86,187 @@ def send_welcome_email(recipient_email, username):
     Terima kasih,
     Tim MotoCare App
     """
+    return subject, body
+
+def build_reminder_digest_email(username, motors):
+    """Menyusun subjek dan isi email digest untuk motor yang sudah jatuh tempo service."""
+    subject = f'Pengingat MotoCare: {len(motors)} motor harus diservice'
+    motor_lines = "\n".join(
+        f"    - {motor['brand']} {motor['model']} ({motor['plate_number']}): "
+        f"jatuh tempo {motor['next_date']:%d %b %Y} atau {motor['next_km']:,} KM"
+        for motor in motors
+    )
+    body = f"""
+    Halo {username},
+
+    Motor berikut sudah melewati jadwal service berkala:
+
+{motor_lines}
+
+    Silakan lakukan service dan catat di MotoCare App agar pengingat diperbarui.
+
+    Terima kasih,
+    Tim MotoCare App
+    """
+    return subject, body
+
+def build_email_message(recipient_email, subject, body):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = SENDER_EMAIL
+    msg['To'] = recipient_email
     msg.set_content(body)
+    return msg
 
+def open_smtp_connection():
+    """Membuka satu koneksi SMTP (dengan timeout) yang dipakai ulang untuk beberapa email."""
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+        if SMTP_USE_TLS:
             server.starttls()
+        if SENDER_PASSWORD:
             server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        # print(f"Gagal mengirim email: {e}")
-        return False
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+# --- KONFIGURASI HASH PASSWORD ---
+# Format metode werkzeug. Hash lama dengan metode/cost berbeda diperbarui otomatis saat login.
+PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+PASSWORD_HASH_WORKERS = os.cpu_count() or 2
+PASSWORD_HASH_MAX_PENDING = 64 # permintaan hash yang boleh menunggu di pool
+PASSWORD_HASH_TIMEOUT = 30 # detik
+# ------------------------------
+
+class PasswordHasherBusyError(RuntimeError):
+    """Pool hash password penuh atau hash tidak selesai dalam batas waktu."""
+
+class PasswordHasher:
+    """Menjalankan hash/verifikasi password di pool thread terbatas.
+
+    scrypt/pbkdf2 di hashlib melepas GIL, jadi sesi Streamlit lain tetap berjalan
+    sementara jumlah hash yang berjalan bersamaan dibatasi jumlah worker.
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="motocare-hash")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._timeout = timeout
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PasswordHasherBusyError("Terlalu banyak permintaan login bersamaan, coba lagi sebentar.")
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError as e:
+            raise PasswordHasherBusyError("Verifikasi password terlalu lama, coba lagi sebentar.") from e
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+@st.cache_resource
+def get_password_hasher():
+    """Satu pool hash password per proses."""
+    return PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT)
+
+def hash_password(password):
+    return get_password_hasher().hash(password)
+
+def verify_password(password_hash, password):
+    return get_password_hasher().verify(password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """True jika hash dibuat dengan metode/cost selain PASSWORD_HASH_METHOD."""
+    return password_hash.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+
+# --- KONFIGURASI PENYIMPANAN FOTO ---
+# Foto disimpan sekali per isi file (SHA-256) di folder ini, bukan di dalam database
+PHOTO_STORE_DIR = "photo_store"
+# Foto upload diperkecil ke sisi terpanjang ini lalu dikompres ulang; EXIF selalu dibuang
+PHOTO_MAX_EDGE = 1600
+PHOTO_JPEG_QUALITY = 80
+PHOTO_THUMB_EDGE = 320
+PHOTO_THUMB_QUALITY = 70
+# ------------------------------
+
+def _detect_image_mime(data):
+    """Menebak MIME type gambar dari beberapa byte pertamanya."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    return "application/octet-stream"
+
+def photo_blob_path(photo_sha256):
+    """Lokasi file foto di penyimpanan berdasarkan hash SHA-256-nya."""
+    return os.path.join(PHOTO_STORE_DIR, photo_sha256[:2], photo_sha256)
+
+def store_photo_blob(data, mime=None):
+    """Menyimpan bytes foto ke penyimpanan; isi yang sama hanya ditulis sekali.
+
+    Mengembalikan (sha256, mime, ukuran_bytes).
+    """
+    photo_sha256 = hashlib.sha256(data).hexdigest()
+    path = photo_blob_path(photo_sha256)
+
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    return photo_sha256, mime or _detect_image_mime(data), len(data)
+
+def read_photo_blob(photo_sha256):
+    """Membaca bytes foto langsung dari file penyimpanan."""
+    with open(photo_blob_path(photo_sha256), "rb") as f:
+        return f.read()
+
+def _encode_image(img, image_format, quality):
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def prepare_service_photo(data):
+    """Memproses foto upload: buang EXIF, batasi sisi terpanjang, kompres ulang, buat thumbnail.
+
+    Mengembalikan (foto_bytes, thumbnail_bytes, mime). Melempar UnidentifiedImageError
+    jika data bukan gambar.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        # Terapkan orientasi dari EXIF sebelum metadata dibuang
+        img = ImageOps.exif_transpose(original)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            image_format, mime = "PNG", "image/png"
+            img = img.convert("RGBA")
+        else:
+            image_format, mime = "JPEG", "image/jpeg"
+            img = img.convert("RGB")
+        img.info.clear()
+
+        full = img.copy()
+        full.thumbnail((PHOTO_MAX_EDGE, PHOTO_MAX_EDGE), Image.LANCZOS)
+        thumb = img.copy()
+        thumb.thumbnail((PHOTO_THUMB_EDGE, PHOTO_THUMB_EDGE), Image.LANCZOS)
+
+        return (
+            _encode_image(full, image_format, PHOTO_JPEG_QUALITY),
+            _encode_image(thumb, image_format, PHOTO_THUMB_QUALITY),
+            mime,
+        )
 
 
 def set_background_image(image_url):
@@ -101,10 +309,284 @@ def set_background_image(image_url):
 # ====================================================================
 
 DATABASE_URL = "sqlite:///motocare.db"
-engine = create_engine(DATABASE_URL)
+# Pool koneksi dibagi oleh semua sesi browser dalam satu proses Streamlit
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30 # detik menunggu koneksi kosong sebelum error
+# Pengaturan SQLite: WAL agar pembaca tidak memblokir penulis
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 20000
+# Penulisan dijalankan satu per satu; maksimal sekian penulisan boleh mengantre
+WRITE_QUEUE_MAX = 64
+WRITE_QUEUE_TIMEOUT = 30 # detik menunggu giliran menulis
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Dipanggil untuk setiap koneksi baru di pool."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL") # aman untuk WAL, fsync hanya saat checkpoint
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+def create_db_engine(database_url):
+    """Engine SQLite dengan pool dan PRAGMA aplikasi (juga dipakai untuk database benchmark)."""
+    db_engine = create_engine(
+        database_url,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        # Koneksi dari pool dipakai bergantian oleh thread sesi Streamlit yang berbeda
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+    event.listen(db_engine, "connect", _set_sqlite_pragmas)
+    return db_engine
+
+@st.cache_resource
+def get_engine():
+    """Membuat engine sekali per proses; skrip Streamlit dieksekusi ulang setiap rerun."""
+    return create_db_engine(DATABASE_URL)
+
+engine = get_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# --- INSTRUMENTASI SQL PER RERUN ---
+# Saat aktif, hook cursor-execute pada engine mencatat statement, durasi, dan helper pemanggil
+# untuk setiap rerun Streamlit. Saat nonaktif listener dilepas dari engine, jadi query tidak
+# membayar biaya apa pun; yang tersisa hanya satu pengecekan atribut per rerun.
+SQL_PROFILE_ENABLED = os.environ.get("MOTOCARE_SQL_PROFILE", "0") == "1"
+SQL_PROFILE_MAX_RERUNS = 200 # rerun terakhir yang disimpan (semua sesi)
+SQL_PROFILE_MAX_QUERIES_PER_RERUN = 5000 # sisanya hanya dihitung
+SQL_N_PLUS_ONE_THRESHOLD = 5 # bentuk statement yang sama dari helper yang sama sebanyak ini per rerun
+# Frame di app.py yang bukan helper bermakna (pembungkus dekorator dan utilitas query)
+SQL_PROFILE_SKIP_FRAMES = {"wrapper", "_fetch_float_columns", "_before_cursor_execute", "_after_cursor_execute"}
+
+_SQL_SHAPE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SHAPE_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def sql_statement_shape(statement):
+    """Bentuk statement tanpa nilai: literal menjadi ?, daftar IN (?, ?, ...) menjadi (?...)."""
+    shape = _SQL_SHAPE_LITERAL.sub("?", statement)
+    shape = _SQL_SHAPE_IN_LIST.sub("(?...)", shape)
+    return " ".join(shape.split())
+
+def _calling_helper():
+    """Nama fungsi app.py terdekat di call stack yang memicu query."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__ and code.co_name not in SQL_PROFILE_SKIP_FRAMES:
+            return code.co_name
+        frame = frame.f_back
+    return "?"
+
+class SqlProfiler:
+    """Merekam query SQL per rerun untuk panel admin; aktif/nonaktif saat runtime."""
+
+    def __init__(self, db_engine, enabled=False, max_reruns=SQL_PROFILE_MAX_RERUNS):
+        self._engine = db_engine
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._reruns = deque(maxlen=max_reruns)
+        self.enabled = False
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            if enabled == self.enabled:
+                return
+            if enabled:
+                event.listen(self._engine, "before_cursor_execute", self._before_cursor_execute)
+                event.listen(self._engine, "after_cursor_execute", self._after_cursor_execute)
+            else:
+                event.remove(self._engine, "before_cursor_execute", self._before_cursor_execute)
+                event.remove(self._engine, "after_cursor_execute", self._after_cursor_execute)
+            self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._reruns.clear()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, "record", None) is not None:
+            conn.info.setdefault("sql_profile_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = getattr(self._local, "record", None)
+        started = conn.info.get("sql_profile_started")
+        if record is None or not started:
+            return
+        duration_ms = (time.perf_counter() - started.pop()) * 1000
+        record["query_count"] += 1
+        record["sql_ms"] += duration_ms
+        if len(record["queries"]) < SQL_PROFILE_MAX_QUERIES_PER_RERUN:
+            record["queries"].append((statement, duration_ms, _calling_helper(), executemany))
+
+    @contextmanager
+    def rerun(self, page):
+        """Merekam semua query thread ini selama blok berjalan sebagai satu rerun halaman page."""
+        if not self.enabled:
+            yield
+            return
+        record = {"page": page, "started_at": datetime.datetime.now(), "query_count": 0, "sql_ms": 0.0, "queries": []}
+        self._local.record = record
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.record = None
+            record["wall_ms"] = (time.perf_counter() - started) * 1000
+            record["n_plus_one"] = self._find_n_plus_one(record["queries"])
+            with self._lock:
+                self._reruns.append(record)
+
+    def set_page(self, page):
+        """Mengganti label halaman rerun yang sedang direkam (halaman baru diketahui di tengah rerun)."""
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["page"] = page
+
+    @staticmethod
+    def _find_n_plus_one(queries):
+        repeats = {}
+        for statement, _, helper, executemany in queries:
+            if not executemany:
+                key = (helper, sql_statement_shape(statement))
+                repeats[key] = repeats.get(key, 0) + 1
+        return [(helper, shape, count) for (helper, shape), count in repeats.items() if count >= SQL_N_PLUS_ONE_THRESHOLD]
+
+    def summary(self, slowest=20):
+        """Ringkasan rerun yang terekam: per halaman, query paling lambat, dan pola N+1."""
+        with self._lock:
+            reruns = list(self._reruns)
+
+        pages = {}
+        slow_queries = []
+        n_plus_one = {}
+        for record in reruns:
+            page = pages.setdefault(record["page"], {"reruns": 0, "queries": 0, "max_queries": 0, "sql_ms": 0.0, "wall_ms": 0.0})
+            page["reruns"] += 1
+            page["queries"] += record["query_count"]
+            page["max_queries"] = max(page["max_queries"], record["query_count"])
+            page["sql_ms"] += record["sql_ms"]
+            page["wall_ms"] += record["wall_ms"]
+            for statement, duration_ms, helper, _ in record["queries"]:
+                slow_queries.append((duration_ms, helper, record["page"], statement))
+            for helper, shape, count in record["n_plus_one"]:
+                key = (record["page"], helper, shape)
+                n_plus_one[key] = max(n_plus_one.get(key, 0), count)
+
+        slow_queries.sort(key=lambda item: item[0], reverse=True)
+        return {
+            "reruns": len(reruns),
+            "pages": pages,
+            "slowest": slow_queries[:slowest],
+            "n_plus_one": sorted(((*key, count) for key, count in n_plus_one.items()), key=lambda item: -item[3]),
+        }
+
+@st.cache_resource
+def get_sql_profiler():
+    """Satu profiler per proses, dibagi oleh semua sesi Streamlit."""
+    return SqlProfiler(engine, enabled=SQL_PROFILE_ENABLED)
+
+# --- PENULISAN SERIAL (SATU PENULIS PER PROSES) ---
+
+class WriteQueueFullError(RuntimeError):
+    """Antrean penulisan penuh atau giliran menulis tidak didapat dalam batas waktu."""
+
+class SerializedWriter:
+    """Menjalankan penulisan database satu per satu; pembaca tetap berjalan paralel (WAL).
+
+    Jumlah penulisan yang menunggu dibatasi max_pending agar lonjakan tidak menumpuk tanpa batas.
+    """
+
+    def __init__(self, max_pending, timeout):
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._timeout = timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def _reject(self, reason):
+        with self._stats_lock:
+            self.rejected += 1
+        raise WriteQueueFullError(reason)
+
+    def holds_turn(self):
+        return getattr(self._local, "depth", 0) > 0
+
+    @contextmanager
+    def turn(self):
+        """Menunggu giliran menulis; pemanggilan bersarang di thread yang sama tidak mengantre lagi."""
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        if not self._slots.acquire(blocking=False):
+            self._reject("Antrean penulisan database penuh, coba lagi sebentar.")
+        try:
+            if not self._lock.acquire(timeout=self._timeout):
+                self._reject("Menunggu giliran menulis ke database terlalu lama.")
+            self._local.depth = 1
+            try:
+                yield
+            finally:
+                self._local.depth = 0
+                self._lock.release()
+            with self._stats_lock:
+                self.completed += 1
+        finally:
+            self._slots.release()
+
+@st.cache_resource
+def get_db_writer():
+    """Satu penulis per proses, dibagi oleh semua sesi Streamlit."""
+    return SerializedWriter(WRITE_QUEUE_MAX, WRITE_QUEUE_TIMEOUT)
+
+def _release_idle_connection(db):
+    """Mengembalikan koneksi session ke pool tanpa meng-expire objek yang sudah dimuat.
+
+    Session yang menunggu giliran menulis tidak boleh memegang koneksi; jika tidak,
+    penulis yang sedang berjalan bisa kehabisan koneksi di pool.
+    """
+    if db.in_transaction() and not (db.new or db.dirty or db.deleted):
+        expire_on_commit = db.expire_on_commit
+        db.expire_on_commit = False
+        try:
+            db.commit()
+        finally:
+            db.expire_on_commit = expire_on_commit
+
+@contextmanager
+def write_transaction(db):
+    """Menjalankan blok penulisan pada giliran penulis; rollback jika terjadi error."""
+    writer = get_db_writer()
+    if not writer.holds_turn():
+        _release_idle_connection(db)
+    with writer.turn():
+        try:
+            yield
+        except Exception:
+            db.rollback()
+            raise
+
+def serialized_write(func):
+    """Dekorator untuk helper yang mengubah database (argumen pertama adalah session)."""
+    @functools.wraps(func)
+    def wrapper(db, *args, **kwargs):
+        with write_transaction(db):
+            return func(db, *args, **kwargs)
+    return wrapper
+
 # --- MODEL DATABASE ---
 
 class User(Base):
@@ -113,7 +595,7 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     email = Column(String, unique=True, index=True)
     password = Column(String)
-    is_admin = Column(Boolean, default=False)
+    is_admin = Column(Boolean, default=False, index=True)
     motors = relationship("Motor", back_populates="owner")
 
 class Motor(Base):
@@ -124,22 +606,34 @@ class Motor(Base):
     year = Column(Integer)
     plate_number = Column(String) # NEW: Kolom Nomor Plat
     current_km = Column(Integer, default=0)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     owner = relationship("User", back_populates="motors")
     services = relationship("Service", back_populates="motor")
     schedule = relationship("Schedule", back_populates="motor", uselist=False)
+    service_stats = relationship("MotorServiceStats", back_populates="motor", uselist=False)
 
 class Service(Base):
     __tablename__ = "services"
+    __table_args__ = (
+        Index("ix_services_motor_date", "motor_id", "service_date"),
+        Index("ix_services_motor_km", "motor_id", "km_at_service"),
+        Index("ix_services_motor_day", "motor_id", "service_on", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     service_date = Column(String, nullable=False)
+    service_on = Column(Date) # service_date sebagai tanggal asli untuk pengurutan/filter (NULL jika tidak valid)
     km_at_service = Column(Integer)
     description = Column(String)
     cost = Column(Integer)
     workshop_name = Column(String) # NEW: Nama Bengkel
     workshop_address = Column(String) # NEW: Alamat Bengkel
-    workshop_photo_base64 = Column(String) # NEW: Foto Bengkel (dalam format Base64)
+    # Kolom lama: foto Base64 dipindahkan ke PHOTO_STORE_DIR oleh migrate_photos_to_blob_store
+    workshop_photo_base64 = deferred(Column(String))
+    workshop_photo_sha256 = Column(String) # Kunci file foto di PHOTO_STORE_DIR
+    workshop_photo_mime = Column(String)
+    workshop_photo_size = Column(Integer)
+    workshop_thumb_sha256 = Column(String) # Thumbnail kecil untuk daftar riwayat
 
     motor_id = Column(Integer, ForeignKey("motors.id"))
 
@@ -156,21 +650,259 @@ class Schedule(Base):
 
     motor = relationship("Motor", back_populates="schedule")
 
+class EmailOutbox(Base):
+    """Antrean email keluar; dikirim oleh EmailOutboxWorker dengan percobaan ulang."""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_due", "status", "next_attempt_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+
+    status = Column(String, nullable=False, default="pending") # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False) # untuk status sending: akhir masa klaim
+    claim_token = Column(String) # penanda batch milik satu pengirim selama status sending
+    last_error = Column(String)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+class MotorServiceStats(Base):
+    """Agregat service per motor, diperbarui di setiap penulisan service."""
+    __tablename__ = "motor_service_stats"
+    motor_id = Column(Integer, ForeignKey("motors.id"), primary_key=True)
+
+    service_count = Column(Integer, nullable=False, default=0)
+    cost_sum = Column(Integer, nullable=False, default=0)
+    last_service_date = Column(String) # service_date terbesar (format YYYY-MM-DD)
+    max_km_at_service = Column(Integer)
+
+    motor = relationship("Motor", back_populates="service_stats")
+
+class MotorDueStatus(Base):
+    """Status jatuh tempo service per motor, dihitung ulang setiap kali motor, service, atau jadwalnya berubah."""
+    __tablename__ = "due_status"
+    __table_args__ = (
+        Index("ix_due_status_status_next_date", "status", "next_date"),
+    )
+    motor_id = Column(Integer, ForeignKey("motors.id"), primary_key=True)
+
+    next_date = Column(Date, nullable=False)
+    next_km = Column(Integer, nullable=False)
+    status = Column(String, nullable=False) # 'overdue', 'due_soon', 'ok'
+    computed_on = Column(Date, nullable=False) # tanggal acuan perhitungan; basi jika bukan hari ini
+
+
+class ReminderDigestLog(Base):
+    """Digest pengingat yang sudah diantrekan; satu baris per pemilik per hari agar job aman diulang."""
+    __tablename__ = "reminder_digest_log"
+    __table_args__ = (
+        Index("ux_reminder_digest_owner_date", "owner_id", "digest_date", unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    digest_date = Column(Date, nullable=False)
+    motor_count = Column(Integer, nullable=False)
+    outbox_id = Column(Integer, ForeignKey("email_outbox.id"))
+    created_at = Column(DateTime, nullable=False)
+
+class ServiceCostRollup(Base):
+    """Biaya service per motor per bulan per bengkel, diperbarui di setiap penulisan service."""
+    __tablename__ = "service_cost_rollup"
+    motor_id = Column(Integer, ForeignKey("motors.id"), primary_key=True)
+    month = Column(Date, primary_key=True) # tanggal 1 dari bulan service_on
+    workshop = Column(String, primary_key=True) # workshop_name tanpa spasi tepi ('' jika kosong)
+
+    service_count = Column(Integer, nullable=False, default=0)
+    cost_sum = Column(Integer, nullable=False, default=0)
+    min_km = Column(Integer)
+    max_km = Column(Integer)
+
+
+class Workshop(Base):
+    """Katalog bengkel berkoordinat; diindeks spasial oleh tabel virtual R*Tree workshop_rtree."""
+    __tablename__ = "workshops"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    name_key = Column(String, index=True) # nama dinormalkan (_normalize_place_text) untuk pencocokan riwayat
+    address = Column(String)
+    city = Column(String)
+    lat = Column(Float, nullable=False)
+    lng = Column(Float, nullable=False)
+    rating = Column(Float) # NULL untuk bengkel yang hanya dikenal dari riwayat service
+    source = Column(String, nullable=False) # 'katalog' (dataset bawaan) atau 'riwayat'
+    visit_count = Column(Integer, nullable=False, default=0) # jumlah service yang tercatat di bengkel ini
+
+
+# Tabel yang barisnya milik satu motor; ikut dihapus saat motornya dihapus
+MOTOR_CHILD_MODELS = [Schedule, Service, MotorServiceStats, MotorDueStatus, ServiceCostRollup]
 
-Base.metadata.create_all(bind=engine)
 
 # ====================================================================
 # 2. FUNGSI DATABASE HELPERS
 # ====================================================================
 
+@contextmanager
 def get_db():
-    """Membuat koneksi database yang aman."""
+    """Satu session database per rerun; session selalu ditutup saat blok with selesai.
+
+    st.rerun()/st.stop() melempar exception, jadi penutupan terjadi di blok finally.
+    """
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# --- CACHE BACA PER USER ---
+# Hasil helper baca disimpan per (user, versi data user). Setiap mutator menaikkan versi
+# user pemilik data setelah commit, sehingga entri lama tidak pernah terbaca lagi.
+# TTL hanya jaring pengaman untuk penulisan dari proses lain (misalnya manage.py).
+READ_CACHE_MAX_ENTRIES = 4096
+READ_CACHE_TTL_SECONDS = 300
+
+class UserReadCache:
+    """Cache LRU berukuran terbatas dengan versi data per user dan penghitung hit/miss."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._motor_owners = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def bump_all(self):
+        with self._lock:
+            for user_id in self._versions:
+                self._versions[user_id] += 1
+            self._entries.clear()
+
+    def get(self, key):
+        """Mengembalikan (ditemukan, nilai)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def motor_owner(self, db, motor_id):
+        """Pemilik motor (dicache; kepemilikan motor tidak pernah berubah)."""
+        with self._lock:
+            if motor_id in self._motor_owners:
+                return self._motor_owners[motor_id]
+        owner_id = db.query(Motor.owner_id).filter(Motor.id == motor_id).scalar()
+        if owner_id is not None:
+            with self._lock:
+                if len(self._motor_owners) >= self._max_entries * 4:
+                    self._motor_owners.clear()
+                self._motor_owners[motor_id] = owner_id
+        return owner_id
+
+    def forget_motors(self, motor_ids=None, owner_id=None):
+        """Melupakan pemilik motor yang dihapus (ID motor SQLite bisa dipakai ulang)."""
+        with self._lock:
+            for motor_id in list(motor_ids or []):
+                self._motor_owners.pop(motor_id, None)
+            if owner_id is not None:
+                for motor_id, motor_owner_id in list(self._motor_owners.items()):
+                    if motor_owner_id == owner_id:
+                        del self._motor_owners[motor_id]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
+
+@st.cache_resource
+def get_read_cache():
+    """Satu cache baca per proses, dibagi oleh semua sesi Streamlit."""
+    return UserReadCache(READ_CACHE_MAX_ENTRIES, READ_CACHE_TTL_SECONDS)
+
+def _cacheable_copy(value):
+    """Salinan nilai untuk cache; objek ORM disalin menjadi objek detached berisi kolom yang sudah dimuat.
+
+    Objek asli tetap milik session pemanggil (tidak di-expunge), sehingga identity map dan
+    perubahan yang belum di-flush di session itu tidak terganggu.
+    """
+    if isinstance(value, list):
+        return [_cacheable_copy(item) for item in value]
+    if isinstance(value, tuple):
+        items = [_cacheable_copy(item) for item in value]
+        return value._make(items) if hasattr(value, "_make") else tuple(items)
+    if isinstance(value, dict):
+        return {key: _cacheable_copy(item) for key, item in value.items()}
+    if isinstance(value, Base):
+        state = inspect(value)
+        copy = type(value)(**{
+            attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict
+        })
+        make_transient_to_detached(copy)
+        return copy
+    return value
+
+def cached_per_user(owner_of, daily=False):
+    """Dekorator cache baca; owner_of(db, *args) menentukan user pemilik data.
+
+    daily=True menambahkan tanggal hari ini ke kunci (untuk hasil yang bergantung pada hari ini).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(db, *args, **kwargs):
+            cache = get_read_cache()
+            user_id = owner_of(db, *args)
+            if user_id is None:
+                return func(db, *args, **kwargs)
+
+            key = (func.__name__, user_id, cache.version(user_id), args, tuple(sorted(kwargs.items())))
+            if daily:
+                key += (datetime.date.today(),)
+            found, value = cache.get(key)
+            if found:
+                return value
+
+            value = func(db, *args, **kwargs)
+            cache.put(key, _cacheable_copy(value))
+            return value
+        return wrapper
+    return decorator
+
+def _owner_from_arg(db, owner_id, *args):
+    return owner_id
+
+def _owner_from_motor(db, motor_id, *args):
+    return get_read_cache().motor_owner(db, motor_id)
+
+def invalidate_user_data(user_id):
+    """Dipanggil setelah commit setiap penulisan data milik user."""
+    if user_id is not None:
+        get_read_cache().bump(user_id)
+
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
@@ -182,40 +914,89 @@ def get_admin_count(db: Session):
     """Menghitung total pengguna yang berstatus admin."""
     return db.query(User).filter(User.is_admin == True).count()
 
-def create_new_user(db, username, email, password):
-    """Mendaftarkan pengguna baru ke database."""
-    hashed_password = generate_password_hash(password)
-    # Aturan Admin: Hanya user pertama yang otomatis jadi admin (Super Admin)
-    is_first_user = db.query(User).count() == 0
-
-    db_user = User(
-        username=username,
-        email=email,
-        password=hashed_password,
-        is_admin=is_first_user
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+def create_new_user(db, username, email, password, is_admin=None):
+    """Mendaftarkan pengguna baru ke database.
+
+    Jika is_admin tidak diberikan, hanya user pertama yang otomatis jadi admin.
+    """
+    hashed_password = hash_password(password)
+
+    with write_transaction(db):
+        if is_admin is None:
+            # Aturan Admin: Hanya user pertama yang otomatis jadi admin (Super Admin)
+            is_admin = db.query(User).count() == 0
+
+        db_user = User(
+            username=username,
+            email=email,
+            password=hashed_password,
+            is_admin=is_admin
+        )
+        db.add(db_user)
+        db.commit()
+        db.refresh(db_user)
     return db_user
 
-def delete_user_and_data(db: Session, user_id):
-    """Menghapus user dan SEMUA data motor, service, dan jadwal terkait."""
+@serialized_write
+def update_user_password_hash(db: Session, user_id, password_hash):
+    db.query(User).filter(User.id == user_id).update({User.password: password_hash}, synchronize_session=False)
+    db.commit()
 
-    motors = db.query(Motor).filter(Motor.owner_id == user_id).all()
-    for motor in motors:
-        db.query(Schedule).filter(Schedule.motor_id == motor.id).delete(synchronize_session=False)
-        db.query(Service).filter(Service.motor_id == motor.id).delete(synchronize_session=False)
+def authenticate_user(db: Session, email, password):
+    """Mengembalikan user jika email dan password cocok, selain itu None.
 
-    db.query(Motor).filter(Motor.owner_id == user_id).delete(synchronize_session=False)
+    Jika hash tersimpan memakai metode/cost lama, hash diperbarui setelah login berhasil.
+    """
+    user = get_user_by_email(db, email)
+    if user is None or not verify_password(user.password, password):
+        return None
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        db.delete(user)
-        db.commit()
-        return True
-    return False
+    if password_needs_rehash(user.password):
+        update_user_password_hash(db, user.id, hash_password(password))
+    return user
+
+def _delete_motors_where(db, motor_filter):
+    """Menghapus motor yang cocok beserta seluruh data turunannya dengan DELETE berbasis subquery.
+
+    Jumlah statement tetap (satu per tabel), berapa pun banyaknya motor. Kunjungan bengkel dari
+    service yang ikut terhapus dikurangi dari katalog dengan satu query berkelompok.
+    """
+    motor_ids = select(Motor.id).where(motor_filter)
+    _record_workshop_visits(db, {
+        (workshop_name, workshop_address): -count
+        for workshop_name, workshop_address, count in (
+            db.query(Service.workshop_name, Service.workshop_address, func.count())
+            .filter(Service.motor_id.in_(motor_ids))
+            .group_by(Service.workshop_name, Service.workshop_address)
+        )
+    })
+    for model in MOTOR_CHILD_MODELS:
+        db.query(model).filter(model.motor_id.in_(motor_ids)).delete(synchronize_session=False)
+    return db.query(Motor).filter(motor_filter).delete(synchronize_session=False)
+
+@serialized_write
+def delete_users_and_data(db: Session, user_ids):
+    """Menghapus banyak user sekaligus beserta SEMUA data motor, service, dan jadwalnya dalam satu transaksi."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+
+    _delete_motors_where(db, Motor.owner_id.in_(user_ids))
+    db.query(ReminderDigestLog).filter(ReminderDigestLog.owner_id.in_(user_ids)).delete(synchronize_session=False)
+    deleted = db.query(User).filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.commit()
+
+    cache = get_read_cache()
+    for user_id in user_ids:
+        invalidate_user_data(user_id)
+        cache.forget_motors(owner_id=user_id)
+    return deleted
+
+def delete_user_and_data(db: Session, user_id):
+    """Menghapus user dan SEMUA data motor, service, dan jadwal terkait."""
+    return delete_users_and_data(db, [user_id]) == 1
 
+@serialized_write
 def toggle_user_admin_status(db: Session, user_id):
     """Mengubah status is_admin seorang user."""
     user = db.query(User).filter(User.id == user_id).first()
@@ -225,10 +1006,49 @@ def toggle_user_admin_status(db: Session, user_id):
         return user.is_admin
     return None
 
+# --- DAFTAR USER UNTUK ADMIN (KEYSET PAGINATION) ---
+
+ADMIN_USERS_PAGE_SIZE = 25
+
+def _prefix_filter(column, prefix):
+    """Filter awalan sebagai rentang agar index kolom tetap dipakai (LIKE 'x%' tidak memakai index)."""
+    return and_(column >= prefix, column < prefix + "\U0010ffff")
+
+def get_users_page(db: Session, after_id=None, search=None, page_size=ADMIN_USERS_PAGE_SIZE):
+    """Mengambil satu halaman user urut ID, setelah after_id, dengan pencarian awalan username/email.
+
+    Mengembalikan (users, motor_counts per user id, after_id untuk halaman berikutnya atau None).
+    """
+    query = db.query(User)
+    if search:
+        query = query.filter(or_(_prefix_filter(User.username, search), _prefix_filter(User.email, search)))
+        if after_id is not None:
+            # "+ 0" mencegah SQLite memilih scan primary key; index username/email lebih selektif
+            query = query.filter(User.id + 0 > after_id)
+    elif after_id is not None:
+        query = query.filter(User.id > after_id)
+
+    users = query.order_by(User.id).limit(page_size + 1).all()
+    has_next_page = len(users) > page_size
+    users = users[:page_size]
+
+    motor_counts = {}
+    if users:
+        motor_counts = dict(
+            db.query(Motor.owner_id, func.count(Motor.id))
+            .filter(Motor.owner_id.in_([user.id for user in users]))
+            .group_by(Motor.owner_id)
+            .all()
+        )
+
+    return users, motor_counts, (users[-1].id if has_next_page else None)
+
+@cached_per_user(_owner_from_arg)
 def get_motors_by_owner(db, owner_id):
     return db.query(Motor).filter(Motor.owner_id == owner_id).all()
 
 # MODIFIED: Menambahkan plate_number
+@serialized_write
 def create_new_motor(db, owner_id, brand, model, year, current_km, plate_number):
     db_motor = Motor(
         owner_id=owner_id,
@@ -248,122 +1068,884 @@ def create_new_motor(db, owner_id, brand, model, year, current_km, plate_number)
         km_interval=2000
     )
     db.add(db_schedule)
+    db.add(MotorServiceStats(motor_id=db_motor.id, service_count=0, cost_sum=0))
+    refresh_due_status(db, [db_motor.id])
     db.commit()
     db.refresh(db_motor)
+    invalidate_user_data(owner_id)
 
     return db_motor
 
+def _parse_service_date(service_date):
+    """Mengubah string YYYY-MM-DD menjadi date; None jika formatnya tidak valid."""
+    try:
+        return datetime.datetime.strptime(service_date, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
 # MODIFIED: Menambahkan detail bengkel dan foto
-def create_new_service(db, motor_id, service_date, km_at_service, description, cost, workshop_name, workshop_address, workshop_photo_base64):
+def create_new_service(db, motor_id, service_date, km_at_service, description, cost, workshop_name, workshop_address, workshop_photo=None, workshop_photo_mime=None):
+    """Mencatat service baru; workshop_photo berupa bytes upload mentah.
+
+    Foto diproses dengan prepare_service_photo lalu foto dan thumbnail-nya disimpan
+    di penyimpanan foto.
+    """
+    photo_sha256 = photo_mime = photo_size = thumb_sha256 = None
+    if workshop_photo:
+        full_bytes, thumb_bytes, processed_mime = prepare_service_photo(workshop_photo)
+        photo_sha256, photo_mime, photo_size = store_photo_blob(full_bytes, processed_mime)
+        thumb_sha256, _, _ = store_photo_blob(thumb_bytes, processed_mime)
+
     db_service = Service(
         motor_id=motor_id,
         service_date=service_date,
+        service_on=_parse_service_date(service_date),
         km_at_service=km_at_service,
         description=description,
         cost=cost,
         workshop_name=workshop_name, # NEW
         workshop_address=workshop_address, # NEW
-        workshop_photo_base64=workshop_photo_base64 # NEW
+        workshop_photo_sha256=photo_sha256,
+        workshop_photo_mime=photo_mime,
+        workshop_photo_size=photo_size,
+        workshop_thumb_sha256=thumb_sha256
     )
-    db.add(db_service)
-    db.commit()
-    db.refresh(db_service)
+    # Foto diproses di luar giliran menulis; hanya bagian database yang diserialkan
+    with write_transaction(db):
+        db.add(db_service)
+        _apply_service_to_stats(db, db_service)
+        _apply_service_to_rollup(db, db_service)
+        _record_workshop_visits(db, {(workshop_name, workshop_address): 1})
+        refresh_due_status(db, [motor_id])
+        db.commit()
+        db.refresh(db_service)
+    invalidate_user_data(get_read_cache().motor_owner(db, motor_id))
     return db_service
 
+@serialized_write
 def update_motor_km(db, motor_id, new_km):
     motor = db.query(Motor).filter(Motor.id == motor_id).first()
     if motor and new_km > motor.current_km:
         motor.current_km = new_km
+        refresh_due_status(db, [motor_id])
         db.commit()
+        invalidate_user_data(motor.owner_id)
         return True
     return False
 
 def get_services_by_motor(db, motor_id):
     return db.query(Service).filter(Service.motor_id == motor_id).order_by(Service.service_date.desc()).all()
 
+# --- RIWAYAT SERVICE BERHALAMAN (KEYSET) ---
+
+SERVICE_HISTORY_PAGE_SIZE = 20
+
+def get_services_page(db, motor_id, cursor=None, page_size=SERVICE_HISTORY_PAGE_SIZE,
+                      date_from=None, date_to=None, cost_min=None, cost_max=None):
+    """Mengambil satu halaman riwayat service (terbaru dulu) dengan filter tanggal dan biaya.
+
+    cursor adalah (service_on, id) baris terakhir halaman sebelumnya. Mengembalikan
+    (services, cursor halaman berikutnya atau None). Service dengan tanggal tidak valid
+    (service_on NULL) tampil paling akhir.
+    """
+    query = db.query(Service).filter(Service.motor_id == motor_id)
+
+    if date_from is not None:
+        query = query.filter(Service.service_on >= date_from)
+    if date_to is not None:
+        query = query.filter(Service.service_on <= date_to)
+    if cost_min is not None:
+        query = query.filter(Service.cost >= cost_min)
+    if cost_max is not None:
+        query = query.filter(Service.cost <= cost_max)
+
+    if cursor is not None:
+        cursor_on, cursor_id = cursor
+        if cursor_on is None:
+            query = query.filter(Service.service_on.is_(None), Service.id < cursor_id)
+        else:
+            query = query.filter(or_(
+                Service.service_on < cursor_on,
+                and_(Service.service_on == cursor_on, Service.id < cursor_id),
+                Service.service_on.is_(None),
+            ))
+
+    services = (
+        query.order_by(Service.service_on.desc(), Service.id.desc())
+        .limit(page_size + 1)
+        .all()
+    )
+    if len(services) > page_size:
+        services = services[:page_size]
+        last = services[-1]
+        return services, (last.service_on, last.id)
+    return services, None
+
+@cached_per_user(_owner_from_motor)
 def get_total_service_cost(db, motor_id):
-    total_cost = db.query(Service).filter(Service.motor_id == motor_id).with_entities(Service.cost).all()
-    return sum(cost[0] for cost in total_cost)
+    stats = db.get(MotorServiceStats, motor_id)
+    return stats.cost_sum if stats else 0
 
+@cached_per_user(_owner_from_motor)
 def get_average_service_cost(db, motor_id):
-    costs = db.query(Service).filter(Service.motor_id == motor_id).with_entities(Service.cost).all()
-    if not costs:
+    stats = db.get(MotorServiceStats, motor_id)
+    if not stats or not stats.service_count:
         return 0
-    total_cost = sum(cost[0] for cost in costs)
-    num_services = len(costs)
-    return round(total_cost / num_services)
+    return round(stats.cost_sum / stats.service_count)
 
+@serialized_write
 def delete_motor(db, motor_id):
-    db.query(Schedule).filter(Schedule.motor_id == motor_id).delete(synchronize_session=False)
-    db.query(Service).filter(Service.motor_id == motor_id).delete(synchronize_session=False)
-    motor = db.query(Motor).filter(Motor.id == motor_id).first()
-    if motor:
-        db.delete(motor)
+    owner_id = db.query(Motor.owner_id).filter(Motor.id == motor_id).scalar()
+    if _delete_motors_where(db, Motor.id == motor_id):
         db.commit()
+        invalidate_user_data(owner_id)
+        get_read_cache().forget_motors(motor_ids=[motor_id])
         return True
+    db.rollback()
     return False
 
+@serialized_write
 def delete_service_record(db, service_id):
     service_record = db.query(Service).filter(Service.id == service_id).first()
     if service_record:
+        motor_id = service_record.motor_id
         db.delete(service_record)
+        _remove_service_from_stats(db, service_record)
+        _remove_service_from_rollup(db, service_record)
+        _record_workshop_visits(db, {(service_record.workshop_name, service_record.workshop_address): -1})
+        refresh_due_status(db, [motor_id])
         db.commit()
+        invalidate_user_data(get_read_cache().motor_owner(db, motor_id))
         return True
     return False
 
+@serialized_write
 def update_motor_schedule(db, motor_id, time_months, km_interval):
     schedule = db.query(Schedule).filter(Schedule.motor_id == motor_id).first()
     if schedule:
         schedule.time_interval_months = time_months
         schedule.km_interval = km_interval
+        refresh_due_status(db, [motor_id])
         db.commit()
+        invalidate_user_data(get_read_cache().motor_owner(db, motor_id))
         return True
     return False
 
+@cached_per_user(_owner_from_motor)
 def get_schedule_by_motor(db, motor_id):
     return db.query(Schedule).filter(Schedule.motor_id == motor_id).first()
 
+# --- AGREGAT SERVICE PER MOTOR ---
+
+def _apply_service_to_stats(db, service):
+    """Menambahkan satu service baru ke agregat motornya (dalam transaksi yang sama)."""
+    stats = db.get(MotorServiceStats, service.motor_id)
+    if stats is None:
+        stats = MotorServiceStats(motor_id=service.motor_id, service_count=0, cost_sum=0)
+        db.add(stats)
+
+    stats.service_count += 1
+    stats.cost_sum += service.cost or 0
+    if stats.last_service_date is None or service.service_date > stats.last_service_date:
+        stats.last_service_date = service.service_date
+    if service.km_at_service is not None and (stats.max_km_at_service is None or service.km_at_service > stats.max_km_at_service):
+        stats.max_km_at_service = service.km_at_service
+
+def _remove_service_from_stats(db, service):
+    """Mengurangi agregat motor untuk service yang dihapus (dalam transaksi yang sama)."""
+    stats = db.get(MotorServiceStats, service.motor_id)
+    if stats is None:
+        return
 
-def calculate_next_service_date(db, motor_id):
-    schedule = get_schedule_by_motor(db, motor_id)
-    interval_months = schedule.time_interval_months if schedule else 2
+    stats.service_count = max(stats.service_count - 1, 0)
+    stats.cost_sum -= service.cost or 0
 
-    last_service = db.query(Service).filter(Service.motor_id == motor_id).order_by(Service.service_date.desc()).first()
+    # Nilai maksimum hanya perlu dicari ulang jika service yang dihapus adalah pemegangnya
+    if service.service_date == stats.last_service_date or service.km_at_service == stats.max_km_at_service:
+        db.flush()
+        last_date, max_km = (
+            db.query(func.max(Service.service_date), func.max(Service.km_at_service))
+            .filter(Service.motor_id == service.motor_id)
+            .one()
+        )
+        stats.last_service_date = last_date
+        stats.max_km_at_service = max_km
+
+@serialized_write
+def rebuild_motor_service_stats(db, motor_ids=None, only_missing=False):
+    """Menghitung ulang agregat service per motor langsung dari tabel services.
+
+    Tanpa motor_ids semua motor dibangun ulang; only_missing hanya mengisi motor yang belum punya agregat.
+    """
+    source = (
+        select(
+            Motor.id,
+            func.count(Service.id),
+            func.coalesce(func.sum(Service.cost), 0),
+            func.max(Service.service_date),
+            func.max(Service.km_at_service),
+        )
+        .select_from(Motor)
+        .outerjoin(Service, Service.motor_id == Motor.id)
+        .group_by(Motor.id)
+    )
+    stale = db.query(MotorServiceStats)
 
-    if last_service:
-        last_date_str = last_service.service_date
+    if motor_ids is not None:
+        source = source.where(Motor.id.in_(motor_ids))
+        stale = stale.filter(MotorServiceStats.motor_id.in_(motor_ids))
+    if only_missing:
+        source = source.where(Motor.id.not_in(select(MotorServiceStats.motor_id)))
     else:
-        last_date_str = datetime.date.today().strftime("%Y-%m-%d")
+        stale.delete(synchronize_session=False)
 
+    result = db.execute(
+        insert(MotorServiceStats).from_select(
+            ["motor_id", "service_count", "cost_sum", "last_service_date", "max_km_at_service"],
+            source,
+        )
+    )
+    db.commit()
+    get_read_cache().bump_all()
+    return result.rowcount
+
+# --- ROLLUP BIAYA BULANAN (MOTOR x BULAN x BENGKEL) ---
+# Halaman analitik hanya membaca tabel service_cost_rollup; setiap penulisan service memperbarui
+# baris rollup yang terdampak dalam transaksi yang sama. Service tanpa tanggal valid tidak ikut.
+
+def _rollup_key(motor_id, service_on, workshop_name):
+    return (motor_id, service_on.replace(day=1), (workshop_name or "").strip(" "))
+
+def _add_to_rollup(db, key, count, cost_sum, min_km, max_km):
+    rollup = db.get(ServiceCostRollup, key)
+    if rollup is None:
+        rollup = ServiceCostRollup(motor_id=key[0], month=key[1], workshop=key[2], service_count=0, cost_sum=0)
+        db.add(rollup)
+    rollup.service_count += count
+    rollup.cost_sum += cost_sum
+    if min_km is not None and (rollup.min_km is None or min_km < rollup.min_km):
+        rollup.min_km = min_km
+    if max_km is not None and (rollup.max_km is None or max_km > rollup.max_km):
+        rollup.max_km = max_km
+
+def _apply_service_to_rollup(db, service):
+    """Menambahkan satu service baru ke rollup bulanannya (dalam transaksi yang sama)."""
+    if service.service_on is None:
+        return
+    key = _rollup_key(service.motor_id, service.service_on, service.workshop_name)
+    _add_to_rollup(db, key, 1, service.cost or 0, service.km_at_service, service.km_at_service)
+
+def _remove_service_from_rollup(db, service):
+    """Mengurangi rollup bulanan untuk service yang dihapus (dalam transaksi yang sama)."""
+    if service.service_on is None:
+        return
+    motor_id, month, workshop = key = _rollup_key(service.motor_id, service.service_on, service.workshop_name)
+    rollup = db.get(ServiceCostRollup, key)
+    if rollup is None:
+        return
+
+    rollup.service_count -= 1
+    rollup.cost_sum -= service.cost or 0
+    if rollup.service_count <= 0:
+        db.delete(rollup)
+        return
+
+    # KM minimum/maksimum hanya dicari ulang jika service yang dihapus adalah pemegangnya
+    if service.km_at_service is not None and service.km_at_service in (rollup.min_km, rollup.max_km):
+        db.flush()
+        next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+        rollup.min_km, rollup.max_km = (
+            db.query(func.min(Service.km_at_service), func.max(Service.km_at_service))
+            .filter(
+                Service.motor_id == motor_id,
+                Service.service_on >= month,
+                Service.service_on < next_month,
+                func.trim(func.coalesce(Service.workshop_name, "")) == workshop,
+            )
+            .one()
+        )
+
+def _apply_import_batch_to_rollup(db, batch):
+    """Menambahkan satu batch service impor ke rollup bulanannya (dalam transaksi yang sama)."""
+    totals = {}
+    for values in batch:
+        key = _rollup_key(values["motor_id"], values["service_on"], values["workshop_name"])
+        count, cost_sum, min_km, max_km = totals.get(key, (0, 0, None, None))
+        km = values["km_at_service"]
+        totals[key] = (count + 1, cost_sum + values["cost"], min(min_km or km, km), max(max_km or km, km))
+    for key, (count, cost_sum, min_km, max_km) in totals.items():
+        _add_to_rollup(db, key, count, cost_sum, min_km, max_km)
+
+@serialized_write
+def rebuild_cost_rollup(db, motor_ids=None):
+    """Menghitung ulang rollup biaya bulanan langsung dari tabel services (semua motor atau motor_ids)."""
+    workshop = func.trim(func.coalesce(Service.workshop_name, ""))
+    month = func.date(Service.service_on, "start of month")
+    source = (
+        select(
+            Service.motor_id,
+            month,
+            workshop,
+            func.count(Service.id),
+            func.coalesce(func.sum(Service.cost), 0),
+            func.min(Service.km_at_service),
+            func.max(Service.km_at_service),
+        )
+        .where(Service.service_on.is_not(None), Service.motor_id.in_(select(Motor.id)))
+        .group_by(Service.motor_id, month, workshop)
+    )
+    stale = db.query(ServiceCostRollup)
+    if motor_ids is not None:
+        source = source.where(Service.motor_id.in_(motor_ids))
+        stale = stale.filter(ServiceCostRollup.motor_id.in_(motor_ids))
+    stale.delete(synchronize_session=False)
+
+    result = db.execute(
+        insert(ServiceCostRollup).from_select(
+            ["motor_id", "month", "workshop", "service_count", "cost_sum", "min_km", "max_km"],
+            source,
+        )
+    )
+    db.commit()
+    get_read_cache().bump_all()
+    return result.rowcount
+
+# --- ANALITIK BIAYA PER USER (NUMPY) ---
+
+ANALYTICS_TREND_MONTHS = 12 # tren biaya dihitung dari sekian bulan terakhir
+
+@cached_per_user(_owner_from_arg)
+def get_cost_analytics(db, owner_id):
+    """Analitik biaya semua motor milik owner_id, dihitung dari service_cost_rollup.
+
+    Mengembalikan dict:
+      motors        : list (id, brand, model, plate_number) urut id; baris matriks mengikuti urutan ini
+      months        : array datetime64[M] dari bulan pertama sampai terakhir yang punya service
+      monthly_cost  : matriks biaya (motor x bulan)
+      yearly_cost   : dict tahun -> total biaya
+      total_cost, km_driven, cost_per_km (NaN jika KM tidak bertambah), trend_per_month : array per motor
+      workshops     : list (bengkel, jumlah service, total biaya) urut biaya terbesar
+    trend_per_month adalah kemiringan regresi linear biaya bulanan ANALYTICS_TREND_MONTHS bulan
+    terakhir (Rp per bulan); positif berarti biaya naik.
+    """
+    motors = (
+        db.query(Motor.id, Motor.brand, Motor.model, Motor.plate_number, func.coalesce(Motor.current_km, 0))
+        .filter(Motor.owner_id == owner_id)
+        .order_by(Motor.id)
+        .all()
+    )
+    motor_ids = np.array([motor[0] for motor in motors], dtype=np.int64)
+    current_km = np.array([motor[4] for motor in motors], dtype=np.float64)
+
+    owned_rollup = (
+        select(
+            ServiceCostRollup.motor_id,
+            func.julianday(ServiceCostRollup.month) - _UNIX_EPOCH_JULIANDAY,
+            ServiceCostRollup.cost_sum,
+            ServiceCostRollup.min_km,
+            ServiceCostRollup.max_km,
+        )
+        .join(Motor, Motor.id == ServiceCostRollup.motor_id)
+        .where(Motor.owner_id == owner_id)
+    )
+    columns = _fetch_float_columns(db, owned_rollup, 5, nullable=True)
+    row_motor = np.searchsorted(motor_ids, columns[:, 0].astype(np.int64))
+    row_month = columns[:, 1].astype(np.int64).astype("datetime64[D]").astype("datetime64[M]")
+    cost = columns[:, 2]
+
+    if len(columns):
+        months = np.arange(row_month.min(), row_month.max() + 1)
+    else:
+        months = np.array([], dtype="datetime64[M]")
+    row_column = (row_month - months[0]).astype(np.int64) if len(columns) else np.zeros(0, dtype=np.int64)
+
+    monthly_cost = np.zeros((len(motor_ids), len(months)))
+    np.add.at(monthly_cost, (row_motor, row_column), cost)
+    total_cost = monthly_cost.sum(axis=1)
+
+    # KM ditempuh: dari KM service terendah sampai KM tertinggi yang diketahui (odometer atau service)
+    min_km = np.full(len(motor_ids), np.inf)
+    max_km = current_km.copy()
+    known_km = ~np.isnan(columns[:, 3])
+    np.minimum.at(min_km, row_motor[known_km], columns[known_km, 3])
+    np.maximum.at(max_km, row_motor[known_km], columns[known_km, 4])
+    km_driven = np.where(np.isfinite(min_km), np.maximum(max_km - min_km, 0), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost_per_km = np.where(km_driven > 0, total_cost / km_driven, np.nan)
+
+    years = months.astype("datetime64[Y]").astype(np.int64) + 1970
+    year_values, year_index = np.unique(years, return_inverse=True)
+    yearly_totals = np.bincount(year_index, weights=monthly_cost.sum(axis=0), minlength=len(year_values))
+    yearly_cost = {int(year): float(total) for year, total in zip(year_values, yearly_totals)}
+
+    recent = monthly_cost[:, -ANALYTICS_TREND_MONTHS:]
+    x = np.arange(recent.shape[1], dtype=np.float64)
+    x -= x.mean() if len(x) else 0
+    x_variance = float(x @ x)
+    trend_per_month = recent @ x / x_variance if x_variance else np.zeros(len(motor_ids))
+
+    workshops = (
+        db.query(ServiceCostRollup.workshop, func.sum(ServiceCostRollup.service_count), func.sum(ServiceCostRollup.cost_sum))
+        .join(Motor, Motor.id == ServiceCostRollup.motor_id)
+        .filter(Motor.owner_id == owner_id)
+        .group_by(ServiceCostRollup.workshop)
+        .order_by(func.sum(ServiceCostRollup.cost_sum).desc())
+        .all()
+    )
+
+    return {
+        "motors": [tuple(motor[:4]) for motor in motors],
+        "months": months,
+        "monthly_cost": monthly_cost,
+        "yearly_cost": yearly_cost,
+        "total_cost": total_cost,
+        "km_driven": km_driven,
+        "cost_per_km": cost_per_km,
+        "trend_per_month": trend_per_month,
+        "workshops": [tuple(row) for row in workshops],
+    }
+
+# --- IMPOR RIWAYAT SERVICE MASSAL (CSV/XLSX) ---
+
+IMPORT_BATCH_SIZE = 5000 # baris per transaksi; satu giliran menulis per batch
+IMPORT_MAX_REPORTED_ERRORS = 1000 # error per baris yang disimpan di laporan (sisanya hanya dihitung)
+IMPORT_COLUMNS = ["plate_number", "service_date", "km_at_service", "description", "cost", "workshop_name", "workshop_address"]
+IMPORT_REQUIRED_COLUMNS = ["service_date", "km_at_service", "description"]
+
+def import_file_types():
+    """Jenis file yang bisa diimpor; XLSX hanya jika openpyxl (dependensi opsional) terpasang."""
+    return ["csv", "xlsx"] if importlib.util.find_spec("openpyxl") else ["csv"]
+
+def iter_import_rows(file, filename):
+    """Membaca file CSV/XLSX baris demi baris; menghasilkan (nomor_baris, dict kolom).
+
+    Nama kolom dinormalkan ke huruf kecil. Nomor baris mengikuti file (header = baris 1).
+    """
+    if filename.lower().endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook # dependensi opsional, hanya untuk impor XLSX
+        except ImportError:
+            raise ValueError("Impor XLSX membutuhkan paket openpyxl (pip install openpyxl). Gunakan CSV sebagai alternatif.")
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell or "").strip().lower() for cell in next(rows, ())]
+            for row_number, values in enumerate(rows, start=2):
+                if any(value not in (None, "") for value in values):
+                    yield row_number, dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        text_file = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text_file)
+        header = [column.strip().lower() for column in next(reader, [])]
+        for row_number, values in enumerate(reader, start=2):
+            if any(value.strip() for value in values):
+                yield row_number, dict(zip(header, values))
+
+# Angka bulat biasa atau dengan pemisah ribuan titik (150.000); koma desimal tidak diterima
+_IMPORT_INT_PATTERN = re.compile(r"^-?(?:\d+|\d{1,3}(?:\.\d{3})+)$")
+
+def _import_int(value, field, minimum):
+    """Angka bulat dari sel impor; nilai berdesimal ditolak, bukan dibulatkan atau digabung."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value) # sel angka XLSX seperti 150000.0
+    elif isinstance(value, str) and _IMPORT_INT_PATTERN.match(value.strip()):
+        value = value.strip().replace(".", "")
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{field} harus berupa angka bulat.")
     try:
-        last_date = datetime.datetime.strptime(last_date_str, "%Y-%m-%d").date()
+        number = int(value)
     except ValueError:
-        last_date = datetime.date.today()
+        raise ValueError(f"{field} harus berupa angka bulat.")
+    if number < minimum:
+        raise ValueError(f"{field} minimal {minimum}.")
+    return number
+
+def _import_text(value):
+    return str(value).strip() if value is not None else ""
+
+def _validate_import_row(row, motor_ids_by_plate, default_motor_id):
+    """Mengubah satu baris impor menjadi nilai kolom Service; ValueError jika tidak valid."""
+    plate = _import_text(row.get("plate_number")).upper().replace(" ", "")
+    if plate:
+        motor_id = motor_ids_by_plate.get(plate)
+        if motor_id is None:
+            raise ValueError(f"Nomor plat {plate} tidak ditemukan di motor Anda.")
+    elif default_motor_id is not None:
+        motor_id = default_motor_id
+    else:
+        raise ValueError("plate_number harus diisi.")
+
+    raw_date = row.get("service_date")
+    if isinstance(raw_date, datetime.datetime):
+        raw_date = raw_date.date()
+    service_on = raw_date if isinstance(raw_date, datetime.date) else _parse_service_date(_import_text(raw_date))
+    if service_on is None:
+        raise ValueError("service_date harus berformat YYYY-MM-DD.")
+
+    description = _import_text(row.get("description"))
+    if not description:
+        raise ValueError("description harus diisi.")
+
+    cost = row.get("cost")
+    return {
+        "motor_id": motor_id,
+        "service_date": service_on.strftime("%Y-%m-%d"),
+        "service_on": service_on,
+        "km_at_service": _import_int(row.get("km_at_service"), "km_at_service", 1),
+        "description": description,
+        "cost": _import_int(cost, "cost", 0) if _import_text(cost) else 0,
+        "workshop_name": _import_text(row.get("workshop_name"))[:100],
+        "workshop_address": _import_text(row.get("workshop_address")),
+    }
+
+def _apply_import_batch_to_stats(db, batch):
+    """Menambahkan satu batch service impor ke agregat motornya (dalam transaksi yang sama)."""
+    totals = {}
+    for values in batch:
+        count, cost_sum, last_date, max_km = totals.get(values["motor_id"], (0, 0, None, None))
+        totals[values["motor_id"]] = (
+            count + 1,
+            cost_sum + values["cost"],
+            max(last_date or "", values["service_date"]),
+            max(max_km or 0, values["km_at_service"]),
+        )
+
+    for motor_id, (count, cost_sum, last_date, max_km) in totals.items():
+        stats = db.get(MotorServiceStats, motor_id)
+        if stats is None:
+            stats = MotorServiceStats(motor_id=motor_id, service_count=0, cost_sum=0)
+            db.add(stats)
+        stats.service_count += count
+        stats.cost_sum += cost_sum
+        if stats.last_service_date is None or last_date > stats.last_service_date:
+            stats.last_service_date = last_date
+        if stats.max_km_at_service is None or max_km > stats.max_km_at_service:
+            stats.max_km_at_service = max_km
+
+def _insert_import_batch(db, batch, max_km_by_motor):
+    # executemany: satu statement INSERT untuk seluruh batch, agregat ikut di transaksi yang sama
+    with write_transaction(db):
+        db.execute(insert(Service), batch)
+        _apply_import_batch_to_stats(db, batch)
+        _apply_import_batch_to_rollup(db, batch)
+        _record_workshop_visits(db, Counter(
+            (values["workshop_name"], values["workshop_address"]) for values in batch
+        ))
+        refresh_due_status(db, {values["motor_id"] for values in batch})
+        db.commit()
+    for values in batch:
+        if values["km_at_service"] > max_km_by_motor.get(values["motor_id"], 0):
+            max_km_by_motor[values["motor_id"]] = values["km_at_service"]
+
+@serialized_write
+def _raise_motor_km(db, max_km_by_motor):
+    """Menaikkan current_km setiap motor ke KM service tertinggi hasil impor (sekali per motor)."""
+    updated = 0
+    for motor_id, km in max_km_by_motor.items():
+        updated += (
+            db.query(Motor)
+            .filter(Motor.id == motor_id, or_(Motor.current_km.is_(None), Motor.current_km < km))
+            .update({Motor.current_km: km}, synchronize_session=False)
+        )
+    refresh_due_status(db, max_km_by_motor)
+    db.commit()
+    return updated
+
+def import_services(db, owner_id, rows, default_motor_id=None, batch_size=IMPORT_BATCH_SIZE):
+    """Mengimpor riwayat service dari iterator (nomor_baris, dict) seperti iter_import_rows.
+
+    Baris dicocokkan ke motor milik owner_id lewat plate_number (atau default_motor_id jika
+    kolom itu kosong). Baris tidak valid dicatat di laporan tanpa menghentikan impor; baris
+    valid disimpan per batch_size baris per transaksi. Kilometer motor diperbarui sekali per
+    motor di akhir. Mengembalikan dict laporan: inserted, error_count, errors, motors_km_updated.
+    """
+    motors = db.query(Motor.id, Motor.plate_number).filter(Motor.owner_id == owner_id).all()
+    motor_ids_by_plate = {
+        (plate or "").upper().replace(" ", ""): motor_id for motor_id, plate in motors if plate
+    }
+    if default_motor_id is not None and default_motor_id not in {motor_id for motor_id, _ in motors}:
+        raise ValueError("Motor tujuan impor bukan milik pengguna ini.")
+
+    report = {"inserted": 0, "error_count": 0, "errors": [], "motors_km_updated": 0}
+    max_km_by_motor = {}
+    batch = []
+
+    def finish():
+        if max_km_by_motor:
+            report["motors_km_updated"] = _raise_motor_km(db, max_km_by_motor)
+        if report["inserted"]:
+            invalidate_user_data(owner_id)
+
+    try:
+        for row_number, row in rows:
+            try:
+                values = _validate_import_row(row, motor_ids_by_plate, default_motor_id)
+            except ValueError as exc:
+                report["error_count"] += 1
+                if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+                    report["errors"].append((row_number, str(exc)))
+                continue
+
+            batch.append(values)
+            if len(batch) >= batch_size:
+                _insert_import_batch(db, batch, max_km_by_motor)
+                report["inserted"] += len(batch)
+                batch = []
+        if batch:
+            _insert_import_batch(db, batch, max_km_by_motor)
+            report["inserted"] += len(batch)
+    except BaseException:
+        # Batch yang sudah tersimpan tetap konsisten meskipun file rusak di tengah jalan, tetapi
+        # kegagalan di sini tidak boleh menutupi error aslinya
+        try:
+            finish()
+        except Exception:
+            logger.exception("Gagal memperbarui kilometer motor setelah impor terhenti.")
+        raise
+    finish()
+    return report
+
+# --- EKSPOR DATA BERTAHAP (CSV/JSONL/PARQUET) ---
+
+EXPORT_CHUNK_SIZE = 1000 # baris per query; memori ekspor dibatasi oleh ukuran ini
+# st.download_button memuat seluruh arsip ke memori server, jadi unduhan lewat UI dibatasi.
+# Ekspor seluruh database dan ekspor dengan foto dijalankan lewat "python manage.py export".
+EXPORT_UI_MAX_BYTES = 50 * 1024 * 1024
+EXPORT_FORMATS = ["csv", "jsonl", "parquet"]
+EXPORT_TABLES = {
+    "motors": (Motor, ["id", "owner_id", "brand", "model", "year", "plate_number", "current_km"]),
+    "services": (Service, [
+        "id", "motor_id", "service_date", "service_on", "km_at_service", "description", "cost",
+        "workshop_name", "workshop_address", "workshop_photo_sha256", "workshop_photo_mime", "workshop_photo_size",
+    ]),
+    "schedules": (Schedule, ["id", "motor_id", "time_interval_months", "km_interval"]),
+}
+
+def iter_export_chunks(db, table_name, owner_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Membaca satu tabel ekspor per chunk_size baris (keyset pada id); menghasilkan list dict.
+
+    Hanya kolom di EXPORT_TABLES yang dibaca (tanpa objek ORM dan tanpa foto Base64 lama).
+    owner_id None berarti seluruh database (khusus admin).
+    """
+    model, columns = EXPORT_TABLES[table_name]
+    query = select(*[getattr(model, column) for column in columns])
+    if owner_id is not None:
+        if model is Motor:
+            query = query.where(Motor.owner_id == owner_id)
+        else:
+            query = query.where(model.motor_id.in_(select(Motor.id).where(Motor.owner_id == owner_id)))
+
+    last_id = 0
+    while True:
+        rows = db.execute(query.where(model.id > last_id).order_by(model.id).limit(chunk_size)).mappings().all()
+        if not rows:
+            return
+        yield [dict(row) for row in rows]
+        last_id = rows[-1]["id"]
+
+def _export_csv_lines(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def _export_jsonl_lines(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in chunk).encode("utf-8")
+
+def _write_export_parquet(out, chunks, model, columns):
+    try:
+        import pyarrow as pa # dependensi opsional, hanya untuk ekspor Parquet
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Ekspor Parquet membutuhkan paket pyarrow (pip install pyarrow).")
+
+    arrow_types = {Integer: pa.int64(), String: pa.string(), Date: pa.date32(), Boolean: pa.bool_()}
+    schema = pa.schema([(column, arrow_types[type(model.__table__.c[column].type)]) for column in columns])
+    # Satu row group per chunk, sehingga hanya satu chunk yang berada di memori
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+def _count_export_rows(chunks, counts, table_name, photos):
+    """Meneruskan chunk sambil menghitung baris dan mencatat foto yang dirujuk (sha256 -> mime)."""
+    for chunk in chunks:
+        counts[table_name] += len(chunk)
+        if photos is not None:
+            photos.update((row["workshop_photo_sha256"], row["workshop_photo_mime"]) for row in chunk if row["workshop_photo_sha256"])
+        yield chunk
+
+def write_export_archive(db, fileobj, owner_id=None, fmt="csv", include_photos=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Menulis arsip ZIP berisi motors, services, dan schedules dalam format fmt ke fileobj.
+
+    Data dibaca per chunk dan langsung ditulis ke arsip. Jika include_photos, foto service
+    ikut disalin dari penyimpanan foto sebagai file terpisah di folder photos/.
+    Mengembalikan dict jumlah baris per tabel (dan jumlah foto).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format ekspor harus salah satu dari: {', '.join(EXPORT_FORMATS)}.")
+
+    counts = {}
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+        for table_name, (model, columns) in EXPORT_TABLES.items():
+            counts[table_name] = 0
+            photos = {} if include_photos and table_name == "services" else None
+            chunks = _count_export_rows(iter_export_chunks(db, table_name, owner_id, chunk_size), counts, table_name, photos)
+            with archive.open(f"{table_name}.{fmt}", "w") as out:
+                if fmt == "parquet":
+                    _write_export_parquet(out, chunks, model, columns)
+                else:
+                    lines = _export_csv_lines(chunks, columns) if fmt == "csv" else _export_jsonl_lines(chunks)
+                    for data in lines:
+                        out.write(data)
+
+            # File foto disalin dari disk satu per satu; nama file = workshop_photo_sha256
+            for sha256, mime in sorted((photos or {}).items()):
+                path = photo_blob_path(sha256)
+                if os.path.exists(path):
+                    extension = ".png" if mime == "image/png" else ".jpg"
+                    archive.write(path, f"photos/{sha256}{extension}", compress_type=zipfile.ZIP_STORED)
+                    counts["photos"] = counts.get("photos", 0) + 1
+    return counts
+
+# --- MIGRASI & PERAWATAN PENYIMPANAN FOTO ---
+
+def migrate_photos_to_blob_store(db, batch_size=50):
+    """Memindahkan foto Base64 lama dari tabel services ke PHOTO_STORE_DIR secara bertahap.
+
+    Setiap batch dibaca, ditulis ke file, lalu kolom Base64-nya dikosongkan dan di-commit,
+    sehingga hanya satu batch yang berada di memori. Mengembalikan jumlah foto yang dipindahkan.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            text(
+                "SELECT id, workshop_photo_base64 FROM services "
+                "WHERE workshop_photo_base64 IS NOT NULL AND id > :last_id "
+                "ORDER BY id LIMIT :batch_size"
+            ),
+            {"last_id": last_id, "batch_size": batch_size},
+        ).all()
+        if not rows:
+            break
+
+        for service_id, photo_base64 in rows:
+            photo_sha256, photo_mime, photo_size = store_photo_blob(base64.b64decode(photo_base64))
+            db.execute(
+                text(
+                    "UPDATE services SET workshop_photo_sha256 = :sha, workshop_photo_mime = :mime, "
+                    "workshop_photo_size = :size, workshop_photo_base64 = NULL WHERE id = :id"
+                ),
+                {"sha": photo_sha256, "mime": photo_mime, "size": photo_size, "id": service_id},
+            )
+            last_id = service_id
+        db.commit()
+        migrated += len(rows)
+
+    return migrated
+
+def backfill_photo_thumbnails(db, batch_size=50):
+    """Membuat thumbnail untuk foto lama (hasil migrasi) yang belum memilikinya."""
+    created = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(Service.id, Service.workshop_photo_sha256)
+            .filter(Service.workshop_photo_sha256.isnot(None), Service.workshop_thumb_sha256.is_(None), Service.id > last_id)
+            .order_by(Service.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        for service_id, photo_sha256 in rows:
+            last_id = service_id
+            try:
+                _, thumb_bytes, mime = prepare_service_photo(read_photo_blob(photo_sha256))
+            except (OSError, UnidentifiedImageError):
+                continue
+            thumb_sha256, _, _ = store_photo_blob(thumb_bytes, mime)
+            db.query(Service).filter(Service.id == service_id).update(
+                {Service.workshop_thumb_sha256: thumb_sha256}, synchronize_session=False
+            )
+            created += 1
+        db.commit()
+
+    return created
+
+def remove_orphan_photo_blobs(db):
+    """Menghapus file di PHOTO_STORE_DIR yang tidak lagi dirujuk oleh service mana pun."""
+    referenced = set()
+    for column in (Service.workshop_photo_sha256, Service.workshop_thumb_sha256):
+        referenced.update(sha for (sha,) in db.query(column).filter(column.isnot(None)).distinct())
+    removed = 0
+    if not os.path.isdir(PHOTO_STORE_DIR):
+        return removed
 
-    year = last_date.year
-    month = last_date.month + interval_months
+    for prefix in os.listdir(PHOTO_STORE_DIR):
+        prefix_dir = os.path.join(PHOTO_STORE_DIR, prefix)
+        for name in os.listdir(prefix_dir):
+            if name not in referenced:
+                os.remove(os.path.join(prefix_dir, name))
+                removed += 1
+    return removed
+
+
+def _add_months_clamped(base_date, months):
+    """Menambah sejumlah bulan ke tanggal, tanggal dipotong ke akhir bulan tujuan."""
+    year = base_date.year
+    month = base_date.month + months
 
     while month > 12:
         month -= 12
         year += 1
 
-    day = min(last_date.day, 28 if month == 2 else 30 if month in [4, 6, 9, 11] else 31)
+    day = min(base_date.day, 28 if month == 2 else 30 if month in [4, 6, 9, 11] else 31)
+
+    return datetime.date(year, month, day)
 
-    next_date = datetime.date(year, month, day)
+def _next_service_date_from(last_date_str, interval_months, today=None):
+    """Menghitung tanggal service berikutnya dari tanggal service terakhir (string) atau None."""
+    today = today or datetime.date.today()
 
-    if not last_service and next_date <= datetime.date.today():
-         today = datetime.date.today()
+    if last_date_str is None:
+        base_date = today
+    else:
+        try:
+            base_date = datetime.datetime.strptime(last_date_str, "%Y-%m-%d").date()
+        except ValueError:
+            base_date = today
+
+    next_date = _add_months_clamped(base_date, interval_months)
 
-         year = today.year
-         month = today.month + interval_months
-         while month > 12:
-            month -= 12
-            year += 1
-         day = min(today.day, 28 if month == 2 else 30 if month in [4, 6, 9, 11] else 31)
-         next_date = datetime.date(year, month, day)
+    if last_date_str is None and next_date <= today:
+        next_date = _add_months_clamped(today, interval_months)
 
     return next_date
 
+def _next_service_km_from(last_km, has_service, km_interval, current_km):
+    """Menghitung KM service berikutnya dari KM service tertinggi atau KM motor saat ini."""
+    if not has_service:
+        return (current_km or 0) + km_interval
+    return (last_km or 0) + km_interval
+
+def calculate_next_service_date(db, motor_id):
+    schedule = get_schedule_by_motor(db, motor_id)
+    interval_months = schedule.time_interval_months if schedule else 2
+
+    last_service = db.query(Service).filter(Service.motor_id == motor_id).order_by(Service.service_date.desc()).first()
+
+    return _next_service_date_from(last_service.service_date if last_service else None, interval_months)
+
 def calculate_next_service_km(db, motor_id):
     schedule = get_schedule_by_motor(db, motor_id)
     km_interval = schedule.km_interval if schedule else 2000
@@ -374,36 +1956,1227 @@ def calculate_next_service_km(db, motor_id):
     last_service = db.query(Service).filter(Service.motor_id == motor_id).order_by(Service.km_at_service.desc()).first()
     last_km = last_service.km_at_service if last_service else 0
 
-    next_km = last_km + km_interval
+    return _next_service_km_from(last_km, last_service is not None, km_interval, current_km)
 
-    if not last_service:
-        next_km = current_km + km_interval
+# --- MESIN PENGINGAT (SATU QUERY UNTUK SEMUA MOTOR) ---
 
-    return next_km
-# =======================================================================
+REMINDER_DUE_SOON_DAYS = 14
+REMINDER_DUE_SOON_KM = 500
 
+def _reminder_status(days_left, km_left):
+    """Status pengingat: 'overdue', 'due_soon', atau 'ok'."""
+    if days_left <= 0 or km_left <= 0:
+        return "overdue"
+    if days_left <= REMINDER_DUE_SOON_DAYS or km_left <= REMINDER_DUE_SOON_KM:
+        return "due_soon"
+    return "ok"
 
-# ====================================================================
-# 3. FUNGSI EKSTERNAL (API)
-# ====================================================================
+def _compute_due(current_km, interval_months, km_interval, last_date, last_km, service_count, today):
+    """Menghitung (next_date, next_km, status) satu motor dari jadwal dan agregat servicenya."""
+    has_service = bool(service_count)
+    next_date = _next_service_date_from(
+        last_date if has_service else None,
+        interval_months if interval_months is not None else 2,
+        today,
+    )
+    next_km = _next_service_km_from(
+        last_km,
+        has_service,
+        km_interval if km_interval is not None else 2000,
+        current_km,
+    )
+    status = _reminder_status((next_date - today).days, next_km - (current_km or 0))
+    return next_date, next_km, status
+
+# --- STATUS JATUH TEMPO TERMATERIALISASI (TABEL due_status) ---
+
+DUE_STATUS_CHUNK_SIZE = 5000 # motor per transaksi pada penyegaran massal
+
+def refresh_due_status(db, motor_ids, today=None):
+    """Menghitung ulang baris due_status untuk motor tertentu di dalam transaksi pemanggil.
+
+    Tidak melakukan commit; dipanggil setiap penulisan yang mengubah KM motor, service, atau jadwal.
+    """
+    today = today or datetime.date.today()
+    motor_ids = list(motor_ids)
+    if not motor_ids:
+        return 0
+
+    db.flush()
+    rows = (
+        db.query(
+            Motor.id,
+            Motor.current_km,
+            Schedule.time_interval_months,
+            Schedule.km_interval,
+            MotorServiceStats.last_service_date,
+            MotorServiceStats.max_km_at_service,
+            MotorServiceStats.service_count,
+        )
+        .outerjoin(Schedule, Schedule.motor_id == Motor.id)
+        .outerjoin(MotorServiceStats, MotorServiceStats.motor_id == Motor.id)
+        .filter(Motor.id.in_(motor_ids))
+        .all()
+    )
+    values = []
+    for motor_id, current_km, interval_months, km_interval, last_date, last_km, service_count in rows:
+        next_date, next_km, status = _compute_due(current_km, interval_months, km_interval, last_date, last_km, service_count, today)
+        values.append({"motor_id": motor_id, "next_date": next_date, "next_km": next_km, "status": status, "computed_on": today})
 
-def search_nearby_workshops(api_key, location_query, radius=5000):
-    """Mencari bengkel motor/mobil terdekat menggunakan Google Places API. (Simulasi)"""
+    db.query(MotorDueStatus).filter(MotorDueStatus.motor_id.in_(motor_ids)).delete(synchronize_session=False)
+    if values:
+        db.execute(insert(MotorDueStatus), values)
+    return len(values)
 
-    if "jakarta" in location_query.lower():
-        lat, lng = -6.175110, 106.865036
-    elif "surabaya" in location_query.lower():
-        lat, lng = -7.257472, 112.752090
+def refresh_all_due_status(db, today=None, only_stale=True, chunk_size=DUE_STATUS_CHUNK_SIZE):
+    """Penyegaran massal due_status (job harian): status berbasis tanggal bergulir ke hari ini.
+
+    only_stale hanya memproses motor yang barisnya belum ada atau dihitung sebelum hari ini.
+    Setiap chunk_size motor diproses dalam satu transaksi. Mengembalikan jumlah motor.
+    """
+    today = today or datetime.date.today()
+    query = select(Motor.id).order_by(Motor.id).limit(chunk_size)
+    if only_stale:
+        query = query.outerjoin(MotorDueStatus, MotorDueStatus.motor_id == Motor.id).where(
+            or_(MotorDueStatus.motor_id.is_(None), MotorDueStatus.computed_on != today)
+        )
+
+    refreshed = 0
+    last_id = 0
+    while True:
+        motor_ids = db.execute(query.where(Motor.id > last_id)).scalars().all()
+        if not motor_ids:
+            break
+        with write_transaction(db):
+            refreshed += refresh_due_status(db, motor_ids, today)
+            db.commit()
+        last_id = motor_ids[-1]
+
+    if refreshed:
+        get_read_cache().bump_all()
+    return refreshed
+
+def _query_due_reminders(db, owner_id):
+    return (
+        db.query(
+            Motor,
+            MotorDueStatus.next_date,
+            MotorDueStatus.next_km,
+            MotorDueStatus.status,
+            MotorDueStatus.computed_on,
+            Schedule.time_interval_months,
+            Schedule.km_interval,
+            MotorServiceStats.last_service_date,
+            MotorServiceStats.max_km_at_service,
+            MotorServiceStats.service_count,
+            MotorServiceStats.cost_sum,
+        )
+        .outerjoin(MotorDueStatus, MotorDueStatus.motor_id == Motor.id)
+        .outerjoin(Schedule, Schedule.motor_id == Motor.id)
+        .outerjoin(MotorServiceStats, MotorServiceStats.motor_id == Motor.id)
+        .filter(Motor.owner_id == owner_id)
+        .order_by(Motor.id)
+        .all()
+    )
+
+@cached_per_user(_owner_from_arg, daily=True)
+def get_service_reminders(db, owner_id, today=None):
+    """Membaca jatuh tempo service semua motor milik owner dari tabel due_status dalam satu query.
+
+    Baris yang belum ada atau basi (job harian belum berjalan) dihitung ulang di memori dengan
+    _compute_due tanpa menulis; penyimpanannya diserahkan ke job refresh-due-status, sehingga
+    pembaca tidak pernah menunggu giliran menulis.
+    Setiap item juga membawa total biaya dan tanggal service terakhir untuk tampilan armada.
+    """
+    today = today or datetime.date.today()
+
+    reminders = []
+    for (motor, next_date, next_km, status, computed_on, interval_months, km_interval,
+         last_date, last_km, service_count, cost_sum) in _query_due_reminders(db, owner_id):
+        if computed_on != today:
+            next_date, next_km, status = _compute_due(
+                motor.current_km, interval_months, km_interval, last_date, last_km, service_count, today
+            )
+        reminders.append({
+            "motor": motor,
+            "next_date": next_date,
+            "next_km": next_km,
+            "days_left": (next_date - today).days,
+            "km_left": next_km - (motor.current_km or 0),
+            "status": status,
+            "last_service_date": last_date if service_count else None,
+            "total_cost": cost_sum or 0,
+        })
+
+    return reminders
+
+# --- PRAKIRAAN JATUH TEMPO ARMADA (NUMPY) ---
+
+FORECAST_MIN_SERVICES = 2 # titik riwayat minimal untuk memperkirakan km/hari
+_UNIX_EPOCH_JULIANDAY = 2440587.5
+
+def _split_days(days):
+    """Memecah array datetime64[D] menjadi array (tahun, bulan, tanggal)."""
+    months = days.astype("datetime64[M]")
+    year = months.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months).astype(np.int64) + 1
+    return year, month, day
+
+def add_months_clamped_array(base_days, months):
+    """Versi vektor _add_months_clamped untuk array datetime64[D] (Februari tetap 28 hari)."""
+    year, month, day = _split_days(base_days)
+    total_months = (year - 1970) * 12 + (month - 1) + months
+    target_month = total_months % 12 + 1
+    month_length = np.where(target_month == 2, 28, np.where(np.isin(target_month, [4, 6, 9, 11]), 30, 31))
+    return total_months.astype("datetime64[M]").astype("datetime64[D]") + (np.minimum(day, month_length) - 1)
+
+def forecast_due_arrays(current_km, interval_months, km_interval, has_service, last_day, last_km,
+                        history_index, history_day, history_km, today):
+    """Prakiraan jatuh tempo seluruh armada sekaligus; semua argumen array per motor kecuali history_*.
+
+    last_day berupa datetime64[D] (NaT jika tanggal service terakhir tidak valid). history_index
+    menunjuk posisi motor untuk setiap titik riwayat (history_day dalam hari sejak epoch, history_km).
+    km/hari adalah kemiringan regresi linear KM terhadap tanggal per motor; km_due adalah tanggal
+    garis itu mencapai next_km. Mengembalikan dict array: km_per_day, next_km, calendar_due,
+    km_due (NaT jika tidak dapat diperkirakan), dan predicted_due (yang paling awal dari keduanya).
+    """
+    count = len(current_km)
+    today_day = np.datetime64(today, "D")
+
+    # Kalender: sama dengan _next_service_date_from
+    base_day = np.where(has_service & ~np.isnat(last_day), last_day, today_day)
+    calendar_due = add_months_clamped_array(base_day, interval_months)
+    retry = ~has_service & (calendar_due <= today_day)
+    if retry.any():
+        calendar_due[retry] = add_months_clamped_array(np.full(retry.sum(), today_day), interval_months[retry])
+
+    next_km = np.where(has_service, last_km, current_km) + km_interval
+
+    # Regresi per motor dengan jumlah terkelompok (bincount); x dipusatkan ke hari ini agar presisi terjaga
+    x = history_day - (today_day - np.datetime64("1970-01-01", "D")).astype(np.float64)
+    n = np.bincount(history_index, minlength=count).astype(np.float64)
+    sum_x = np.bincount(history_index, weights=x, minlength=count)
+    sum_y = np.bincount(history_index, weights=history_km, minlength=count)
+    sum_xx = np.bincount(history_index, weights=x * x, minlength=count)
+    sum_xy = np.bincount(history_index, weights=x * history_km, minlength=count)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominator = n * sum_xx - sum_x ** 2
+        slope = (n * sum_xy - sum_x * sum_y) / denominator
+        usable = (n >= FORECAST_MIN_SERVICES) & (denominator > 0) & (slope > 0)
+        km_per_day = np.where(usable, slope, np.nan)
+        days_until = (sum_x / n) + (next_km - sum_y / n) / km_per_day
+
+    km_due = np.full(count, np.datetime64("NaT"), dtype="datetime64[D]")
+    km_due[usable] = today_day + np.ceil(days_until[usable]).astype(np.int64)
+    # Odometer yang sudah melewati next_km berarti jatuh tempo paling lambat hari ini
+    passed = current_km >= next_km
+    km_due[passed] = np.where(np.isnat(km_due[passed]), today_day, np.minimum(km_due[passed], today_day))
+
+    predicted_due = np.where(np.isnat(km_due), calendar_due, np.minimum(calendar_due, km_due))
+    return {
+        "km_per_day": km_per_day,
+        "next_km": next_km,
+        "calendar_due": calendar_due,
+        "km_due": km_due,
+        "predicted_due": predicted_due,
+    }
+
+def _fetch_float_columns(db, query, width, nullable=False):
+    """Menjalankan query dan mengembalikan hasilnya sebagai array float (baris x width).
+
+    Kolom harus numerik: tuple dibaca langsung dari kursor DBAPI (tanpa objek Row) lalu
+    diratakan dengan np.fromiter, jauh lebih cepat daripada np.array(list_of_rows).
+    nullable=True mengubah NULL menjadi NaN (sedikit lebih lambat).
+    """
+    rows = db.connection().execute(query).cursor.fetchall()
+    values = itertools.chain.from_iterable(rows)
+    if nullable:
+        values = (np.nan if value is None else value for value in values)
+    return np.fromiter(values, dtype=np.float64, count=len(rows) * width).reshape(-1, width)
+
+@cached_per_user(_owner_from_arg, daily=True)
+def forecast_fleet(db, owner_id, today=None):
+    """Memuat jadwal, agregat, dan riwayat KM motor milik owner_id (None = semua motor) ke array
+    NumPy lalu menjalankan forecast_due_arrays. Hasil berisi array motor_id terurut plus kolom prakiraan.
+    """
+    today = today or datetime.date.today()
+    motor_query = (
+        select(
+            Motor.id,
+            func.coalesce(Motor.current_km, 0),
+            func.coalesce(Schedule.time_interval_months, 2),
+            func.coalesce(Schedule.km_interval, 2000),
+            func.coalesce(MotorServiceStats.service_count, 0),
+            func.julianday(MotorServiceStats.last_service_date) - _UNIX_EPOCH_JULIANDAY,
+            func.coalesce(MotorServiceStats.max_km_at_service, 0),
+        )
+        .outerjoin(Schedule, Schedule.motor_id == Motor.id)
+        .outerjoin(MotorServiceStats, MotorServiceStats.motor_id == Motor.id)
+        .order_by(Motor.id)
+    )
+    history_query = (
+        select(
+            Service.motor_id,
+            func.julianday(Service.service_on) - _UNIX_EPOCH_JULIANDAY,
+            Service.km_at_service,
+        )
+        .where(Service.service_on.is_not(None), Service.km_at_service.is_not(None))
+    )
+    if owner_id is not None:
+        motor_query = motor_query.where(Motor.owner_id == owner_id)
+        history_query = history_query.where(Service.motor_id.in_(select(Motor.id).where(Motor.owner_id == owner_id)))
+
+    motor_columns = _fetch_float_columns(db, motor_query, 7, nullable=True)
+    motor_ids = motor_columns[:, 0].astype(np.int64)
+    # julianday() bernilai NULL (NaN) untuk tanggal tidak valid; motor itu memakai hari ini sebagai dasar
+    last_day = np.full(len(motor_ids), np.datetime64("NaT"), dtype="datetime64[D]")
+    valid_day = ~np.isnan(motor_columns[:, 5])
+    last_day[valid_day] = motor_columns[valid_day, 5].astype(np.int64).astype("datetime64[D]")
+
+    history_columns = _fetch_float_columns(db, history_query, 3)
+    history_motor_ids = history_columns[:, 0].astype(np.int64)
+    history_index = np.minimum(np.searchsorted(motor_ids, history_motor_ids), max(len(motor_ids) - 1, 0))
+    # Riwayat tanpa motor (yatim) diabaikan
+    known = (motor_ids[history_index] == history_motor_ids) if len(motor_ids) else np.zeros(len(history_motor_ids), dtype=bool)
+    history_columns, history_index = history_columns[known], history_index[known]
+
+    result = forecast_due_arrays(
+        current_km=motor_columns[:, 1],
+        interval_months=motor_columns[:, 2].astype(np.int64),
+        km_interval=motor_columns[:, 3],
+        has_service=motor_columns[:, 4] > 0,
+        last_day=last_day,
+        last_km=motor_columns[:, 6],
+        history_index=history_index,
+        history_day=history_columns[:, 1],
+        history_km=history_columns[:, 2],
+        today=today,
+    )
+    result["motor_id"] = motor_ids
+    return result
+
+# --- OUTBOX EMAIL ---
+
+@serialized_write
+def enqueue_email(db, recipient_email, subject, body):
+    """Memasukkan email ke antrean outbox; pengiriman dilakukan oleh worker latar belakang."""
+    message = _new_outbox_message(recipient_email, subject, body, datetime.datetime.now())
+    db.add(message)
+    db.commit()
+    return message.id
+
+def _new_outbox_message(recipient_email, subject, body, now):
+    return EmailOutbox(
+        recipient=recipient_email,
+        subject=subject,
+        body=body,
+        status="pending",
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now,
+    )
+
+def _outbox_retry_delay(attempts):
+    return datetime.timedelta(seconds=OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+@serialized_write
+def _claim_outbox_batch(db, batch_size, now):
+    """Mengklaim sampai batch_size email jatuh tempo untuk pengirim ini dan mengembalikannya.
+
+    Klaim yang sudah habis dikembalikan ke pending dulu. UPDATE klaim adalah satu statement di
+    bawah kunci tulis SQLite, jadi dua pengirim (worker dan manage.py) tidak pernah mengklaim
+    baris yang sama.
+    """
+    db.query(EmailOutbox).filter(
+        EmailOutbox.status == "sending", EmailOutbox.next_attempt_at <= now
+    ).update({"status": "pending", "claim_token": None}, synchronize_session=False)
+
+    token = os.urandom(16).hex()
+    due_ids = (
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(batch_size)
+    )
+    db.query(EmailOutbox).filter(EmailOutbox.id.in_(due_ids)).update(
+        {
+            "status": "sending",
+            "claim_token": token,
+            "next_attempt_at": now + datetime.timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+    messages = (
+        db.query(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.body, EmailOutbox.attempts)
+        .filter(EmailOutbox.claim_token == token)
+        .order_by(EmailOutbox.id)
+        .all()
+    )
+    return token, messages
+
+def deliver_pending_emails(db, batch_size=OUTBOX_BATCH_SIZE, now=None):
+    """Mengirim satu batch email outbox yang jatuh tempo melalui satu koneksi SMTP.
+
+    Batch diklaim dulu (status sending) di giliran menulis; hanya email yang diklaim proses ini
+    yang dikirim. Pengiriman (jaringan) dilakukan di luar giliran menulis; status hasilnya
+    dicatat sekaligus setelahnya. Mengembalikan (jumlah terkirim, jumlah gagal).
+    """
+    now = now or datetime.datetime.now()
+    token, messages = _claim_outbox_batch(db, batch_size, now)
+    if not messages:
+        return 0, 0
+
+    results = {}
+    try:
+        server = open_smtp_connection()
+    except (OSError, smtplib.SMTPException) as e:
+        results = {message.id: repr(e) for message in messages}
     else:
-        lat, lng = -6.175110, 106.865036
+        with server:
+            for message in messages:
+                try:
+                    server.send_message(build_email_message(message.recipient, message.subject, message.body))
+                    results[message.id] = None
+                except smtplib.SMTPServerDisconnected as e:
+                    # Koneksi putus: sisa batch dicoba lagi pada putaran berikutnya
+                    for remaining in messages:
+                        results.setdefault(remaining.id, repr(e))
+                    break
+                except (OSError, smtplib.SMTPException) as e:
+                    results[message.id] = repr(e)
+
+    attempts_by_id = {message.id: message.attempts for message in messages}
+    finished_at = datetime.datetime.now()
+    with write_transaction(db):
+        for message_id, error in results.items():
+            attempts = attempts_by_id[message_id] + 1
+            if error is None:
+                values = {"status": "sent", "attempts": attempts, "sent_at": finished_at, "last_error": None}
+            elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                values = {"status": "failed", "attempts": attempts, "last_error": error}
+            else:
+                values = {
+                    "status": "pending", "attempts": attempts, "last_error": error,
+                    "next_attempt_at": finished_at + _outbox_retry_delay(attempts),
+                }
+            values["claim_token"] = None
+            # Hanya baris yang masih diklaim oleh batch ini yang diperbarui
+            db.query(EmailOutbox).filter(
+                EmailOutbox.id == message_id, EmailOutbox.claim_token == token
+            ).update(values, synchronize_session=False)
+        db.commit()
 
-    simulated_results = [
-        {"name": "Bengkel Ahli Motor (Simulasi)", "address": "Jl. Merdeka No. 12, Jakarta", "rating": 4.5},
-        {"name": "Service Cepat Jaya (Simulasi)", "address": "Jl. Sudirman Kav. 5, Jakarta", "rating": 4.1},
-        {"name": "Ganti Oli 24 Jam (Simulasi)", "address": "Jl. MH Thamrin, Jakarta", "rating": 4.7},
-    ]
+    sent = sum(error is None for error in results.values())
+    return sent, len(results) - sent
+
+class EmailOutboxWorker:
+    """Thread latar belakang yang mengosongkan outbox secara berkala atau saat dibangunkan."""
+
+    def __init__(self, session_factory, poll_seconds=OUTBOX_POLL_SECONDS):
+        self._session_factory = session_factory
+        self._poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="motocare-email-outbox", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Membangunkan worker setelah email baru diantrekan."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Menghentikan worker setelah putaran yang sedang berjalan selesai."""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self._poll_seconds)
+            self._wake.clear()
+            try:
+                with self._session_factory() as db:
+                    # Lanjutkan selama batch penuh terkirim; sisanya menunggu jadwal percobaan ulang
+                    while deliver_pending_emails(db)[0] == OUTBOX_BATCH_SIZE:
+                        pass
+            except Exception:
+                logger.exception("Worker outbox email gagal memproses antrean.")
+
+@st.cache_resource
+def get_email_outbox_worker():
+    """Satu worker outbox per proses."""
+    return EmailOutboxWorker(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+# --- DIGEST PENGINGAT SERVICE (JOB BATCH) ---
+
+def _iter_digest_owner_chunks(db, today, statuses, chunk_size):
+    """Menghasilkan per chunk daftar (owner_id, username, email, [motor]) untuk pemilik yang punya
+    motor dengan status di statuses dan belum menerima digest hari ini. Keyset pada owner_id.
+    """
+    already_sent = select(ReminderDigestLog.owner_id).where(ReminderDigestLog.digest_date == today)
+    last_owner_id = 0
+    while True:
+        owner_ids = db.execute(
+            select(Motor.owner_id)
+            .join(MotorDueStatus, MotorDueStatus.motor_id == Motor.id)
+            .where(
+                MotorDueStatus.status.in_(statuses),
+                Motor.owner_id > last_owner_id,
+                Motor.owner_id.not_in(already_sent),
+            )
+            .group_by(Motor.owner_id)
+            .order_by(Motor.owner_id)
+            .limit(chunk_size)
+        ).scalars().all()
+        if not owner_ids:
+            return
+
+        rows = db.execute(
+            select(
+                User.id, User.username, User.email,
+                Motor.brand, Motor.model, Motor.plate_number,
+                MotorDueStatus.next_date, MotorDueStatus.next_km,
+            )
+            .join(Motor, Motor.owner_id == User.id)
+            .join(MotorDueStatus, MotorDueStatus.motor_id == Motor.id)
+            .where(User.id.in_(owner_ids), MotorDueStatus.status.in_(statuses))
+            .order_by(User.id, MotorDueStatus.next_date, Motor.id)
+        ).all()
+
+        groups = []
+        for row in rows:
+            if not groups or groups[-1][0] != row.id:
+                groups.append((row.id, row.username, row.email, []))
+            groups[-1][3].append({
+                "brand": row.brand, "model": row.model, "plate_number": row.plate_number,
+                "next_date": row.next_date, "next_km": row.next_km,
+            })
+        yield groups
+        last_owner_id = owner_ids[-1]
+
+def queue_reminder_digests(db, today=None, statuses=DIGEST_STATUSES, chunk_size=DIGEST_OWNER_CHUNK, workers=DIGEST_RENDER_WORKERS):
+    """Job batch: memasukkan satu email digest per pemilik motor yang jatuh tempo ke outbox.
+
+    Status dibaca dari due_status (baris basi disegarkan dulu secara massal). Email dirender
+    di thread pool, lalu setiap chunk dicatat di outbox dan reminder_digest_log dalam satu
+    transaksi, sehingga menjalankan ulang job di hari yang sama tidak mengirim ganda.
+    Mengembalikan jumlah digest yang diantrekan.
+    """
+    today = today or datetime.date.today()
+    refresh_all_due_status(db, today)
+
+    queued = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="motocare-digest") as pool:
+        for groups in _iter_digest_owner_chunks(db, today, statuses, chunk_size):
+            rendered = list(pool.map(build_reminder_digest_email, [g[1] for g in groups], [g[3] for g in groups]))
+            now = datetime.datetime.now()
+            with write_transaction(db):
+                # Job lain (cron dan manual bersamaan) bisa sudah mengantrekan pemilik ini sejak chunk dibaca
+                already_logged = set(db.execute(
+                    select(ReminderDigestLog.owner_id).where(
+                        ReminderDigestLog.digest_date == today,
+                        ReminderDigestLog.owner_id.in_([g[0] for g in groups]),
+                    )
+                ).scalars())
+                for (owner_id, _, email, motors), (subject, body) in zip(groups, rendered):
+                    if owner_id in already_logged:
+                        continue
+                    message = _new_outbox_message(email, subject, body, now)
+                    db.add(message)
+                    db.flush()
+                    db.add(ReminderDigestLog(
+                        owner_id=owner_id, digest_date=today, motor_count=len(motors),
+                        outbox_id=message.id, created_at=now,
+                    ))
+                    queued += 1
+                db.commit()
+    return queued
+
+# --- PENCARIAN TEKS PENUH RIWAYAT SERVICE (FTS5) ---
+# service_fts adalah index FTS5 external-content atas view service_fts_source: teks tidak disalin,
+# hanya index-nya. Kolom owner_tag ('u' + owner_id) membatasi pencarian ke motor milik satu user
+# lewat irisan doclist, bukan scan. Trigger di tabel services menjaga index tetap sinkron untuk
+# semua jalur tulis (form, impor massal, hapus berbasis subquery).
+
+SERVICE_SEARCH_PAGE_SIZE = 20
+SERVICE_SEARCH_MAX_RESULTS = 500 # urutan hasil dibekukan sebanyak ini saat halaman pertama dibuka
+SERVICE_SEARCH_WEIGHTS = (10.0, 5.0, 2.0, 0.0) # bm25: description, workshop_name, workshop_address, owner_tag
+SERVICE_SEARCH_MIN_PREFIX = 3 # kata terakhir dicari sebagai awalan jika minimal sepanjang ini
+SERVICE_FTS_DDL = [
+    "CREATE VIEW IF NOT EXISTS service_fts_source AS "
+    "SELECT s.id AS id, s.description AS description, s.workshop_name AS workshop_name, "
+    "s.workshop_address AS workshop_address, 'u' || m.owner_id AS owner_tag "
+    "FROM services s JOIN motors m ON m.id = s.motor_id",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS service_fts USING fts5("
+    "description, workshop_name, workshop_address, owner_tag, "
+    "content='service_fts_source', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    # Nilai 'delete' harus sama persis dengan yang diindeks; pemilik dibaca dari motors, jadi
+    # service harus dihapus sebelum motornya (lihat MOTOR_CHILD_MODELS)
+    "CREATE TRIGGER IF NOT EXISTS service_fts_insert AFTER INSERT ON services BEGIN "
+    "INSERT INTO service_fts (rowid, description, workshop_name, workshop_address, owner_tag) "
+    "VALUES (new.id, new.description, new.workshop_name, new.workshop_address, "
+    "(SELECT 'u' || owner_id FROM motors WHERE id = new.motor_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS service_fts_delete AFTER DELETE ON services BEGIN "
+    "INSERT INTO service_fts (service_fts, rowid, description, workshop_name, workshop_address, owner_tag) "
+    "VALUES ('delete', old.id, old.description, old.workshop_name, old.workshop_address, "
+    "(SELECT 'u' || owner_id FROM motors WHERE id = old.motor_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS service_fts_update "
+    "AFTER UPDATE OF description, workshop_name, workshop_address, motor_id ON services BEGIN "
+    "INSERT INTO service_fts (service_fts, rowid, description, workshop_name, workshop_address, owner_tag) "
+    "VALUES ('delete', old.id, old.description, old.workshop_name, old.workshop_address, "
+    "(SELECT 'u' || owner_id FROM motors WHERE id = old.motor_id)); "
+    "INSERT INTO service_fts (rowid, description, workshop_name, workshop_address, owner_tag) "
+    "VALUES (new.id, new.description, new.workshop_name, new.workshop_address, "
+    "(SELECT 'u' || owner_id FROM motors WHERE id = new.motor_id)); END",
+]
+
+def _create_service_fts(conn):
+    for statement in SERVICE_FTS_DDL:
+        conn.execute(text(statement))
+
+def rebuild_service_fts(bind):
+    """Membangun ulang index FTS5 dari tabel services (setelah perubahan di luar trigger)."""
+    with bind.begin() as conn:
+        conn.execute(text("INSERT INTO service_fts (service_fts) VALUES ('rebuild')"))
+
+def _service_search_expression(owner_id, query):
+    """Ekspresi MATCH FTS5 dari teks bebas; None jika tidak ada kata yang bisa dicari.
+
+    Setiap kata dikutip (operator FTS5 di input tidak berlaku) dan semua kata harus ada.
+    """
+    terms = re.findall(r"\w+", (query or "").lower())
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= SERVICE_SEARCH_MIN_PREFIX:
+        phrases[-1] += "*"
+    return f'owner_tag : "u{int(owner_id)}" AND {{description workshop_name workshop_address}} : ({" ".join(phrases)})'
+
+def search_services(db, owner_id, query, cursor=None, page_size=SERVICE_SEARCH_PAGE_SIZE):
+    """Mencari service di semua motor milik owner_id berdasarkan deskripsi dan nama/alamat bengkel.
+
+    Hasil diurutkan menurut relevansi bm25 (deskripsi paling berbobot). Skor bm25 berubah setiap
+    kali index ditulis, jadi tidak bisa dipakai sebagai keyset: halaman pertama menyimpan urutan
+    id hasil (maksimal SERVICE_SEARCH_MAX_RESULTS) di cursor, dan halaman berikutnya membaca
+    potongan urutan itu. Service yang dihapus atau tidak cocok lagi dilewati; service baru muncul
+    setelah pencarian diulang. Mengembalikan (list dict, cursor berikutnya atau None).
+    """
+    expression = _service_search_expression(owner_id, query)
+    if expression is None:
+        return [], None
+
+    weights = ", ".join(str(weight) for weight in SERVICE_SEARCH_WEIGHTS)
+    if cursor is None:
+        ranked_ids = tuple(db.execute(
+            text(
+                "SELECT rowid FROM service_fts WHERE service_fts MATCH :expression "
+                f"ORDER BY bm25(service_fts, {weights}), rowid LIMIT :limit"
+            ),
+            {"expression": expression, "limit": SERVICE_SEARCH_MAX_RESULTS},
+        ).scalars())
+        offset = 0
+    else:
+        ranked_ids, offset = cursor
+
+    page_ids = ranked_ids[offset:offset + page_size]
+    if not page_ids:
+        return [], None
+    rows = db.execute(
+        text(
+            "SELECT f.id, f.score, s.motor_id, s.service_date, s.km_at_service, s.description, s.cost, "
+            "s.workshop_name, s.workshop_address, m.brand, m.model, m.plate_number "
+            f"FROM (SELECT rowid AS id, bm25(service_fts, {weights}) AS score "
+            "FROM service_fts WHERE service_fts MATCH :expression AND rowid IN :ids) f "
+            "JOIN services s ON s.id = f.id JOIN motors m ON m.id = s.motor_id"
+        ).bindparams(bindparam("ids", expanding=True)),
+        {"expression": expression, "ids": list(page_ids)},
+    ).mappings().all()
+
+    position = {service_id: index for index, service_id in enumerate(page_ids)}
+    results = sorted((dict(row) for row in rows), key=lambda row: position[row["id"]])
+    next_offset = offset + page_size
+    return results, ((ranked_ids, next_offset) if next_offset < len(ranked_ids) else None)
+
+# --- KATALOG BENGKEL & INDEX SPASIAL (R*TREE) ---
+# Bengkel disimpan di tabel workshops; workshop_rtree menyimpan kotak (titik) lat/lng per bengkel
+# sehingga pencarian radius hanya membaca bengkel di dalam kotak pembatas, bukan seluruh katalog.
+
+WORKSHOP_DATASET_PATH = "workshops.csv" # katalog bawaan: name, address, city, lat, lng, rating
+WORKSHOP_DEFAULT_RADIUS_M = 5000
+WORKSHOP_MAX_RESULTS = 50
+WORKSHOP_RANK_BUCKET_M = 500 # dalam selisih jarak sekelas ini, bengkel dengan rating lebih tinggi didahulukan
+WORKSHOP_NEAREST_MAX_RADIUS_M = 50000 # batas perluasan pencarian k-terdekat
+EARTH_RADIUS_M = 6371008.8
+# Titik pusat kota/wilayah untuk pencarian teks dan untuk memetakan bengkel dari alamat di riwayat service
+WORKSHOP_PLACES = {
+    "jakarta": (-6.175110, 106.865036),
+    "jakarta pusat": (-6.186500, 106.834100),
+    "jakarta selatan": (-6.261500, 106.810600),
+    "jakarta barat": (-6.168300, 106.758900),
+    "jakarta timur": (-6.225000, 106.900400),
+    "jakarta utara": (-6.138400, 106.863600),
+    "surabaya": (-7.257472, 112.752090),
+    "bandung": (-6.917500, 107.619100),
+    "semarang": (-6.966700, 110.416700),
+    "yogyakarta": (-7.795600, 110.369500),
+    "jogja": (-7.795600, 110.369500),
+    "medan": (3.595200, 98.672200),
+    "makassar": (-5.147700, 119.432700),
+    "denpasar": (-8.670500, 115.212600),
+    "malang": (-7.966600, 112.632600),
+    "bogor": (-6.597100, 106.806000),
+    "depok": (-6.402500, 106.794200),
+    "tangerang": (-6.178300, 106.631900),
+    "bekasi": (-6.238300, 106.975600),
+    "palembang": (-2.976100, 104.775400),
+    "surakarta": (-7.575500, 110.824300),
+    "solo": (-7.575500, 110.824300),
+    "balikpapan": (-1.237900, 116.852900),
+    "pekanbaru": (0.507100, 101.447800),
+    "padang": (-0.947100, 100.417200),
+    "manado": (1.474800, 124.842100),
+    "pontianak": (-0.026300, 109.342500),
+}
+_COORDINATE_PATTERN = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,;]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+def _normalize_place_text(value):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (value or "").lower()).split())
+
+def _find_place(value):
+    """Nama WORKSHOP_PLACES terpanjang yang disebut di teks (sebagai kata utuh), atau None."""
+    padded = f" {_normalize_place_text(value)} "
+    matches = [name for name in WORKSHOP_PLACES if f" {name} " in padded]
+    return max(matches, key=len) if matches else None
+
+def geocode_location(location_query):
+    """Mengubah teks lokasi menjadi (lat, lng).
+
+    Menerima koordinat "lat, lng" atau nama kota/wilayah di WORKSHOP_PLACES; None jika tidak dikenali.
+    """
+    match = _COORDINATE_PATTERN.match(location_query or "")
+    if match:
+        lat, lng = float(match.group(1)), float(match.group(2))
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            return lat, lng
+        return None
+    place = _find_place(location_query)
+    return WORKSHOP_PLACES[place] if place else None
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def _workshops_in_box(db, lat, lng, radius_m):
+    """Bengkel di dalam kotak pembatas lingkaran radius_m (lewat R*Tree), masing-masing dengan distance_m."""
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    d_lng = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    rows = db.execute(
+        text(
+            "SELECT w.id, w.name, w.address, w.city, w.lat, w.lng, w.rating, w.source, w.visit_count "
+            "FROM workshop_rtree r JOIN workshops w ON w.id = r.id "
+            "WHERE r.min_lat <= :max_lat AND r.max_lat >= :min_lat "
+            "AND r.min_lng <= :max_lng AND r.max_lng >= :min_lng"
+        ),
+        {"min_lat": lat - d_lat, "max_lat": lat + d_lat, "min_lng": lng - d_lng, "max_lng": lng + d_lng},
+    ).mappings().all()
+    workshops = []
+    for row in rows:
+        workshop = dict(row)
+        workshop["distance_m"] = _haversine_m(lat, lng, row["lat"], row["lng"])
+        workshops.append(workshop)
+    return workshops
+
+def _workshop_rank_key(workshop):
+    return (int(workshop["distance_m"] // WORKSHOP_RANK_BUCKET_M), -(workshop["rating"] or 0), workshop["distance_m"])
+
+def find_workshops_within(db, lat, lng, radius_m=WORKSHOP_DEFAULT_RADIUS_M, limit=WORKSHOP_MAX_RESULTS):
+    """Bengkel dalam radius_m meter dari (lat, lng), diurutkan per kelas jarak lalu rating.
+
+    Kotak pembatas dibaca dari R*Tree; jarak sebenarnya (haversine) menyaring sudut kotak.
+    """
+    workshops = [w for w in _workshops_in_box(db, lat, lng, radius_m) if w["distance_m"] <= radius_m]
+    workshops.sort(key=_workshop_rank_key)
+    return workshops[:limit]
 
-    return simulated_results
+def find_nearest_workshops(db, lat, lng, k=5, max_radius_m=WORKSHOP_NEAREST_MAX_RADIUS_M):
+    """k bengkel terdekat dari (lat, lng) dalam max_radius_m, urut jarak.
+
+    Radius pencarian digandakan mulai 1 km sampai k bengkel ditemukan di dalam lingkarannya;
+    bengkel di luar lingkaran belum tentu lebih dekat daripada yang belum terbaca.
+    """
+    radius_m = min(1000, max_radius_m)
+    while True:
+        workshops = [w for w in _workshops_in_box(db, lat, lng, radius_m) if w["distance_m"] <= radius_m]
+        if len(workshops) >= k or radius_m >= max_radius_m:
+            workshops.sort(key=lambda w: w["distance_m"])
+            return workshops[:k]
+        radius_m = min(radius_m * 2, max_radius_m)
+
+def _read_workshop_dataset(dataset_path):
+    with open(dataset_path, encoding="utf-8-sig", newline="") as file:
+        for row in csv.DictReader(file):
+            yield {
+                "name": row["name"].strip(),
+                "name_key": _normalize_place_text(row["name"]),
+                "address": row["address"].strip(),
+                "city": row["city"].strip(),
+                "lat": float(row["lat"]),
+                "lng": float(row["lng"]),
+                "rating": float(row["rating"]) if row.get("rating") else None,
+                "source": "katalog",
+                "visit_count": 0,
+            }
+
+def _create_workshop_rtree(conn):
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS workshop_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+    ))
+
+def _record_workshop_visits(db, visits):
+    """Memperbarui katalog bengkel untuk service yang dicatat/dihapus (dalam transaksi pemanggil).
+
+    visits: dict (workshop_name, workshop_address) -> selisih jumlah service (negatif saat dihapus).
+    Aturannya sama dengan rebuild_workshop_index: bengkel katalog hanya menambah visit_count,
+    bengkel riwayat baru ditempatkan di titik pusat kota/wilayahnya dan masuk ke workshop_rtree,
+    dan bengkel riwayat yang tidak punya service lagi dikeluarkan dari katalog.
+    """
+    for (name, address), delta in visits.items():
+        key = _normalize_place_text(name)
+        if not key or not delta:
+            continue
+        catalog_entry = (
+            db.query(Workshop)
+            .filter(Workshop.name_key == key, Workshop.source == "katalog")
+            .order_by(Workshop.id.desc())
+            .first()
+        )
+        if catalog_entry is not None:
+            catalog_entry.visit_count = max(catalog_entry.visit_count + delta, 0)
+            continue
+
+        place = _find_place(address) or _find_place(name)
+        if place is None:
+            continue
+        entry = (
+            db.query(Workshop)
+            .filter(Workshop.name_key == key, Workshop.source == "riwayat", Workshop.city == place.title())
+            .first()
+        )
+        if entry is None:
+            if delta < 0:
+                continue
+            lat, lng = WORKSHOP_PLACES[place]
+            entry = Workshop(
+                name=name.strip(), name_key=key, address=(address or "").strip(), city=place.title(),
+                lat=lat, lng=lng, rating=None, source="riwayat", visit_count=0,
+            )
+            db.add(entry)
+            db.flush()
+            db.execute(
+                text("INSERT INTO workshop_rtree (id, min_lat, max_lat, min_lng, max_lng) VALUES (:id, :lat, :lat, :lng, :lng)"),
+                {"id": entry.id, "lat": lat, "lng": lng},
+            )
+        entry.visit_count += delta
+        if entry.visit_count <= 0:
+            db.execute(text("DELETE FROM workshop_rtree WHERE id = :id"), {"id": entry.id})
+            db.delete(entry)
+
+@serialized_write
+def rebuild_workshop_index(db, dataset_path=WORKSHOP_DATASET_PATH):
+    """Membangun ulang katalog bengkel dan index R*Tree-nya dalam satu transaksi.
+
+    Isi katalog: dataset bawaan (jika dataset_path ada) ditambah bengkel yang dicatat pengguna
+    di riwayat service. Bengkel riwayat yang namanya sudah ada di katalog hanya menambah
+    visit_count; sisanya ditempatkan di titik pusat kota/wilayah yang disebut di alamat atau
+    namanya (bengkel tanpa lokasi yang dikenali dilewati). Mengembalikan jumlah bengkel per sumber.
+    """
+    entries = {}
+    if dataset_path and os.path.exists(dataset_path):
+        for entry in _read_workshop_dataset(dataset_path):
+            entries[_normalize_place_text(entry["name"])] = entry
+
+    history = (
+        db.query(Service.workshop_name, Service.workshop_address, func.count())
+        .filter(Service.workshop_name.isnot(None), Service.workshop_name != "")
+        .group_by(Service.workshop_name, Service.workshop_address)
+        .all()
+    )
+    for name, address, count in history:
+        key = _normalize_place_text(name)
+        if key in entries and entries[key]["source"] == "katalog":
+            entries[key]["visit_count"] += count
+            continue
+        place = _find_place(address) or _find_place(name)
+        if place is None:
+            continue
+        entry = entries.setdefault((key, place), {
+            "name": name.strip(), "name_key": key, "address": (address or "").strip(), "city": place.title(),
+            "lat": WORKSHOP_PLACES[place][0], "lng": WORKSHOP_PLACES[place][1],
+            "rating": None, "source": "riwayat", "visit_count": 0,
+        })
+        entry["visit_count"] += count
+
+    db.execute(text("DELETE FROM workshop_rtree"))
+    db.query(Workshop).delete(synchronize_session=False)
+    if entries:
+        db.execute(insert(Workshop), list(entries.values()))
+    db.execute(text(
+        "INSERT INTO workshop_rtree (id, min_lat, max_lat, min_lng, max_lng) "
+        "SELECT id, lat, lat, lng, lng FROM workshops"
+    ))
+    db.commit()
+
+    counts = {"katalog": 0, "riwayat": 0}
+    for entry in entries.values():
+        counts[entry["source"]] += 1
+    return counts
+
+# --- MIGRASI SKEMA BERVERSI ---
+# Setiap langkah dijalankan sekali dan dicatat di tabel schema_migrations.
+# Langkah harus idempoten: database baru sudah dibuat lengkap oleh langkah 1.
+
+def _add_missing_columns(conn, model):
+    """Menambahkan kolom model yang belum ada di tabel lama (create_all tidak mengubah tabel)."""
+    existing = {col["name"] for col in inspect(conn).get_columns(model.__tablename__)}
+    for column in model.__table__.columns:
+        if column.name not in existing:
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} {col_type}"))
+
+def _create_model_indexes(conn, model, index_names):
+    for index in model.__table__.indexes:
+        if index.name in index_names:
+            index.create(conn, checkfirst=True)
+
+def _migration_base_tables(conn):
+    Base.metadata.create_all(bind=conn)
+
+def _migration_service_photo_columns(conn):
+    _add_missing_columns(conn, Service)
+
+def _migration_backfill_service_stats(conn):
+    with Session(bind=conn) as db:
+        rebuild_motor_service_stats(db, only_missing=True)
+
+def _migration_owner_and_admin_indexes(conn):
+    _create_model_indexes(conn, Motor, {"ix_motors_owner_id"})
+    _create_model_indexes(conn, User, {"ix_users_is_admin"})
+
+def _migration_service_history_indexes(conn):
+    _create_model_indexes(conn, Service, {"ix_services_motor_date", "ix_services_motor_km"})
+
+def _migration_email_outbox(conn):
+    EmailOutbox.__table__.create(conn, checkfirst=True)
+
+def _migration_email_outbox_claim(conn):
+    _add_missing_columns(conn, EmailOutbox)
+
+def _migration_due_status(conn):
+    MotorDueStatus.__table__.create(conn, checkfirst=True)
+    with Session(bind=conn) as db:
+        refresh_all_due_status(db)
+
+def _migration_reminder_digest_log(conn):
+    ReminderDigestLog.__table__.create(conn, checkfirst=True)
+
+def _migration_workshop_index(conn):
+    Workshop.__table__.create(conn, checkfirst=True)
+    _create_workshop_rtree(conn)
+    with Session(bind=conn) as db:
+        rebuild_workshop_index(db)
+
+def _migration_service_fts(conn):
+    _create_service_fts(conn)
+    conn.execute(text("INSERT INTO service_fts (service_fts) VALUES ('rebuild')"))
+
+def _migration_service_cost_rollup(conn):
+    ServiceCostRollup.__table__.create(conn, checkfirst=True)
+    with Session(bind=conn) as db:
+        rebuild_cost_rollup(db)
+
+def _migration_workshop_name_key(conn):
+    _add_missing_columns(conn, Workshop)
+    _create_model_indexes(conn, Workshop, {"ix_workshops_name_key"})
+    with Session(bind=conn) as db:
+        rebuild_workshop_index(db)
+
+def _migration_service_date_column(conn):
+    _add_missing_columns(conn, Service)
+    # date() mengembalikan NULL untuk string yang bukan tanggal valid
+    conn.execute(text("UPDATE services SET service_on = date(service_date) WHERE service_on IS NULL"))
+    _create_model_indexes(conn, Service, {"ix_services_motor_day"})
+
+MIGRATIONS = [
+    (1, "base_tables", _migration_base_tables),
+    (2, "service_photo_columns", _migration_service_photo_columns),
+    (3, "backfill_service_stats", _migration_backfill_service_stats),
+    (4, "owner_and_admin_indexes", _migration_owner_and_admin_indexes),
+    (5, "service_history_indexes", _migration_service_history_indexes),
+    (6, "service_date_column", _migration_service_date_column),
+    (7, "email_outbox", _migration_email_outbox),
+    (8, "due_status", _migration_due_status),
+    (9, "reminder_digest_log", _migration_reminder_digest_log),
+    (10, "workshop_index", _migration_workshop_index),
+    (11, "service_fts", _migration_service_fts),
+    (12, "service_cost_rollup", _migration_service_cost_rollup),
+    (13, "workshop_name_key", _migration_workshop_name_key),
+    (14, "email_outbox_claim", _migration_email_outbox_claim),
+]
+
+def _ensure_migration_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"
+    ))
+
+def get_schema_version(bind):
+    """Versi skema tertinggi yang sudah diterapkan (0 jika belum ada)."""
+    with bind.begin() as conn:
+        _ensure_migration_table(conn)
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+def run_migrations(bind, target_version=None):
+    """Menjalankan langkah migrasi yang belum diterapkan secara berurutan.
+
+    Mengembalikan daftar (versi, nama) yang baru diterapkan.
+    """
+    applied = []
+    current_version = get_schema_version(bind)
+    for version, name, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+        if target_version is not None and version > target_version:
+            break
+        with bind.begin() as conn:
+            step(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.datetime.now().isoformat(timespec="seconds")},
+            )
+        applied.append((version, name))
+    return applied
+
+@st.cache_resource
+def _run_migrations_once():
+    """Migrasi cukup dicek sekali per proses, bukan di setiap rerun.
+
+    Hanya dipanggil dari main() (jalur Streamlit); manage.py dan benchmarks.py memanggil
+    run_migrations sendiri agar import app tidak pernah mengubah skema.
+    """
+    return run_migrations(engine)
+
+# =======================================================================
+
+
+# ====================================================================
+# 3. FUNGSI EKSTERNAL (API)
+# ====================================================================
+
+# --- KLIEN PENCARIAN BENGKEL (HTTP) ---
+# Satu session HTTP berpool per proses. Hasil dicache per (koordinat dibulatkan, radius) di memori
+# (TTL + LRU) dan opsional di file SQLite agar tetap ada setelah restart. Permintaan identik yang
+# sedang berjalan digabung: hanya satu yang benar-benar memanggil backend.
+WORKSHOP_API_URL = os.environ.get("MOTOCARE_PLACES_URL", "https://maps.googleapis.com/maps/api/place/nearbysearch/json")
+WORKSHOP_API_KEY = os.environ.get("MOTOCARE_PLACES_API_KEY", "")
+WORKSHOP_API_TIMEOUT = (3.05, 10) # detik (connect, read)
+WORKSHOP_API_POOL_SIZE = 10
+WORKSHOP_API_RETRIES = 2 # hanya untuk GET yang gagal koneksi atau mendapat 502/503/504
+WORKSHOP_CACHE_TTL_SECONDS = 6 * 3600
+WORKSHOP_CACHE_MAX_ENTRIES = 1024
+WORKSHOP_CACHE_COORD_DECIMALS = 3 # ~110 m; pencarian dari titik berdekatan memakai entri cache yang sama
+WORKSHOP_DISK_CACHE_PATH = os.environ.get("MOTOCARE_PLACES_CACHE", "workshop_cache.db") # kosongkan untuk menonaktifkan
+
+class WorkshopLookupError(RuntimeError):
+    """Backend pencarian bengkel menolak permintaan atau membalas dengan format yang tidak dikenal."""
+
+class WorkshopLookupClient:
+    """Klien pencarian bengkel dengan session berpool, cache TTL+LRU, cache disk, dan penggabungan permintaan."""
+
+    def __init__(self, base_url=WORKSHOP_API_URL, timeout=WORKSHOP_API_TIMEOUT, pool_size=WORKSHOP_API_POOL_SIZE,
+                 ttl_seconds=WORKSHOP_CACHE_TTL_SECONDS, max_entries=WORKSHOP_CACHE_MAX_ENTRIES,
+                 disk_cache_path=WORKSHOP_DISK_CACHE_PATH):
+        self._base_url = base_url
+        self._timeout = timeout
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=WORKSHOP_API_RETRIES, backoff_factor=0.3,
+                              status_forcelist=[502, 503, 504], allowed_methods=["GET"]),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.requests = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+
+        self._disk = None
+        self._disk_lock = threading.Lock()
+        if disk_cache_path:
+            self._disk = sqlite3.connect(disk_cache_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS workshop_lookup_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            self._disk.commit()
+
+    @staticmethod
+    def cache_key(lat, lng, radius_m):
+        return (round(lat, WORKSHOP_CACHE_COORD_DECIMALS), round(lng, WORKSHOP_CACHE_COORD_DECIMALS), int(radius_m))
+
+    def _memory_get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        return None
+
+    def _memory_put(self, key, value):
+        self._entries[key] = (time.monotonic() + self._ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self._disk is None:
+            return None
+        with self._disk_lock:
+            row = self._disk.execute(
+                "SELECT payload FROM workshop_lookup_cache WHERE key = ? AND expires_at > ?",
+                (json.dumps(key), time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _disk_put(self, key, value):
+        if self._disk is None:
+            return
+        with self._disk_lock:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO workshop_lookup_cache (key, expires_at, payload) VALUES (?, ?, ?)",
+                (json.dumps(key), time.time() + self._ttl_seconds, json.dumps(value)),
+            )
+            self._disk.execute("DELETE FROM workshop_lookup_cache WHERE expires_at <= ?", (time.time(),))
+            self._disk.commit()
+
+    def _fetch(self, api_key, key):
+        """Satu panggilan ke backend (format Google Places Nearby Search)."""
+        lat, lng, radius_m = key
+        with self._lock:
+            self.requests += 1
+        response = self._session.get(
+            self._base_url,
+            params={"location": f"{lat},{lng}", "radius": radius_m, "type": "car_repair", "keyword": "bengkel motor", "key": api_key},
+            timeout=self._timeout,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        status = payload.get("status", "OK")
+        if status == "ZERO_RESULTS":
+            return []
+        if status != "OK":
+            raise WorkshopLookupError(payload.get("error_message") or f"Backend pencarian bengkel membalas status {status}.")
+        try:
+            return [
+                {
+                    "name": place["name"],
+                    "address": place.get("vicinity") or place.get("formatted_address") or "",
+                    "lat": place["geometry"]["location"]["lat"],
+                    "lng": place["geometry"]["location"]["lng"],
+                    "rating": place.get("rating"),
+                }
+                for place in payload.get("results", [])
+            ]
+        except (KeyError, TypeError):
+            raise WorkshopLookupError("Format balasan backend pencarian bengkel tidak dikenal.")
+
+    def lookup(self, api_key, lat, lng, radius_m):
+        """Daftar bengkel (name, address, lat, lng, rating) di sekitar titik; memakai cache bila ada."""
+        key = self.cache_key(lat, lng, radius_m)
+        with self._lock:
+            value = self._memory_get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return pending.result(timeout=sum(self._timeout) * (WORKSHOP_API_RETRIES + 1))
+
+        try:
+            value = self._disk_get(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                value = self._fetch(api_key, key)
+                self._disk_put(key, value)
+            with self._lock:
+                self._memory_put(key, value)
+            pending.set_result(value)
+            return value
+        except Exception as exc:
+            pending.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "hits": self.hits, "disk_hits": self.disk_hits,
+                    "coalesced": self.coalesced, "entries": len(self._entries)}
+
+@st.cache_resource
+def get_workshop_lookup_client():
+    """Satu klien (dan satu pool koneksi HTTP) per proses, dibagi oleh semua sesi Streamlit."""
+    return WorkshopLookupClient()
+
+def _rank_remote_workshops(places, lat, lng, radius_m, limit):
+    workshops = []
+    for place in places:
+        distance_m = _haversine_m(lat, lng, place["lat"], place["lng"])
+        if distance_m <= radius_m:
+            workshops.append({**place, "city": None, "source": "api", "visit_count": 0, "distance_m": distance_m})
+    workshops.sort(key=_workshop_rank_key)
+    return workshops[:limit]
+
+def search_nearby_workshops(db, location_query, radius=WORKSHOP_DEFAULT_RADIUS_M, limit=WORKSHOP_MAX_RESULTS, api_key=None):
+    """Mencari bengkel dalam radius (meter) dari lokasi teks.
+
+    Dengan api_key, bengkel dicari lewat WorkshopLookupClient; jika backend gagal, pencarian
+    jatuh kembali ke katalog bengkel lokal. Mengembalikan (lat, lng) lokasi dan daftar bengkel
+    (name, address, rating, distance_m, source, ...) yang diurutkan per kelas jarak lalu rating.
+    ValueError jika lokasi tidak dikenali.
+    """
+    point = geocode_location(location_query)
+    if point is None:
+        raise ValueError(f"Lokasi '{location_query}' tidak dikenali. Gunakan nama kota/wilayah atau koordinat 'lat, lng'.")
+    if api_key:
+        try:
+            places = get_workshop_lookup_client().lookup(api_key, point[0], point[1], radius)
+            return point, _rank_remote_workshops(places, point[0], point[1], radius, limit)
+        except (requests.RequestException, WorkshopLookupError):
+            logger.warning("Pencarian bengkel online gagal; memakai katalog lokal.", exc_info=True)
+    return point, find_workshops_within(db, point[0], point[1], radius, limit)
 
 # ====================================================================
 # 4. FUNGSI TAMPILAN (FORMS & PAGES)
@@ -419,14 +3192,10 @@ def admin_login_form(db: Session):
         submitted = st.form_submit_button("Login")
 
         if submitted:
-            user = get_user_by_email(db, email)
+            user = authenticate_user(db, email, password)
 
             # Periksa: Apakah pengguna ada DAN apakah is_admin = True
-            is_valid_admin = (
-                user is not None and
-                user.is_admin and
-                check_password_hash(user.password, password)
-            )
+            is_valid_admin = user is not None and user.is_admin
 
             if is_valid_admin:
                 # Set Session State untuk Admin
@@ -471,14 +3240,13 @@ def register_form(db: Session):
             else:
                 new_user = create_new_user(db, username, email, password)
 
-                email_sent = send_welcome_email(email, username)
+                enqueue_email(db, email, *build_welcome_email(email, username))
+                get_email_outbox_worker().notify()
 
                 if new_user.is_admin:
                     st.success("Pendaftaran berhasil! Anda adalah **Admin** pertama! Silakan masuk melalui Login Admin.")
-                elif email_sent:
-                    st.success("Pendaftaran berhasil! Silakan masuk. Cek email Anda untuk konfirmasi.")
                 else:
-                    st.success("Pendaftaran berhasil! Silakan masuk. (Peringatan: Gagal mengirim email konfirmasi, periksa pengaturan SMTP.)")
+                    st.success("Pendaftaran berhasil! Silakan masuk. Email konfirmasi akan segera dikirim ke alamat Anda.")
 
                 st.rerun()
 
@@ -503,14 +3271,7 @@ def register_form(db: Session):
                             st.warning("Email Admin sudah terdaftar.")
                         else:
                             # Buat pengguna baru dengan is_admin=True
-                            new_admin = User(
-                                username=admin_username,
-                                email=admin_email,
-                                password=generate_password_hash(admin_password),
-                                is_admin=True
-                            )
-                            db.add(new_admin)
-                            db.commit()
+                            create_new_user(db, admin_username, admin_email, admin_password, is_admin=True)
                             st.success(f"Akun admin '{admin_username}' berhasil dibuat. Total admin: {current_admin_count + 1}/3")
                             st.rerun()
         else:
@@ -528,10 +3289,10 @@ def login_form(db: Session):
         submitted = st.form_submit_button("Masuk")
 
         if submitted:
-            user = get_user_by_email(db, email)
+            user = authenticate_user(db, email, password)
 
             # Hanya izinkan login jika bukan admin atau admin yang login melalui halaman regular
-            if user and check_password_hash(user.password, password):
+            if user:
                 st.session_state['logged_in'] = True
                 st.session_state['username'] = user.username
                 st.session_state['user_id'] = user.id
@@ -560,35 +3321,61 @@ def admin_dashboard(db: Session):
     col1.metric("Total Pengguna", total_users)
     col2.metric("Total Motor Terdaftar", total_motors)
 
+    cache_stats = get_read_cache().stats()
+    st.caption(
+        f"Cache baca: {cache_stats['hits']:,} hit, {cache_stats['misses']:,} miss, "
+        f"{cache_stats['entries']:,} entri, {cache_stats['evictions']:,} dikeluarkan (LRU)."
+    )
+
     # Panggil Form Registrasi untuk fungsi membuat admin tambahan
     register_form(db)
 
     st.subheader("Kelola Pengguna Terdaftar")
 
-    all_users = db.query(User).order_by(User.id).all()
     current_admin_id = st.session_state.get('user_id')
 
+    # Pencarian & halaman: cursor setiap halaman yang sudah dibuka disimpan agar bisa kembali
+    search = st.text_input("Cari username/email (awalan)", key="admin_user_search").strip()
+    if st.session_state.get('admin_user_search_applied') != search:
+        st.session_state['admin_user_search_applied'] = search
+        st.session_state['admin_user_cursors'] = [None]
+    cursors = st.session_state.setdefault('admin_user_cursors', [None])
+
+    users, motor_counts, next_after_id = get_users_page(db, after_id=cursors[-1], search=search or None)
+    admin_count = get_admin_count(db)
+
     # Header Tabel
-    col_id, col_email, col_admin, col_action = st.columns([0.5, 2, 1, 2])
+    col_select, col_id, col_email, col_admin, col_motors, col_action = st.columns([0.4, 0.5, 2, 1, 0.7, 2])
+    col_select.markdown("**Pilih**")
     col_id.markdown("**ID**")
     col_email.markdown("**Nama (Email)**")
     col_admin.markdown("**Status Admin**")
+    col_motors.markdown("**Motor**")
     col_action.markdown("**Aksi**")
     st.markdown("---")
 
-    for user in all_users:
-        col_id, col_email, col_admin, col_action = st.columns([0.5, 2, 1, 2])
+    if not users:
+        st.info("Tidak ada pengguna yang cocok.")
+
+    selected_ids = []
+    for user in users:
+        col_select, col_id, col_email, col_admin, col_motors, col_action = st.columns([0.4, 0.5, 2, 1, 0.7, 2])
 
+        if user.id != current_admin_id and col_select.checkbox(
+            "Pilih", key=f"select_user_{user.id}", label_visibility="collapsed"
+        ):
+            selected_ids.append(user.id)
         col_id.write(user.id)
         col_email.write(f"{user.username} ({user.email})")
         col_admin.write("Admin ✅" if user.is_admin else "Pengguna 👤")
+        col_motors.write(motor_counts.get(user.id, 0))
 
         with col_action:
             if user.id != current_admin_id: # Admin tidak bisa menghapus/mengubah status dirinya sendiri
                 col_btn1, col_btn2 = st.columns(2)
 
                 # Tombol Toggle Admin (Hanya jika total admin tidak mencapai batas 3)
-                is_max_admin = get_admin_count(db) >= 3 and not user.is_admin
+                is_max_admin = admin_count >= 3 and not user.is_admin
 
                 btn_label = "Hapus Admin" if user.is_admin else "Jadikan Admin"
                 if col_btn1.button(btn_label, key=f"toggle_{user.id}", type="secondary", disabled=is_max_admin):
@@ -614,8 +3401,197 @@ def admin_dashboard(db: Session):
             else:
                 st.write("Anda (Admin Aktif)")
 
+    # Hapus massal: semua pengguna terpilih dihapus dalam satu transaksi
+    if st.button(f"Hapus {len(selected_ids)} Pengguna Terpilih", key="bulk_delete_users", type="primary", disabled=not selected_ids):
+        if st.session_state.get('confirm_bulk_delete_users') == selected_ids:
+            deleted = delete_users_and_data(db, selected_ids)
+            for user_id in selected_ids:
+                st.session_state.pop(f"select_user_{user_id}", None)
+            st.session_state.pop('confirm_bulk_delete_users')
+            st.success(f"{deleted} pengguna dan semua datanya berhasil dihapus.")
+            st.rerun()
+        else:
+            st.session_state['confirm_bulk_delete_users'] = selected_ids
+            st.error("Tekan tombol hapus lagi untuk **KONFIRMASI PENGHAPUSAN PERMANEN** semua pengguna terpilih.")
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    if col_prev.button("← Sebelumnya", key="admin_users_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    col_page.write(f"Halaman {len(cursors)}")
+    if col_next.button("Berikutnya →", key="admin_users_next", disabled=next_after_id is None):
+        cursors.append(next_after_id)
+        st.rerun()
+
+    st.markdown("---")
+    sql_profile_panel()
+
+
+def sql_profile_panel():
+    """Bagian panel admin: jumlah query per halaman, query paling lambat, dan pola N+1."""
+    st.subheader("Instrumentasi SQL")
+    profiler = get_sql_profiler()
+    col_toggle, col_reset = st.columns([3, 1])
+    enabled = col_toggle.toggle("Rekam query SQL setiap rerun", value=profiler.enabled, key="sql_profile_enabled")
+    if enabled != profiler.enabled:
+        profiler.set_enabled(enabled)
+        st.rerun()
+    if col_reset.button("Reset Rekaman", key="sql_profile_reset"):
+        profiler.reset()
+        st.rerun()
+    if not profiler.enabled:
+        st.caption("Perekaman nonaktif; hook query tidak terpasang di engine.")
+        return
+
+    summary = profiler.summary()
+    st.caption(f"{summary['reruns']:,} rerun terakhir terekam (maks. {SQL_PROFILE_MAX_RERUNS}, semua sesi).")
+
+    st.markdown("#### Query per Halaman")
+    st.dataframe(
+        [
+            {
+                "Halaman": page,
+                "Rerun": stats["reruns"],
+                "Rata-rata Query": round(stats["queries"] / stats["reruns"], 1),
+                "Maks. Query": stats["max_queries"],
+                "Rata-rata SQL (ms)": round(stats["sql_ms"] / stats["reruns"], 1),
+                "Rata-rata Rerun (ms)": round(stats["wall_ms"] / stats["reruns"], 1),
+            }
+            for page, stats in sorted(summary["pages"].items())
+        ],
+        hide_index=True,
+    )
+
+    st.markdown("#### Pola N+1")
+    if summary["n_plus_one"]:
+        st.dataframe(
+            [
+                {"Halaman": page, "Helper": helper, "Pengulangan per Rerun": count, "Bentuk Statement": shape}
+                for page, helper, shape, count in summary["n_plus_one"]
+            ],
+            hide_index=True,
+        )
+    else:
+        st.caption(f"Tidak ada statement yang diulang {SQL_N_PLUS_ONE_THRESHOLD}x atau lebih oleh helper yang sama dalam satu rerun.")
+
+    st.markdown("#### Query Paling Lambat")
+    st.dataframe(
+        [
+            {"Durasi (ms)": round(duration_ms, 2), "Helper": helper, "Halaman": page, "Statement": statement}
+            for duration_ms, helper, page, statement in summary["slowest"]
+        ],
+        hide_index=True,
+    )
+
+
+FLEET_MODE_THRESHOLD = 20 # di atas jumlah motor ini daftar motor ditampilkan sebagai tabel armada
+FLEET_STATUS_LABELS = {"overdue": "🚨 Harus Service", "due_soon": "⚠️ Mendekati", "ok": "✅ Aman"}
+
+def display_motor_detail(db, motor, total_cost):
+    """Detail dan tombol aksi untuk satu motor."""
+    is_confirming = st.session_state.get(f'confirm_delete_{motor.id}', False)
+    st.markdown(f"**Merek:** {motor.brand}")
+    st.markdown(f"**Model:** {motor.model}")
+    st.markdown(f"**Tahun:** {motor.year}")
+    st.markdown(f"**Nomor Plat:** {motor.plate_number}") # NEW: Tampilkan Nomor Plat
+    st.markdown(f"**Kilometer Saat Ini:** {motor.current_km:,} KM")
+    st.markdown(f"**Total Biaya Service:** **Rp {total_cost:,}** 💸")
     st.markdown("---")
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    with col1:
+        if st.button(f"Catat Service", key=f"service_{motor.id}"):
+            st.session_state['action'] = 'catat_service'
+            st.session_state['selected_motor_id'] = motor.id
+            st.rerun()
+    with col2:
+        if st.button(f"Lihat Riwayat", key=f"history_{motor.id}"):
+            st.session_state['action'] = 'view_history'
+            st.session_state['selected_motor_id'] = motor.id
+            st.rerun()
+    with col3:
+        if st.button("Kelola Pengingat", key=f"schedule_{motor.id}", type="secondary"):
+            st.session_state['action'] = 'manage_schedule'
+            st.session_state['selected_motor_id'] = motor.id
+            st.rerun()
+    with col4:
+        if is_confirming:
+            if st.button("KONFIRMASI HAPUS!", key=f"confirm_delete_btn_{motor.id}", type="primary"):
+                if delete_motor(db, motor.id):
+                    st.success(f"Motor {motor.model} berhasil dihapus.")
+                else:
+                    st.error("Gagal menghapus motor.")
+                st.session_state.pop(f'confirm_delete_{motor.id}')
+                st.rerun()
+            st.button("Batal", key=f"cancel_delete_{motor.id}", on_click=lambda m_id=motor.id: st.session_state.pop(f'confirm_delete_{m_id}'), args=[])
+        else:
+            if st.button("Hapus Motor", key=f"delete_{motor.id}", type="secondary"):
+                st.session_state[f'confirm_delete_{motor.id}'] = True
+                st.warning("Tekan 'KONFIRMASI HAPUS' di atas untuk menghapus motor dan semua data servicenya.")
+                st.rerun()
+
+def display_fleet_overview(db, owner_id):
+    """Tabel armada: satu baris per motor dari get_service_reminders; detail hanya untuk motor terpilih."""
+    reminders = get_service_reminders(db, owner_id)
+
+    col_search, col_status = st.columns([2, 2])
+    search = col_search.text_input("Cari merek/model/plat", key="fleet_search").strip().lower()
+    statuses = col_status.multiselect(
+        "Status", list(FLEET_STATUS_LABELS), default=list(FLEET_STATUS_LABELS),
+        format_func=FLEET_STATUS_LABELS.get, key="fleet_status",
+    )
+
+    rows = [
+        reminder for reminder in reminders
+        if reminder["status"] in statuses
+        and (not search or search in f"{reminder['motor'].brand} {reminder['motor'].model} {reminder['motor'].plate_number}".lower())
+    ]
+    st.caption(f"Menampilkan {len(rows):,} dari {len(reminders):,} motor. Klik judul kolom untuk mengurutkan, pilih baris untuk melihat detail.")
+
+    # Prakiraan berbasis laju KM per hari dihitung sekaligus untuk seluruh armada
+    forecast = forecast_fleet(db, owner_id)
+    # Pengingat dan prakiraan dicache terpisah; motor yang berubah di proses lain di antara
+    # keduanya tidak punya pasangan dan ditampilkan tanpa prakiraan
+    forecast_ids = forecast["motor_id"]
+    row_motor_ids = np.array([reminder["motor"].id for reminder in rows], dtype=np.int64)
+    km_per_day = np.full(len(rows), np.nan)
+    predicted_due = [None] * len(rows)
+    if len(forecast_ids):
+        positions = np.minimum(np.searchsorted(forecast_ids, row_motor_ids), len(forecast_ids) - 1)
+        matched = forecast_ids[positions] == row_motor_ids
+        km_per_day[matched] = forecast["km_per_day"][positions[matched]]
+        predicted_due = [
+            forecast["predicted_due"][position].item() if is_matched else None
+            for position, is_matched in zip(positions, matched)
+        ]
+
+    event = st.dataframe(
+        [
+            {
+                "Plat": reminder["motor"].plate_number,
+                "Merek": reminder["motor"].brand,
+                "Model": reminder["motor"].model,
+                "KM": reminder["motor"].current_km,
+                "Total Biaya (Rp)": reminder["total_cost"],
+                "Service Terakhir": reminder["last_service_date"],
+                "Jatuh Tempo": reminder["next_date"],
+                "Jatuh Tempo (KM)": reminder["next_km"],
+                "Status": FLEET_STATUS_LABELS[reminder["status"]],
+                "KM/Hari": None if np.isnan(km_per_day[i]) else round(float(km_per_day[i]), 1),
+                "Prediksi Jatuh Tempo": predicted_due[i],
+            }
+            for i, reminder in enumerate(rows)
+        ],
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key="fleet_table",
+    )
 
+    if event.selection.rows:
+        selected = rows[event.selection.rows[0]]
+        motor = selected["motor"]
+        st.markdown(f"#### {motor.brand} {motor.model} ({motor.plate_number})")
+        display_motor_detail(db, motor, selected["total_cost"])
 
 def display_motors(db):
     st.subheader("Daftar Motor Saya 🏍️")
@@ -623,50 +3599,14 @@ def display_motors(db):
     motors = get_motors_by_owner(db, owner_id)
     if not motors:
         st.info("Anda belum memiliki motor terdaftar. Silakan tambahkan motor Anda!")
+    elif st.toggle("Mode Armada (tabel)", value=len(motors) > FLEET_MODE_THRESHOLD, key="fleet_mode"):
+        display_fleet_overview(db, owner_id)
     else:
         for motor in motors:
-            is_confirming = st.session_state.get(f'confirm_delete_{motor.id}', False)
             total_cost = get_total_service_cost(db, motor.id)
             # MODIFIED: Judul expander menampilkan Nomor Plat
             with st.expander(f"**{motor.brand} {motor.model}** ({motor.plate_number})"):
-                st.markdown(f"**Merek:** {motor.brand}")
-                st.markdown(f"**Model:** {motor.model}")
-                st.markdown(f"**Tahun:** {motor.year}")
-                st.markdown(f"**Nomor Plat:** {motor.plate_number}") # NEW: Tampilkan Nomor Plat
-                st.markdown(f"**Kilometer Saat Ini:** {motor.current_km:,} KM")
-                st.markdown(f"**Total Biaya Service:** **Rp {total_cost:,}** 💸")
-                st.markdown("---")
-                col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
-                with col1:
-                    if st.button(f"Catat Service", key=f"service_{motor.id}"):
-                        st.session_state['action'] = 'catat_service'
-                        st.session_state['selected_motor_id'] = motor.id
-                        st.rerun()
-                with col2:
-                    if st.button(f"Lihat Riwayat", key=f"history_{motor.id}"):
-                        st.session_state['action'] = 'view_history'
-                        st.session_state['selected_motor_id'] = motor.id
-                        st.rerun()
-                with col3:
-                    if st.button("Kelola Pengingat", key=f"schedule_{motor.id}", type="secondary"):
-                        st.session_state['action'] = 'manage_schedule'
-                        st.session_state['selected_motor_id'] = motor.id
-                        st.rerun()
-                with col4:
-                    if is_confirming:
-                        if st.button("KONFIRMASI HAPUS!", key=f"confirm_delete_btn_{motor.id}", type="primary"):
-                            if delete_motor(db, motor.id):
-                                st.success(f"Motor {motor.model} berhasil dihapus.")
-                            else:
-                                st.error("Gagal menghapus motor.")
-                            st.session_state.pop(f'confirm_delete_{motor.id}')
-                            st.rerun()
-                        st.button("Batal", key=f"cancel_delete_{motor.id}", on_click=lambda m_id=motor.id: st.session_state.pop(f'confirm_delete_{m_id}'), args=[])
-                    else:
-                        if st.button("Hapus Motor", key=f"delete_{motor.id}", type="secondary"):
-                            st.session_state[f'confirm_delete_{motor.id}'] = True
-                            st.warning("Tekan 'KONFIRMASI HAPUS' di atas untuk menghapus motor dan semua data servicenya.")
-                            st.rerun()
+                display_motor_detail(db, motor, total_cost)
 
 def add_motor_form(db):
     st.subheader("Tambahkan Motor Baru Anda")
@@ -726,11 +3666,12 @@ def service_form(db):
         workshop_address = st.text_area("Alamat Bengkel")
         workshop_photo = st.file_uploader("Upload Foto Bengkel/Kwitansi Service (Opsional)", type=['jpg', 'jpeg', 'png'])
 
-        # Logic to convert photo to Base64 for storage
-        photo_base64 = None
+        # Foto dikirim sebagai bytes; create_new_service memperkecil dan menyimpannya
+        photo_bytes = None
+        photo_mime = None
         if workshop_photo is not None:
             photo_bytes = workshop_photo.read()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_mime = workshop_photo.type
         # ----------------------------------------
 
         submitted = st.form_submit_button("Simpan Catatan Service")
@@ -741,7 +3682,11 @@ def service_form(db):
                 return
 
             # MODIFIED: Tambah parameter detail bengkel dan foto ke fungsi create_new_service
-            create_new_service(db, selected_motor_id, service_date, km_at_service, description, cost, workshop_name, workshop_address, photo_base64)
+            try:
+                create_new_service(db, selected_motor_id, service_date, km_at_service, description, cost, workshop_name, workshop_address, photo_bytes, photo_mime)
+            except UnidentifiedImageError:
+                st.error("File foto tidak dapat dibaca sebagai gambar. Silakan upload JPG/PNG yang valid.")
+                return
             is_km_updated = update_motor_km(db, selected_motor_id, km_at_service)
             if is_km_updated:
                 st.success(f"Catatan service untuk {selected_motor_display} berhasil disimpan! Kilometer motor diperbarui menjadi {km_at_service:,} KM. ✅")
@@ -749,16 +3694,193 @@ def service_form(db):
                 st.warning(f"Catatan service berhasil disimpan, tetapi Kilometer motor TIDAK diperbarui karena KM service ({km_at_service:,} KM) lebih kecil dari KM saat ini.")
             st.rerun()
 
+def import_services_page(db):
+    """Halaman impor riwayat service massal dari file CSV/XLSX."""
+    st.subheader("Impor Riwayat Service (CSV/XLSX) 📥")
+    owner_id = st.session_state.get('user_id')
+    motors = get_motors_by_owner(db, owner_id)
+    if not motors:
+        st.warning("Anda belum memiliki motor terdaftar. Silakan tambahkan motor terlebih dahulu.")
+        return
+
+    st.markdown(
+        "Baris pertama file harus berisi nama kolom: "
+        + ", ".join(f"`{column}`" for column in IMPORT_COLUMNS)
+        + ". Kolom wajib: " + ", ".join(f"`{column}`" for column in IMPORT_REQUIRED_COLUMNS)
+        + ". Tanggal berformat YYYY-MM-DD. KM dan biaya berupa angka bulat (boleh dengan titik ribuan, contoh 150.000)."
+    )
+    motor_options = {"(Gunakan kolom plate_number)": None}
+    motor_options.update({f"{m.brand} {m.model} ({m.plate_number})": m.id for m in motors})
+    selected_motor_display = st.selectbox("Motor untuk baris tanpa plate_number:", options=list(motor_options.keys()))
+    file_types = import_file_types()
+    if "xlsx" not in file_types:
+        st.caption("Impor XLSX tidak tersedia di server ini (paket openpyxl belum terpasang); gunakan CSV.")
+    uploaded = st.file_uploader("File riwayat service", type=file_types, key="import_services_file")
+
+    if uploaded is not None and st.button("Mulai Impor", type="primary"):
+        with st.spinner("Mengimpor riwayat service..."):
+            try:
+                report = import_services(
+                    db, owner_id, iter_import_rows(uploaded, uploaded.name),
+                    default_motor_id=motor_options[selected_motor_display],
+                )
+            except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+                st.error(f"Impor dihentikan: {str(exc).rstrip('.')}. Baris yang sudah diimpor sebelumnya tetap tersimpan.")
+                return
+
+        st.success(
+            f"{report['inserted']:,} catatan service berhasil diimpor. "
+            f"Kilometer {report['motors_km_updated']} motor diperbarui."
+        )
+        if report["error_count"]:
+            st.warning(f"{report['error_count']:,} baris dilewati karena tidak valid.")
+            st.dataframe(
+                [{"Baris": row_number, "Kesalahan": message} for row_number, message in report["errors"]],
+                hide_index=True,
+            )
+
+def export_data_page(db):
+    """Halaman ekspor data motor, service, dan jadwal ke arsip ZIP (tanpa foto, maksimal EXPORT_UI_MAX_BYTES)."""
+    st.subheader("Ekspor Data 📤")
+    owner_id = st.session_state.get('user_id')
+
+    fmt = st.selectbox("Format file", EXPORT_FORMATS, format_func=str.upper)
+    st.caption(
+        f"Unduhan di sini tanpa foto dan maksimal {EXPORT_UI_MAX_BYTES // (1024 * 1024)} MB. "
+        "Ekspor dengan foto dijalankan oleh admin server: "
+        f"`python manage.py export arsip.zip --email <email> --format {fmt} --photos`."
+    )
+    if st.session_state.get('is_admin', False):
+        st.info(
+            "Ekspor seluruh database (semua pengguna) dijalankan di server agar tidak dimuat ke memori aplikasi: "
+            f"`python manage.py export motocare_semua.zip --format {fmt}` (tambahkan `--photos` untuk foto)."
+        )
+
+    if st.button("Siapkan Ekspor", type="primary"):
+        # Arsip ditulis ke file sementara di disk, bukan dirakit di memori
+        archive_file = tempfile.TemporaryFile()
+        try:
+            with st.spinner("Menyiapkan arsip ekspor..."):
+                try:
+                    counts = write_export_archive(db, archive_file, owner_id=owner_id, fmt=fmt)
+                except ValueError as exc:
+                    st.error(str(exc))
+                    return
+            size = archive_file.tell()
+            if size > EXPORT_UI_MAX_BYTES:
+                st.error(
+                    f"Arsip berukuran {size / (1024 * 1024):,.1f} MB, melebihi batas unduhan "
+                    f"{EXPORT_UI_MAX_BYTES // (1024 * 1024)} MB. Minta admin menjalankan "
+                    "`python manage.py export` untuk data Anda."
+                )
+                return
+            archive_file.seek(0)
+            archive_bytes = archive_file.read()
+        finally:
+            archive_file.close()
+
+        st.success(
+            f"Arsip siap: {counts['motors']:,} motor, {counts['services']:,} service, "
+            f"{counts['schedules']:,} jadwal."
+        )
+        st.download_button(
+            "Unduh Arsip (.zip)",
+            data=archive_bytes,
+            file_name=f"motocare_export_{datetime.date.today():%Y%m%d}_{fmt}.zip",
+            mime="application/zip",
+            on_click="ignore",
+        )
+
+def cost_analytics_page(db):
+    st.subheader("📊 Analitik Biaya Service")
+    analytics = get_cost_analytics(db, st.session_state.get('user_id'))
+    if not len(analytics["months"]):
+        st.info("Belum ada service bertanggal yang dicatat untuk dianalisis.")
+        return
+
+    total = float(analytics["total_cost"].sum())
+    km_driven = float(analytics["km_driven"].sum())
+    this_year = analytics["yearly_cost"].get(datetime.date.today().year, 0)
+    col_total, col_year, col_per_km = st.columns(3)
+    col_total.metric("Total Biaya", f"Rp {total:,.0f}")
+    col_year.metric(f"Biaya {datetime.date.today().year}", f"Rp {this_year:,.0f}")
+    col_per_km.metric("Biaya per KM", f"Rp {total / km_driven:,.0f}" if km_driven else "-")
+
+    st.markdown("#### Biaya per Bulan")
+    st.bar_chart(
+        {
+            "Bulan": [str(month) for month in analytics["months"]],
+            "Biaya (Rp)": analytics["monthly_cost"].sum(axis=0).tolist(),
+        },
+        x="Bulan",
+        y="Biaya (Rp)",
+    )
+
+    st.markdown("#### Biaya per Tahun")
+    st.dataframe(
+        [{"Tahun": str(year), "Biaya (Rp)": round(cost)} for year, cost in sorted(analytics["yearly_cost"].items(), reverse=True)],
+        hide_index=True,
+    )
+
+    st.markdown("#### Per Motor")
+    st.caption(f"Tren: perubahan biaya bulanan rata-rata selama {ANALYTICS_TREND_MONTHS} bulan terakhir.")
+    st.dataframe(
+        [
+            {
+                "Motor": f"{brand} {model}",
+                "Plat": plate_number,
+                "Total Biaya (Rp)": round(analytics["total_cost"][i]),
+                "KM Ditempuh": int(analytics["km_driven"][i]),
+                "Biaya/KM (Rp)": None if np.isnan(analytics["cost_per_km"][i]) else round(float(analytics["cost_per_km"][i]), 1),
+                "Tren (Rp/bulan)": round(float(analytics["trend_per_month"][i])),
+            }
+            for i, (_, brand, model, plate_number) in enumerate(analytics["motors"])
+        ],
+        hide_index=True,
+    )
+
+    st.markdown("#### Per Bengkel")
+    st.dataframe(
+        [
+            {"Bengkel": workshop or "(tidak dicatat)", "Jumlah Service": count, "Total Biaya (Rp)": cost}
+            for workshop, count, cost in analytics["workshops"]
+        ],
+        hide_index=True,
+    )
+
 def display_service_history(db, motor_id, motor_display_name):
     st.subheader(f"Riwayat Service: {motor_display_name}")
-    services = get_services_by_motor(db, motor_id)
-    if not services:
+    stats = db.get(MotorServiceStats, motor_id)
+    if not stats or not stats.service_count:
         st.info("Belum ada riwayat service yang dicatat untuk motor ini.")
         if st.button(f"Catat Service Sekarang untuk {motor_display_name}", key=f"quick_service_{motor_id}"):
             st.session_state['action'] = 'catat_service'
             st.session_state['selected_motor_id'] = motor_id
             st.rerun()
     else:
+        with st.expander("Filter Riwayat"):
+            col_from, col_to = st.columns(2)
+            date_from = col_from.date_input("Dari Tanggal", value=None, key=f"history_from_{motor_id}")
+            date_to = col_to.date_input("Sampai Tanggal", value=None, key=f"history_to_{motor_id}")
+            col_min, col_max = st.columns(2)
+            cost_min = col_min.number_input("Biaya Minimum (Rp)", min_value=0, value=None, key=f"history_cost_min_{motor_id}")
+            cost_max = col_max.number_input("Biaya Maksimum (Rp)", min_value=0, value=None, key=f"history_cost_max_{motor_id}")
+
+        # Cursor setiap halaman yang sudah dibuka; direset jika filter berubah
+        filters = (date_from, date_to, cost_min, cost_max)
+        cursors_key = f'history_cursors_{motor_id}'
+        if st.session_state.get(f'history_filters_{motor_id}') != filters:
+            st.session_state[f'history_filters_{motor_id}'] = filters
+            st.session_state[cursors_key] = [None]
+        cursors = st.session_state.setdefault(cursors_key, [None])
+
+        services, next_cursor = get_services_page(
+            db, motor_id, cursor=cursors[-1],
+            date_from=date_from, date_to=date_to, cost_min=cost_min, cost_max=cost_max,
+        )
+        if not services:
+            st.info("Tidak ada service yang cocok dengan filter.")
+
         # MODIFIED: Sesuaikan lebar kolom untuk mengakomodasi expander
         col_date, col_km, col_desc_summary, col_cost, col_action = st.columns([1.5, 1, 2.5, 1.5, 1])
         col_date.markdown("**Tanggal**")
@@ -781,16 +3903,23 @@ def display_service_history(db, motor_id, motor_display_name):
                     st.write(f"**Nama Bengkel:** {s.workshop_name or '-'}")
                     st.write(f"**Alamat Bengkel:** {s.workshop_address or '-'}")
 
-                    if s.workshop_photo_base64:
+                    if s.workshop_photo_sha256:
                         st.markdown("---")
                         st.markdown("**Foto/Kwitansi Dokumentasi:**")
+                        # Hanya thumbnail yang dikirim; foto penuh dimuat jika diminta
+                        show_full_key = f'show_full_photo_{s.id}'
                         try:
-                            # Reconstruct image from base64
-                            img_data = base64.b64decode(s.workshop_photo_base64)
-                            # Pastikan data bisa di-display sebagai gambar
-                            st.image(io.BytesIO(img_data), caption="Dokumentasi Service", use_column_width=True)
+                            if st.session_state.get(show_full_key):
+                                st.image(photo_blob_path(s.workshop_photo_sha256), caption="Dokumentasi Service", use_column_width=True)
+                            elif s.workshop_thumb_sha256:
+                                st.image(photo_blob_path(s.workshop_thumb_sha256), caption="Dokumentasi Service (thumbnail)")
                         except Exception as e:
                             st.error("Gagal menampilkan foto dokumentasi.")
+
+                        if not st.session_state.get(show_full_key):
+                            if st.button("Lihat Foto Resolusi Penuh", key=f"full_photo_btn_{s.id}"):
+                                st.session_state[show_full_key] = True
+                                st.rerun()
                     else:
                         st.info("Tidak ada foto dokumentasi service.")
 
@@ -809,12 +3938,57 @@ def display_service_history(db, motor_id, motor_display_name):
                         st.session_state[f'confirm_del_svc_{s.id}'] = True
                         st.warning("Tekan 'Hapus' lagi untuk konfirmasi!")
                         st.rerun()
+
+        # Halaman berikutnya hanya dibaca saat diminta
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        if col_prev.button("← Lebih Baru", key=f"history_prev_{motor_id}", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        col_page.write(f"Halaman {len(cursors)}")
+        if col_next.button("Lebih Lama →", key=f"history_next_{motor_id}", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
     st.markdown("---")
     if st.button("← Kembali ke Daftar Motor", key="back_to_motors_from_history"):
         st.session_state['action'] = 'view_motors'
         st.session_state.pop('view_history', None)
         st.rerun()
 
+def service_search_box(db, owner_id):
+    """Kotak pencarian riwayat service di semua motor milik user (index FTS5)."""
+    query = st.text_input("🔎 Cari Riwayat Service", placeholder="Contoh: ganti rantai, kampas rem, AHASS", key="service_search_query")
+    if not query.strip():
+        return
+
+    # Cursor setiap halaman yang sudah dibuka; direset jika kata kunci berubah
+    cursors_key = 'service_search_cursors'
+    if st.session_state.get('service_search_last_query') != query:
+        st.session_state['service_search_last_query'] = query
+        st.session_state[cursors_key] = [None]
+    cursors = st.session_state.setdefault(cursors_key, [None])
+
+    results, next_cursor = search_services(db, owner_id, query, cursor=cursors[-1])
+    if not results and len(cursors) == 1:
+        st.info(f"Tidak ada service yang cocok dengan '{query}'.")
+        return
+
+    for result in results:
+        plate = f" ({result['plate_number']})" if result["plate_number"] else ""
+        st.markdown(f"**{result['service_date']}** · {result['brand']} {result['model']}{plate} · KM {result['km_at_service']:,}")
+        st.write(result["description"])
+        workshop = ", ".join(part for part in (result["workshop_name"], result["workshop_address"]) if part)
+        st.caption(f"{workshop or 'Bengkel tidak dicatat'} · Rp {result['cost'] or 0:,}")
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    if col_prev.button("← Sebelumnya", key="service_search_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    col_page.write(f"Halaman {len(cursors)}")
+    if col_next.button("Berikutnya →", key="service_search_next", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+    st.markdown("---")
+
 def manage_schedule_form(db, motor_id, motor_display_name):
     st.subheader(f"Kelola Pengingat Service: {motor_display_name}")
     if st.button("← Kembali ke Daftar Motor", key="back_from_schedule_form"):
@@ -850,35 +4024,65 @@ def manage_schedule_form(db, motor_id, motor_display_name):
                 st.error("Gagal memperbarui pengaturan jadwal.")
             st.rerun()
 
-def nearby_workshop_page():
+def _display_workshop(index, workshop):
+    st.markdown(f"**{index}. {workshop['name']}** — {workshop['distance_m'] / 1000:.1f} km")
+    st.write(f"Alamat: {workshop['address'] or '-'}")
+    rating = f"⭐ {workshop['rating']:.1f}" if workshop["rating"] is not None else "Belum ada rating"
+    visits = f" · tercatat di {workshop['visit_count']} service pengguna" if workshop["visit_count"] else ""
+    st.write(f"Rating: {rating}{visits}")
+    st.markdown("---")
+
+def nearby_workshop_page(db):
     st.subheader("📍 Temukan Bengkel Terdekat")
-    st.info("Fitur ini memerlukan **API Key Google Maps** yang terpisah untuk berfungsi penuh. Saat ini menampilkan data simulasi.")
+    st.info("Masukkan nama kota/wilayah (contoh: Jakarta Selatan) atau koordinat (contoh: -6.2615, 106.8106).")
     with st.form("workshop_search_form"):
         location_query = st.text_input("Masukkan Lokasi Anda (Contoh: Jakarta Pusat)", "Jakarta")
         search_radius = st.slider("Jarak Pencarian Maksimal (meter)", min_value=1000, max_value=10000, value=5000, step=1000)
-        google_api_key = st.text_input("API Key Google Maps (Opsional untuk simulasi)", "INPUT_API_KEY_ANDA_DI_SINI", type="password")
+        api_key = st.text_input("API Key Google Maps (kosongkan untuk katalog lokal)", WORKSHOP_API_KEY, type="password")
         submitted = st.form_submit_button("Cari Bengkel")
     if submitted:
-        if google_api_key == "INPUT_API_KEY_ANDA_DI_SINI":
-             st.warning("Menggunakan data simulasi karena API Key belum dimasukkan.")
-        results = search_nearby_workshops(google_api_key, location_query, search_radius)
+        try:
+            (lat, lng), results = search_nearby_workshops(db, location_query, search_radius, api_key=api_key.strip())
+        except ValueError as e:
+            st.error(str(e))
+            return
         if results:
             st.success(f"Ditemukan {len(results)} bengkel di dekat {location_query} (radius {search_radius}m).")
             for i, workshop in enumerate(results):
-                st.markdown(f"**{i+1}. {workshop['name']}**")
-                st.write(f"Alamat: {workshop['address']}")
-                st.write(f"Rating: ⭐ {workshop.get('rating', 'N/A')}")
-                st.markdown("---")
+                _display_workshop(i + 1, workshop)
         else:
             st.warning(f"Tidak ada bengkel ditemukan di dekat {location_query} dengan radius {search_radius}m.")
+            nearest = find_nearest_workshops(db, lat, lng, k=3)
+            if nearest:
+                st.write("Bengkel terdekat di luar radius:")
+                for i, workshop in enumerate(nearest):
+                    _display_workshop(i + 1, workshop)
+
+REMINDER_STATUS_LABELS = {
+    "overdue": "**HARUS SERVICE!** 🚨",
+    "due_soon": "**Mendekati Jatuh Tempo** ⚠️",
+    "ok": "Aman ✅",
+}
 
 def display_reminders(db, owner_id):
     st.subheader("🔔 Pengingat Service Anda")
-    motors = get_motors_by_owner(db, owner_id)
-    today = datetime.date.today()
-    if not motors:
+    reminders = get_service_reminders(db, owner_id)
+    if not reminders:
         st.info("Tambahkan motor untuk melihat pengingat service Anda.")
         return
+    if len(reminders) > FLEET_MODE_THRESHOLD:
+        # Armada besar: ringkasan per status; daftar lengkapnya ada di tabel armada
+        counts = {status: 0 for status in FLEET_STATUS_LABELS}
+        for reminder in reminders:
+            counts[reminder["status"]] += 1
+        col_overdue, col_due_soon, col_ok = st.columns(3)
+        col_overdue.metric("Harus Service 🚨", counts["overdue"])
+        col_due_soon.metric("Mendekati Jatuh Tempo ⚠️", counts["due_soon"])
+        col_ok.metric("Aman ✅", counts["ok"])
+        if counts["overdue"] or counts["due_soon"]:
+            st.warning("Gunakan filter **Status** di tabel armada (menu Motor Saya) untuk melihat motor yang perlu diservice.")
+        st.markdown("---")
+        return
     col_motor, col_next_date, col_next_km, col_status = st.columns([2, 1.5, 1.5, 2])
     col_motor.markdown("**Motor**")
     col_next_date.markdown("**Jatuh Tempo (Waktu)**")
@@ -886,36 +4090,31 @@ def display_reminders(db, owner_id):
     col_status.markdown("**Status**")
     st.markdown("---")
     needs_attention = False
-    for motor in motors:
-        next_date = calculate_next_service_date(db, motor.id)
-        next_km = calculate_next_service_km(db, motor.id)
-        days_left = (next_date - today).days
-        km_left = next_km - motor.current_km
+    for reminder in reminders:
+        motor = reminder["motor"]
 
         # MODIFIED: Tampilkan Nomor Plat di daftar pengingat
         motor_display = f"{motor.brand} {motor.model} ({motor.plate_number})"
 
-        if days_left <= 0 or km_left <= 0:
-            status = f"**HARUS SERVICE!** 🚨"
+        if reminder["status"] != "ok":
             needs_attention = True
-        elif days_left <= 14 or km_left <= 500:
-            status = f"**Mendekati Jatuh Tempo** ⚠️"
-            needs_attention = True
-        else:
-            status = f"Aman ✅"
         col_motor.write(motor_display)
-        col_next_date.write(next_date.strftime("%d %b %Y"))
-        col_next_km.write(f"{next_km:,} KM")
-        col_status.markdown(status)
+        col_next_date.write(reminder["next_date"].strftime("%d %b %Y"))
+        col_next_km.write(f"{reminder['next_km']:,} KM")
+        col_status.markdown(REMINDER_STATUS_LABELS[reminder["status"]])
     if needs_attention:
         st.warning("Perhatikan motor dengan status **HARUS SERVICE** atau **Mendekati Jatuh Tempo**.")
     st.markdown("---")
 
-def dashboard_page():
-    """Menampilkan halaman utama setelah login."""
+# Aksi yang menampilkan halaman lain dari menu yang sedang dipilih (label halaman di instrumentasi SQL)
+SQL_PROFILE_ACTION_PAGES = {
+    "view_history": "Riwayat Service",
+    "catat_service": "Catat Service Baru",
+    "manage_schedule": "Atur Jadwal",
+}
 
-    db_generator = get_db()
-    db = next(db_generator)
+def dashboard_page(db):
+    """Menampilkan halaman utama setelah login."""
 
     is_admin = st.session_state.get('is_admin', False)
 
@@ -924,15 +4123,16 @@ def dashboard_page():
 
     # --- NAVIGASI ADMIN/USER ---
     if is_admin:
-        menu_options = ["Motor Saya", "Catat Service Baru", "Tambah Motor", "Cari Bengkel", "Admin Panel"]
+        menu_options = ["Motor Saya", "Catat Service Baru", "Impor Riwayat", "Ekspor Data", "Analitik Biaya", "Tambah Motor", "Cari Bengkel", "Admin Panel"]
     else:
-        menu_options = ["Motor Saya", "Catat Service Baru", "Tambah Motor", "Cari Bengkel"]
+        menu_options = ["Motor Saya", "Catat Service Baru", "Impor Riwayat", "Ekspor Data", "Analitik Biaya", "Tambah Motor", "Cari Bengkel"]
 
     dashboard_menu = st.sidebar.radio("Menu Dashboard", menu_options, key='dashboard_menu_radio')
     # -----------------------------
 
     current_action = st.session_state.get('action')
     selected_motor_id = st.session_state.get('selected_motor_id')
+    get_sql_profiler().set_page(SQL_PROFILE_ACTION_PAGES.get(current_action, dashboard_menu))
 
     # ADMIN PANEL CHECK
     if dashboard_menu == "Admin Panel" and is_admin:
@@ -942,6 +4142,7 @@ def dashboard_page():
 
     # Tampilkan Pengingat di bagian atas dashboard normal
     display_reminders(db, st.session_state.get('user_id'))
+    service_search_box(db, st.session_state.get('user_id'))
 
     if current_action == 'view_history' and selected_motor_id:
         motor = db.query(Motor).filter(Motor.id == selected_motor_id).first()
@@ -964,9 +4165,21 @@ def dashboard_page():
         st.session_state['action'] = 'catat_service_menu'
         service_form(db)
 
+    elif dashboard_menu == "Impor Riwayat":
+        st.session_state['action'] = 'import_services'
+        import_services_page(db)
+
+    elif dashboard_menu == "Ekspor Data":
+        st.session_state['action'] = 'export_data'
+        export_data_page(db)
+
+    elif dashboard_menu == "Analitik Biaya":
+        st.session_state['action'] = 'cost_analytics'
+        cost_analytics_page(db)
+
     elif dashboard_menu == "Cari Bengkel":
         st.session_state['action'] = 'find_workshop'
-        nearby_workshop_page()
+        nearby_workshop_page(db)
 
     elif dashboard_menu == "Motor Saya":
         st.session_state['action'] = 'view_motors'
@@ -991,6 +4204,7 @@ def dashboard_page():
 def main():
     # MODIFIED: Menambahkan page_icon untuk favicon
     st.set_page_config(layout="centered", page_title="MotoCare App", page_icon="🏍️")
+    _run_migrations_once()
 
     # --- PANGGIL FUNGSI BACKGROUND DAN TEMA ---
     set_background_image("https://upload.wikimedia.org/wikipedia/commons/thumb/d/d3/Solid_black.svg/2048px-Solid_black.svg.png")
@@ -1000,9 +4214,6 @@ def main():
         st.session_state['action'] = None
         st.session_state['is_admin'] = False
 
-    db_generator = get_db()
-    db = next(db_generator)
-
     # NEW: Menampilkan logo di Sidebar
     try:
         # Menampilkan gambar dengan lebar 200px. Ganti lebar jika terlalu besar/kecil
@@ -1015,19 +4226,29 @@ def main():
 
     st.sidebar.info("Aplikasi Monitoring Service Motor")
 
-    if st.session_state['logged_in']:
-        dashboard_page()
-    else:
-        # st.sidebar.title("MotoCare App") # Pindah ke atas/dihapus
-        
-        page = st.sidebar.radio("Pilih Aksi", ["Login Pengguna", "Daftar", "Login Admin"], key='main_nav_radio')
-
-        if page == "Daftar":
-            register_form(db)
-        elif page == "Login Pengguna":
-            login_form(db)
-        elif page == "Login Admin":
-            admin_login_form(db)
+    # Memastikan worker outbox email berjalan (dibuat sekali per proses)
+    get_email_outbox_worker()
+
+    with get_db() as db, get_sql_profiler().rerun("Login"):
+        try:
+            if st.session_state['logged_in']:
+                dashboard_page(db)
+            else:
+                # st.sidebar.title("MotoCare App") # Pindah ke atas/dihapus
+                
+                page = st.sidebar.radio("Pilih Aksi", ["Login Pengguna", "Daftar", "Login Admin"], key='main_nav_radio')
+                get_sql_profiler().set_page(page)
+
+                if page == "Daftar":
+                    register_form(db)
+                elif page == "Login Pengguna":
+                    login_form(db)
+                elif page == "Login Admin":
+                    admin_login_form(db)
+        except WriteQueueFullError:
+            st.error("Server sedang sibuk menyimpan data. Silakan coba lagi dalam beberapa detik.")
+        except PasswordHasherBusyError:
+            st.error("Server sedang sibuk memproses login. Silakan coba lagi dalam beberapa detik.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
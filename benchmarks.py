@@ -0,0 +1,314 @@
+"""Generator data sintetis dan micro-benchmark untuk helper database di bagian 2 app.py.
+
+Setiap titik skala dibuat sebagai file SQLite terpisah lewat migrasi aplikasi, lalu helper
+dijalankan terhadapnya dengan cache baca dikosongkan sebelum setiap panggilan. Untuk setiap
+helper dicatat waktu (rata-rata, p50, p95) dan jumlah query SQL per panggilan; hasilnya
+ditulis sebagai JSON agar dua run bisa dibandingkan. Dijalankan lewat manage.py:
+
+    python manage.py generate-data bench.db --users 1000 --motors-per-user 3 --services-per-motor 30
+    python manage.py bench-helpers --scale 100x2x10 --scale 1000x3x30 --output hasil.json
+    python manage.py bench-helpers --scale 1000x3x30 --compare hasil.json
+"""
+import base64
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import time
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import sessionmaker
+
+import app
+
+GENERATOR_CHUNK_SIZE = 10000 # baris per transaksi saat mengisi database
+GENERATOR_HISTORY_DAYS = 3 * 365 # riwayat service tersebar dalam rentang ini
+GENERATOR_PASSWORD = "benchmark"
+SERVICE_DESCRIPTIONS = [
+    "Ganti oli mesin", "Ganti oli gardan", "Servis CVT dan roller", "Ganti kampas rem depan",
+    "Ganti kampas rem belakang", "Ganti rantai dan gir", "Tune up dan bersihkan karburator",
+    "Ganti busi", "Ganti filter udara", "Ganti aki", "Ganti ban depan", "Ganti ban belakang",
+    "Servis berkala", "Ganti v-belt", "Kuras radiator",
+]
+MOTOR_MODELS = [
+    ("Honda", "Beat"), ("Honda", "Vario 125"), ("Honda", "PCX 160"), ("Yamaha", "NMAX"),
+    ("Yamaha", "Aerox"), ("Yamaha", "Mio M3"), ("Suzuki", "Nex II"), ("Kawasaki", "KLX 150"),
+]
+
+BENCH_DEFAULT_SCALES = ["100x2x10", "1000x3x30", "5000x4x50"] # user x motor per user x service per motor
+BENCH_SAMPLE_CALLS = 30 # panggilan per helper per titik skala
+BENCH_DELETE_CALLS = 5 # delete_user_and_data merusak data, jadi dijalankan paling akhir dan lebih sedikit
+BENCH_REGRESSION_RATIO = 1.25 # p50 lebih lambat dari ini (relatif baseline) dianggap regresi
+BENCH_MIN_REGRESSION_MS = 0.5 # selisih p50 di bawah ini diabaikan (derau pengukuran)
+
+
+def parse_scale(value):
+    """Mengubah "USERSxMOTORSxSERVICES" (contoh "1000x3x30") menjadi dict titik skala."""
+    try:
+        users, motors_per_user, services_per_motor = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Skala '{value}' harus berformat USERSxMOTORSxSERVICES, contoh 1000x3x30.")
+    return {"users": users, "motors_per_user": motors_per_user, "services_per_motor": services_per_motor}
+
+
+def _scale_label(scale):
+    return f"{scale['users']}x{scale['motors_per_user']}x{scale['services_per_motor']}"
+
+
+def _insert_chunked(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= GENERATOR_CHUNK_SIZE:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+
+def _iter_services(rng, motor_ids, services_per_motor, photo_bytes, photo_ratio, workshops, today):
+    """Riwayat service per motor: tanggal dan KM naik, deskripsi dan bengkel acak."""
+    photo = base64.b64encode(rng.randbytes(photo_bytes)).decode() if photo_bytes else None
+    for motor_id in motor_ids:
+        # Langkah antar-service maksimal 90 hari, jadi service terakhir tidak melewati hari ini
+        day = today - datetime.timedelta(days=services_per_motor * 90 + rng.randint(0, GENERATOR_HISTORY_DAYS))
+        km = rng.randint(0, 5000)
+        for _ in range(services_per_motor):
+            day += datetime.timedelta(days=rng.randint(20, 90))
+            km += rng.randint(500, 3000)
+            workshop_name, workshop_address = rng.choice(workshops)
+            yield {
+                "motor_id": motor_id,
+                "service_date": day.strftime("%Y-%m-%d"),
+                "service_on": day,
+                "km_at_service": km,
+                "description": rng.choice(SERVICE_DESCRIPTIONS),
+                "cost": rng.randrange(30000, 750000, 5000),
+                "workshop_name": workshop_name,
+                "workshop_address": workshop_address,
+                # Foto disimpan di kolom Base64 lama agar efek ukuran baris pada query terukur
+                "workshop_photo_base64": photo if photo and rng.random() < photo_ratio else None,
+            }
+
+
+def generate_database(path, users, motors_per_user, services_per_motor, photo_bytes=0, photo_ratio=0.2, seed=0):
+    """Membuat database SQLite sintetis di path (file lama ditimpa) dan mengembalikan engine-nya.
+
+    Skema dibuat oleh run_migrations; agregat, due_status, rollup biaya, dan katalog bengkel dibangun ulang
+    setelah pengisian, sama seperti database produksi setelah migrasi. photo_bytes > 0 mengisi
+    sekitar photo_ratio service dengan foto acak sebesar itu.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    engine = app.create_db_engine(f"sqlite:///{path}")
+    app.run_migrations(engine)
+
+    # Satu hash untuk semua user; hash per user akan mendominasi waktu pembuatan
+    password_hash = app.hash_password(GENERATOR_PASSWORD)
+    workshops = [(f"Bengkel Sintetis {i}", f"Jl. Uji No. {i}, {rng.choice(list(app.WORKSHOP_PLACES)).title()}") for i in range(200)]
+    motor_count = users * motors_per_user
+
+    with engine.begin() as conn:
+        _insert_chunked(conn, app.User.__table__, (
+            {"id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@bench.motocare.local",
+             "password": password_hash, "is_admin": user_id == 1}
+            for user_id in range(1, users + 1)
+        ))
+        _insert_chunked(conn, app.Motor.__table__, (
+            {"id": motor_id, "owner_id": (motor_id - 1) // motors_per_user + 1,
+             "brand": brand, "model": model, "year": rng.randint(2012, 2025),
+             "plate_number": f"B {motor_id} SYN", "current_km": 0}
+            for motor_id in range(1, motor_count + 1)
+            for brand, model in [rng.choice(MOTOR_MODELS)]
+        ))
+        _insert_chunked(conn, app.Schedule.__table__, (
+            {"motor_id": motor_id, "time_interval_months": rng.choice([2, 3, 6]), "km_interval": rng.choice([2000, 3000, 4000])}
+            for motor_id in range(1, motor_count + 1)
+        ))
+
+    motor_ids = range(1, motor_count + 1)
+    services = _iter_services(rng, motor_ids, services_per_motor, photo_bytes, photo_ratio, workshops, today)
+    while True:
+        chunk = [row for _, row in zip(range(GENERATOR_CHUNK_SIZE), services)]
+        if not chunk:
+            break
+        with engine.begin() as conn:
+            conn.execute(insert(app.Service.__table__), chunk)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "UPDATE motors SET current_km = COALESCE((SELECT MAX(km_at_service) FROM services "
+            "WHERE services.motor_id = motors.id), 0) + 300"
+        )
+    with sessionmaker(autocommit=False, autoflush=False, bind=engine)() as db:
+        app.rebuild_motor_service_stats(db)
+        app.refresh_all_due_status(db, only_stale=False)
+        app.rebuild_cost_rollup(db)
+        app.rebuild_workshop_index(db)
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return engine
+
+
+class QueryCounter:
+    """Menghitung statement SQL yang dieksekusi engine selama terpasang."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self.count = 0
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self._engine, "before_cursor_execute", self._before_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self._engine, "before_cursor_execute", self._before_execute)
+
+
+# (nama, fungsi(db, user_id, motor_id)); urutan ini juga urutan eksekusi
+BENCH_HELPERS = [
+    ("get_motors_by_owner", lambda db, user_id, motor_id: app.get_motors_by_owner(db, user_id)),
+    ("get_services_by_motor", lambda db, user_id, motor_id: app.get_services_by_motor(db, motor_id)),
+    ("get_total_service_cost", lambda db, user_id, motor_id: app.get_total_service_cost(db, motor_id)),
+    ("get_average_service_cost", lambda db, user_id, motor_id: app.get_average_service_cost(db, motor_id)),
+    ("calculate_next_service_date", lambda db, user_id, motor_id: app.calculate_next_service_date(db, motor_id)),
+    ("calculate_next_service_km", lambda db, user_id, motor_id: app.calculate_next_service_km(db, motor_id)),
+    ("get_service_reminders", lambda db, user_id, motor_id: app.get_service_reminders(db, user_id)),
+    ("delete_user_and_data", lambda db, user_id, motor_id: app.delete_user_and_data(db, user_id)),
+]
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _measure(session_factory, counter, helper, samples):
+    timings = []
+    queries = []
+    for user_id, motor_id in samples:
+        # Cache baca dikosongkan agar setiap panggilan benar-benar membaca database
+        app.get_read_cache().bump_all()
+        with session_factory() as db:
+            counter.count = 0
+            started = time.perf_counter()
+            helper(db, user_id, motor_id)
+            timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+            db.rollback()
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "p50_ms": round(_percentile(timings, 0.50), 4),
+        "p95_ms": round(_percentile(timings, 0.95), 4),
+        "queries_per_call": round(statistics.fmean(queries), 2),
+        "max_queries": max(queries),
+    }
+
+
+def run_helper_benchmarks(engine, scale, calls=BENCH_SAMPLE_CALLS, delete_calls=BENCH_DELETE_CALLS, seed=0):
+    """Menjalankan BENCH_HELPERS terhadap database hasil generate_database dengan skala scale."""
+    rng = random.Random(seed)
+    motors_per_user = scale["motors_per_user"]
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # ID motor dipakai ulang antar titik skala dengan pemilik berbeda; lupakan pemilik yang dicache
+    app.get_read_cache().forget_motors(motor_ids=range(1, scale["users"] * motors_per_user + 1))
+
+    # User yang dihapus dipisahkan dari sampel helper baca
+    user_ids = list(range(1, scale["users"] + 1))
+    rng.shuffle(user_ids)
+    delete_users = user_ids[:delete_calls]
+    read_users = user_ids[delete_calls:] or user_ids
+
+    def samples(count, users):
+        for _ in range(count):
+            user_id = rng.choice(users)
+            yield user_id, (user_id - 1) * motors_per_user + rng.randint(1, motors_per_user)
+
+    results = {}
+    with QueryCounter(engine) as counter:
+        for name, helper in BENCH_HELPERS:
+            if name == "delete_user_and_data":
+                helper_samples = [(user_id, None) for user_id in delete_users]
+            else:
+                helper_samples = list(samples(calls, read_users))
+            results[name] = _measure(session_factory, counter, helper, helper_samples)
+    return results
+
+
+def run_benchmark_suite(scales, workdir, calls=BENCH_SAMPLE_CALLS, photo_bytes=0, seed=0, keep=False):
+    """Membuat database untuk setiap titik skala, menjalankan benchmark, dan mengembalikan dict hasil."""
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "calls_per_helper": calls,
+        "scales": [],
+    }
+    for scale in scales:
+        path = os.path.join(workdir, f"bench_{_scale_label(scale)}.db")
+        started = time.perf_counter()
+        engine = generate_database(path, photo_bytes=photo_bytes, seed=seed, **scale)
+        generate_seconds = time.perf_counter() - started
+        try:
+            helpers = run_helper_benchmarks(engine, scale, calls=calls, seed=seed)
+        finally:
+            engine.dispose()
+        report["scales"].append({
+            "label": _scale_label(scale),
+            **scale,
+            "photo_bytes": photo_bytes,
+            "db_bytes": os.path.getsize(path),
+            "generate_seconds": round(generate_seconds, 2),
+            "helpers": helpers,
+        })
+        if not keep:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return report
+
+
+def compare_reports(baseline, current, ratio=BENCH_REGRESSION_RATIO, min_delta_ms=BENCH_MIN_REGRESSION_MS):
+    """Membandingkan dua hasil run; mengembalikan daftar (skala, helper, pesan) regresi.
+
+    Regresi: jumlah query per panggilan bertambah, atau p50 lebih lambat dari ratio kali
+    baseline dan selisihnya di atas min_delta_ms.
+    """
+    baseline_scales = {entry["label"]: entry for entry in baseline.get("scales", [])}
+    regressions = []
+    for entry in current.get("scales", []):
+        previous = baseline_scales.get(entry["label"])
+        if previous is None:
+            continue
+        for name, result in entry["helpers"].items():
+            before = previous["helpers"].get(name)
+            if before is None:
+                continue
+            if result["queries_per_call"] > before["queries_per_call"]:
+                regressions.append((entry["label"], name, f"query/panggilan {before['queries_per_call']} -> {result['queries_per_call']}"))
+            if result["p50_ms"] > before["p50_ms"] * ratio and result["p50_ms"] - before["p50_ms"] > min_delta_ms:
+                regressions.append((entry["label"], name, f"p50 {before['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms"))
+    return regressions
+
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+
+def read_report(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
@@ -0,0 +1,1432 @@
+"""Perintah pemeliharaan MotoCare yang dijalankan di luar Streamlit.
+
+Contoh:
+    python manage.py migrate
+    python manage.py migrate --status
+    python manage.py check-indexes
+    python manage.py check-reminder-queries --motors 5 50
+    python manage.py check-cache
+    python manage.py rebuild-stats
+    python manage.py send-outbox
+    python manage.py check-outbox --messages 200 --senders 3
+    python manage.py check-digests --users 200
+    python manage.py stress-writes --writers 16 --writes-per-writer 100
+    python manage.py soak-sessions --rounds 10 --threads 16
+    python manage.py bench-login --concurrency 1 4 16
+    python manage.py rebuild-stats --motor-id 3 --motor-id 7
+    python manage.py rebuild-rollup
+    python manage.py migrate-photos --batch-size 100
+    python manage.py rebuild-workshops
+    python manage.py check-workshops
+    python manage.py find-workshops "Jakarta Selatan" --radius 3000
+    python manage.py bench-workshop-client --concurrency 16
+    python manage.py search-services contoh@motocare.local "ganti rantai"
+    python manage.py check-search-pages --query "ganti oli"
+    python manage.py generate-data bench.db --users 1000 --motors-per-user 3 --services-per-motor 30
+    python manage.py bench-helpers --scale 100x2x10 --scale 1000x3x30 --output hasil.json
+"""
+import argparse
+import csv
+import datetime
+import email
+import json
+import os
+import socketserver
+import tempfile
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import sessionmaker
+
+import app
+import benchmarks
+
+
+def cmd_migrate(args):
+    """Menerapkan migrasi skema yang belum dijalankan."""
+    if args.status:
+        current_version = app.get_schema_version(app.engine)
+        for version, name, _ in app.MIGRATIONS:
+            mark = "x" if version <= current_version else " "
+            print(f"[{mark}] {version:04d} {name}")
+        return 0
+
+    applied = app.run_migrations(app.engine, target_version=args.to)
+    for version, name in applied:
+        print(f"Diterapkan: {version:04d} {name}")
+    print(f"Versi skema sekarang: {app.get_schema_version(app.engine)}")
+    return 0
+
+
+# Helper baca di bagian 2 app.py yang rencana query-nya harus memakai index
+INDEXED_HELPERS = [
+    ("get_user_by_email", lambda db: app.get_user_by_email(db, "contoh@motocare.local")),
+    ("get_user_count", lambda db: app.get_user_count(db)),
+    ("get_admin_count", lambda db: app.get_admin_count(db)),
+    ("get_motors_by_owner", lambda db: app.get_motors_by_owner(db, 1)),
+    ("get_services_by_motor", lambda db: app.get_services_by_motor(db, 1)),
+    ("get_services_page", lambda db: app.get_services_page(db, 1, cursor=(datetime.date(2025, 1, 1), 100))),
+    ("get_total_service_cost", lambda db: app.get_total_service_cost(db, 1)),
+    ("get_average_service_cost", lambda db: app.get_average_service_cost(db, 1)),
+    ("get_schedule_by_motor", lambda db: app.get_schedule_by_motor(db, 1)),
+    ("calculate_next_service_date", lambda db: app.calculate_next_service_date(db, 1)),
+    ("calculate_next_service_km", lambda db: app.calculate_next_service_km(db, 1)),
+    ("get_service_reminders", lambda db: app.get_service_reminders(db, 1)),
+    ("get_cost_analytics", lambda db: app.get_cost_analytics(db, 1)),
+    ("search_services", lambda db: app.search_services(db, 1, "ganti oli")),
+    ("find_workshops_within", lambda db: app.find_workshops_within(db, -6.175110, 106.865036, 5000)),
+]
+
+
+def _capture_statements(helper):
+    """Menjalankan helper dan mengembalikan semua (statement, parameter) yang dieksekusinya."""
+    captured = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    # Cache baca dikosongkan agar query helper benar-benar dieksekusi
+    app.get_read_cache().bump_all()
+    event.listen(app.engine, "before_cursor_execute", before_execute)
+    try:
+        with app.SessionLocal() as db:
+            helper(db)
+            db.rollback()
+    finally:
+        event.remove(app.engine, "before_cursor_execute", before_execute)
+    return captured
+
+
+def _uses_full_scan(plan_detail):
+    # "SCAN users USING COVERING INDEX ..." tetap memakai index; "SCAN users" saja berarti full table scan
+    return plan_detail.startswith("SCAN ") and "INDEX" not in plan_detail
+
+
+def cmd_check_indexes(args):
+    """Memastikan setiap query helper bagian 2 memakai index (EXPLAIN QUERY PLAN)."""
+    failures = 0
+    with app.engine.connect() as conn:
+        for name, helper in INDEXED_HELPERS:
+            for statement, parameters in _capture_statements(helper):
+                plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+                details = [row[-1] for row in plan]
+                full_scans = [detail for detail in details if _uses_full_scan(detail)]
+                status = "GAGAL" if full_scans else "OK"
+                failures += bool(full_scans)
+                print(f"[{status}] {name}: {' | '.join(details)}")
+    if failures:
+        print(f"{failures} query masih melakukan full table scan.")
+        return 1
+    print("Semua query helper memakai index.")
+    return 0
+
+
+def _scratch_session(workdir, users, motors_per_user, services_per_motor):
+    """Database sintetis sementara (generate_database) dan session untuknya; cache baca dikosongkan."""
+    path = os.path.join(workdir, f"check_{users}x{motors_per_user}x{services_per_motor}.db")
+    engine = benchmarks.generate_database(path, users, motors_per_user, services_per_motor)
+    cache = app.get_read_cache()
+    cache.bump_all()
+    # ID motor database sementara bisa bertabrakan dengan database sebelumnya
+    cache.forget_motors(motor_ids=range(1, users * motors_per_user + 100))
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@contextmanager
+def _app_sessions_bound_to(engine):
+    """Mengarahkan app.SessionLocal (dan get_db) sementara ke engine lain, misalnya database sementara."""
+    app.SessionLocal.configure(bind=engine)
+    try:
+        yield
+    finally:
+        app.SessionLocal.configure(bind=app.engine)
+
+
+def cmd_check_reminder_queries(args):
+    """Memastikan get_service_reminders memakai jumlah query tetap berapa pun banyaknya motor.
+
+    Nilai jatuh tempo setiap motor juga dibandingkan dengan calculate_next_service_date/_km.
+    """
+    query_counts = []
+    mismatches = 0
+    with tempfile.TemporaryDirectory(prefix="motocare-check-") as workdir:
+        for motors in args.motors:
+            engine, session_factory = _scratch_session(workdir, 1, motors, args.services_per_motor)
+            try:
+                with session_factory() as db:
+                    # Satu motor tanpa riwayat service agar cabang "belum pernah service" ikut diperiksa
+                    app.create_new_motor(db, 1, "Cek", "Tanpa Service", 2024, 1500, "CEK 1")
+                app.get_read_cache().bump_all()
+
+                with session_factory() as db, benchmarks.QueryCounter(engine) as counter:
+                    reminders = app.get_service_reminders(db, 1)
+                    query_counts.append(counter.count)
+                with session_factory() as db:
+                    for reminder in reminders:
+                        motor_id = reminder["motor"].id
+                        expected = (app.calculate_next_service_date(db, motor_id), app.calculate_next_service_km(db, motor_id))
+                        if (reminder["next_date"], reminder["next_km"]) != expected:
+                            mismatches += 1
+                            print(f"  motor {motor_id}: pengingat {reminder['next_date']}/{reminder['next_km']}, "
+                                  f"fungsi skalar {expected[0]}/{expected[1]}")
+            finally:
+                engine.dispose()
+            print(f"{motors + 1:5d} motor: {query_counts[-1]} query, {len(reminders)} pengingat")
+
+    if len(set(query_counts)) > 1:
+        print(f"GAGAL: jumlah query berubah mengikuti jumlah motor ({query_counts}).")
+        return 1
+    if mismatches:
+        print(f"GAGAL: {mismatches} pengingat berbeda dari calculate_next_service_date/_km.")
+        return 1
+    print("Jumlah query pengingat tetap dan nilainya cocok dengan fungsi skalar.")
+    return 0
+
+
+# Helper baca yang dicache per user: (nama, fungsi(helper, db, user_id, motor_ids))
+CACHED_READERS = [
+    ("get_motors_by_owner", lambda helper, db, user_id, motor_ids: helper(db, user_id)),
+    ("get_total_service_cost", lambda helper, db, user_id, motor_ids: [helper(db, motor_id) for motor_id in motor_ids]),
+    ("get_average_service_cost", lambda helper, db, user_id, motor_ids: [helper(db, motor_id) for motor_id in motor_ids]),
+    ("get_schedule_by_motor", lambda helper, db, user_id, motor_ids: [helper(db, motor_id) for motor_id in motor_ids]),
+    ("get_cost_analytics", lambda helper, db, user_id, motor_ids: helper(db, user_id)),
+    ("get_service_reminders", lambda helper, db, user_id, motor_ids: helper(db, user_id)),
+    ("forecast_fleet", lambda helper, db, user_id, motor_ids: helper(db, user_id)),
+]
+
+
+def _snapshot(value):
+    """Bentuk pembanding nilai helper: objek ORM jadi nilai kolom, array NumPy jadi list, NaN jadi teks."""
+    if isinstance(value, app.Base):
+        return (type(value).__name__, [_snapshot(getattr(value, attr.key)) for attr in inspect(value).mapper.column_attrs])
+    if isinstance(value, app.np.ndarray):
+        return _snapshot(value.tolist())
+    if isinstance(value, app.np.generic):
+        return _snapshot(value.item())
+    if isinstance(value, dict):
+        return {key: _snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_snapshot(item) for item in value]
+    if isinstance(value, float) and value != value:
+        return "nan"
+    return value
+
+
+def _stale_cached_readers(session_factory, user_ids, motor_ids_before):
+    """Membandingkan hasil cache setiap helper dengan hasil yang dihitung ulang tanpa cache."""
+    stale = []
+    for user_id in user_ids:
+        with session_factory() as db:
+            motor_ids = sorted(set(motor_ids_before[user_id]) | {motor.id for motor in app.get_motors_by_owner.__wrapped__(db, user_id)})
+        for name, call in CACHED_READERS:
+            helper = getattr(app, name)
+            with session_factory() as db:
+                cached = _snapshot(call(helper, db, user_id, motor_ids))
+            with session_factory() as db:
+                fresh = _snapshot(call(helper.__wrapped__, db, user_id, motor_ids))
+            if cached != fresh:
+                stale.append(f"{name}(user {user_id})")
+    return stale
+
+
+def cmd_check_cache(args):
+    """Memastikan setiap mutator menginvalidasi cache baca: hasil cache harus sama dengan hasil baru.
+
+    Sebelum setiap mutator semua helper cache diisi; sesudahnya hasil cache dibandingkan dengan
+    hasil yang dihitung langsung dari database. Untuk rebuild_* data turunan sengaja dirusak
+    dulu (seperti drift), lalu cache diisi dengan nilai rusak itu sebelum rebuild dijalankan.
+    """
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    with tempfile.TemporaryDirectory(prefix="motocare-check-") as workdir:
+        engine, session_factory = _scratch_session(workdir, 2, 2, 3)
+        user_ids = [1, 2]
+        state = {}
+
+        def tamper(sql):
+            with engine.begin() as conn:
+                conn.exec_driver_sql(sql)
+
+        def new_motor(db):
+            state["motor_id"] = app.create_new_motor(db, 1, "Cek", "Cache", 2024, 1000, "CEK 2").id
+
+        def new_service(db):
+            state["service_id"] = app.create_new_service(db, state["motor_id"], today, 1800, "Ganti oli", 55000, "Bengkel Cek", "-").id
+
+        import_rows = [
+            (2, {"service_date": today, "km_at_service": "2100", "description": "Ganti busi", "cost": "25.000", "workshop_name": "Bengkel Cek"}),
+            (3, {"service_date": today, "km_at_service": "2300", "description": "Ganti kampas rem", "cost": "80000", "workshop_name": "Bengkel Lain"}),
+        ]
+        # (nama, perusakan data sebelum cache diisi atau None, mutator(db))
+        steps = [
+            ("create_new_motor", None, new_motor),
+            ("create_new_service", None, new_service),
+            ("update_motor_km", None, lambda db: app.update_motor_km(db, state["motor_id"], 2000)),
+            ("update_motor_schedule", None, lambda db: app.update_motor_schedule(db, state["motor_id"], 3, 3000)),
+            ("import_services", None, lambda db: app.import_services(db, 1, iter(import_rows), default_motor_id=state["motor_id"])),
+            ("delete_service_record", None, lambda db: app.delete_service_record(db, state["service_id"])),
+            ("rebuild_motor_service_stats", "UPDATE motor_service_stats SET cost_sum = cost_sum + 1",
+             lambda db: app.rebuild_motor_service_stats(db)),
+            ("rebuild_cost_rollup", "UPDATE service_cost_rollup SET cost_sum = cost_sum + 1",
+             lambda db: app.rebuild_cost_rollup(db)),
+            ("refresh_all_due_status", "UPDATE due_status SET next_km = next_km + 1",
+             lambda db: app.refresh_all_due_status(db, only_stale=False)),
+            ("delete_motor", None, lambda db: app.delete_motor(db, state["motor_id"])),
+            ("delete_user_and_data", None, lambda db: app.delete_user_and_data(db, 2)),
+            ("delete_users_and_data", None, lambda db: app.delete_users_and_data(db, [1])),
+        ]
+
+        failures = 0
+        try:
+            # Hasil pertama tetap milik session pemanggil; yang disimpan di cache adalah salinannya
+            app.get_read_cache().bump_all()
+            with session_factory() as db:
+                motors = app.get_motors_by_owner(db, 1)
+                attached = all(motor in db and db.get(app.Motor, motor.id) is motor for motor in motors)
+                cached = app.get_motors_by_owner(db, 1)
+                copies = not any(motor in db for motor in cached) and (
+                    [(m.id, m.brand, m.current_km) for m in cached] == [(m.id, m.brand, m.current_km) for m in motors]
+                )
+            failures += not (attached and copies)
+            print(f"[{'OK' if attached and copies else 'GAGAL'}] objek pemanggil tetap di session "
+                  f"(asli terpasang={attached}, hasil cache berupa salinan={copies})")
+
+            for name, tamper_sql, mutate in steps:
+                if tamper_sql:
+                    tamper(tamper_sql)
+                # Cache dikosongkan agar setiap mutator dinilai sendiri, lalu diisi dengan hasil sebelum mutator
+                app.get_read_cache().bump_all()
+                motor_ids_before = {}
+                for user_id in user_ids:
+                    with session_factory() as db:
+                        motor_ids_before[user_id] = [motor.id for motor in app.get_motors_by_owner(db, user_id)]
+                        for reader_name, call in CACHED_READERS:
+                            call(getattr(app, reader_name), db, user_id, motor_ids_before[user_id])
+                with session_factory() as db:
+                    mutate(db)
+                stale = _stale_cached_readers(session_factory, user_ids, motor_ids_before)
+                failures += bool(stale)
+                print(f"[{'GAGAL' if stale else 'OK'}] {name}" + (f": cache basi di {', '.join(stale)}" if stale else ""))
+        finally:
+            engine.dispose()
+
+    if failures:
+        print(f"{failures} mutator meninggalkan hasil cache yang basi.")
+        return 1
+    print("Semua mutator menginvalidasi cache baca dengan benar.")
+    return 0
+
+
+def cmd_rebuild_stats(args):
+    """Menghitung ulang agregat service per motor dari tabel services."""
+    with app.SessionLocal() as db:
+        count = app.rebuild_motor_service_stats(db, motor_ids=args.motor_id or None)
+        # Status jatuh tempo diturunkan dari agregat, jadi ikut dihitung ulang
+        if args.motor_id:
+            with app.write_transaction(db):
+                app.refresh_due_status(db, args.motor_id)
+                db.commit()
+            app.get_read_cache().bump_all()
+        else:
+            app.refresh_all_due_status(db, only_stale=False)
+    print(f"Agregat service dibangun ulang untuk {count} motor.")
+    return 0
+
+
+def cmd_rebuild_rollup(args):
+    """Menghitung ulang rollup biaya bulanan (motor x bulan x bengkel) dari tabel services."""
+    started = time.perf_counter()
+    with app.SessionLocal() as db:
+        count = app.rebuild_cost_rollup(db, motor_ids=args.motor_id or None)
+    print(f"Rollup biaya dibangun ulang: {count} baris dalam {time.perf_counter() - started:.2f} dtk.")
+    return 0
+
+
+def cmd_refresh_due_status(args):
+    """Job harian: menggulirkan status jatuh tempo semua motor ke tanggal hari ini."""
+    today = datetime.datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    started = time.perf_counter()
+    with app.SessionLocal() as db:
+        count = app.refresh_all_due_status(db, today=today, only_stale=not args.all, chunk_size=args.chunk_size)
+        counts = dict(db.query(app.MotorDueStatus.status, app.func.count()).group_by(app.MotorDueStatus.status).all())
+    print(f"Status jatuh tempo diperbarui untuk {count} motor dalam {time.perf_counter() - started:.2f} dtk.")
+    print("Status: " + ", ".join(f"{status}={total}" for status, total in sorted(counts.items())))
+    return 0
+
+
+def cmd_forecast(args):
+    """Menjalankan prakiraan jatuh tempo armada dan (opsional) membandingkannya dengan fungsi skalar."""
+    today = datetime.date.today()
+    with app.SessionLocal() as db:
+        owner_id = None
+        if args.email:
+            user = app.get_user_by_email(db, args.email)
+            if user is None:
+                print(f"Pengguna {args.email} tidak ditemukan.")
+                return 1
+            owner_id = user.id
+        started = time.perf_counter()
+        forecast = app.forecast_fleet(db, owner_id, today)
+        elapsed = time.perf_counter() - started
+
+        km_per_day = forecast["km_per_day"]
+        print(f"Prakiraan {len(forecast['motor_id'])} motor dalam {elapsed * 1000:.0f} ms.")
+        print(f"Motor dengan laju KM: {int(app.np.isfinite(km_per_day).sum())}, "
+              f"median {app.np.nanmedian(km_per_day) if app.np.isfinite(km_per_day).any() else 0:.1f} km/hari; "
+              f"jatuh tempo KM lebih awal dari kalender: {int((forecast['km_due'] < forecast['calendar_due']).sum())}")
+
+        if args.verify:
+            rows = (
+                db.query(app.Motor.id, app.Motor.current_km, app.Schedule.time_interval_months, app.Schedule.km_interval,
+                         app.MotorServiceStats.last_service_date, app.MotorServiceStats.max_km_at_service,
+                         app.MotorServiceStats.service_count)
+                .outerjoin(app.Schedule, app.Schedule.motor_id == app.Motor.id)
+                .outerjoin(app.MotorServiceStats, app.MotorServiceStats.motor_id == app.Motor.id)
+                .order_by(app.Motor.id)
+            )
+            if owner_id is not None:
+                rows = rows.filter(app.Motor.owner_id == owner_id)
+            mismatches = 0
+            for index, (motor_id, *inputs) in enumerate(rows.all()):
+                next_date, next_km, _ = app._compute_due(*inputs, today)
+                if forecast["calendar_due"][index].item() != next_date or forecast["next_km"][index] != next_km:
+                    mismatches += 1
+            print(f"Verifikasi terhadap fungsi skalar: {mismatches} selisih dari {len(forecast['motor_id'])} motor.")
+            return 0 if not mismatches else 2
+    return 0
+
+
+def cmd_migrate_photos(args):
+    """Memindahkan foto Base64 lama ke penyimpanan foto berbasis SHA-256."""
+    with app.SessionLocal() as db:
+        count = app.migrate_photos_to_blob_store(db, batch_size=args.batch_size)
+    print(f"{count} foto dipindahkan ke '{app.PHOTO_STORE_DIR}'.")
+    return 0
+
+
+def cmd_make_thumbnails(args):
+    """Membuat thumbnail untuk foto lama yang belum memilikinya."""
+    with app.SessionLocal() as db:
+        count = app.backfill_photo_thumbnails(db, batch_size=args.batch_size)
+    print(f"{count} thumbnail dibuat.")
+    return 0
+
+
+def cmd_gc_photos(args):
+    """Menghapus file foto yang tidak lagi dirujuk oleh service mana pun."""
+    with app.SessionLocal() as db:
+        count = app.remove_orphan_photo_blobs(db)
+    print(f"{count} file foto yatim dihapus.")
+    return 0
+
+
+def cmd_rebuild_search(args):
+    """Membangun ulang index teks penuh riwayat service dari tabel services."""
+    started = time.perf_counter()
+    app.rebuild_service_fts(app.engine)
+    print(f"Index pencarian service dibangun ulang dalam {time.perf_counter() - started:.2f} dtk.")
+    return 0
+
+
+def cmd_search_services(args):
+    """Mencari riwayat service satu pengguna dan menampilkan waktu query-nya."""
+    with app.SessionLocal() as db:
+        user = app.get_user_by_email(db, args.email)
+        if user is None:
+            print(f"Pengguna {args.email} tidak ditemukan.")
+            return 1
+        started = time.perf_counter()
+        results, next_cursor = app.search_services(db, user.id, args.query, page_size=args.page_size)
+        elapsed = time.perf_counter() - started
+    print(f"{len(results)} hasil{' (ada halaman berikutnya)' if next_cursor else ''} dalam {elapsed * 1000:.2f} ms")
+    for result in results:
+        print(f"  {result['score']:7.2f}  {result['service_date']}  {result['brand']} {result['model']}: {result['description']}")
+    return 0
+
+
+def cmd_check_search_pages(args):
+    """Membuka semua halaman hasil pencarian sambil menulis service di antara halaman (database sementara).
+
+    Setiap halaman berikutnya didahului service baru yang cocok (relevansinya tertinggi) dan
+    penghapusan satu hasil yang belum tampil. Semua hasil awal yang tidak dihapus harus tampil
+    tepat sekali, tanpa hasil baru di tengah penelusuran.
+    """
+    with tempfile.TemporaryDirectory(prefix="motocare-search-") as workdir:
+        engine, session_factory = _scratch_session(workdir, 1, args.motors, args.services_per_motor)
+        try:
+            with session_factory() as db:
+                expression = app._service_search_expression(1, args.query)
+                initial_ids = set(db.execute(
+                    app.text("SELECT rowid FROM service_fts WHERE service_fts MATCH :expression"),
+                    {"expression": expression},
+                ).scalars())
+                if not initial_ids or len(initial_ids) > app.SERVICE_SEARCH_MAX_RESULTS:
+                    print(f"Jumlah hasil awal {len(initial_ids)} harus 1..{app.SERVICE_SEARCH_MAX_RESULTS}; ubah ukuran data.")
+                    return 1
+
+                shown, deleted, added = [], set(), set()
+                results, cursor = app.search_services(db, 1, args.query, page_size=args.page_size)
+                shown += [row["id"] for row in results]
+                pages = 1
+                while cursor is not None:
+                    added.add(app.create_new_service(
+                        db, 1, "2025-01-01", 100, f"{args.query} {args.query} {args.query}", 1000, "Bengkel Uji", "-",
+                    ).id)
+                    not_yet_shown = sorted(initial_ids - deleted - set(shown))
+                    if not_yet_shown:
+                        app.delete_service_record(db, not_yet_shown[0])
+                        deleted.add(not_yet_shown[0])
+                    results, cursor = app.search_services(db, 1, args.query, cursor=cursor, page_size=args.page_size)
+                    shown += [row["id"] for row in results]
+                    pages += 1
+        finally:
+            engine.dispose()
+
+    duplicates = len(shown) - len(set(shown))
+    missing = initial_ids - deleted - set(shown)
+    unexpected = set(shown) - initial_ids
+    ok = not duplicates and not missing and not unexpected
+    print(f"[{'OK' if ok else 'GAGAL'}] {pages} halaman, {len(initial_ids)} hasil awal: tampil={len(shown)} "
+          f"ganda={duplicates} terlewat={len(missing)} tak terduga={len(unexpected)} "
+          f"(ditulis di antara halaman: {len(added)} baru, {len(deleted)} dihapus)")
+    return 0 if ok else 1
+
+
+def cmd_rebuild_workshops(args):
+    """Membangun ulang katalog bengkel (dataset bawaan + riwayat service) dan index R*Tree-nya."""
+    started = time.perf_counter()
+    with app.SessionLocal() as db:
+        counts = app.rebuild_workshop_index(db, dataset_path=args.dataset)
+    print(f"Katalog bengkel: {counts['katalog']} dari dataset, {counts['riwayat']} dari riwayat service "
+          f"({time.perf_counter() - started:.2f} dtk).")
+    return 0
+
+
+def _workshop_catalogue(db):
+    """Isi katalog bengkel tanpa id (id berubah setiap rebuild) dan apakah R*Tree berisi id yang sama."""
+    rows = sorted(db.query(
+        app.Workshop.source, app.Workshop.name_key, app.Workshop.city, app.Workshop.lat, app.Workshop.lng,
+        app.Workshop.visit_count,
+    ).all())
+    workshop_ids = set(db.execute(app.select(app.Workshop.id)).scalars())
+    rtree_ids = set(db.execute(app.text("SELECT id FROM workshop_rtree")).scalars())
+    return rows, workshop_ids == rtree_ids
+
+
+def cmd_check_workshops(args):
+    """Memastikan katalog bengkel yang diperbarui per penulisan sama dengan hasil rebuild_workshop_index.
+
+    Setiap penulisan service (termasuk hapus motor dan hapus user) dijalankan di database
+    sementara, lalu katalognya dibandingkan dengan katalog yang dibangun ulang dari nol.
+    """
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    with tempfile.TemporaryDirectory(prefix="motocare-workshops-") as workdir:
+        engine, session_factory = _scratch_session(workdir, 3, 2, args.services_per_motor)
+        state = {}
+
+        def new_service(db):
+            state["service_id"] = app.create_new_service(
+                db, 1, today, 5000, "Ganti oli", 55000, "Bengkel Cek Baru", "Jl. Cek No. 1, Bandung",
+            ).id
+
+        import_rows = [
+            (2, {"service_date": today, "km_at_service": "5100", "description": "Ganti busi", "cost": "25000",
+                 "workshop_name": "Bengkel Sintetis 1", "workshop_address": "Jl. Uji No. 1, Jakarta"}),
+            (3, {"service_date": today, "km_at_service": "5200", "description": "Ganti rantai", "cost": "90000",
+                 "workshop_name": "Bengkel Impor Cek", "workshop_address": "Jl. Cek No. 2, Surabaya"}),
+        ]
+        steps = [
+            ("create_new_service", new_service),
+            ("import_services", lambda db: app.import_services(db, 1, iter(import_rows), default_motor_id=1)),
+            ("delete_service_record", lambda db: app.delete_service_record(db, state["service_id"])),
+            ("delete_motor", lambda db: app.delete_motor(db, 1)),
+            ("delete_user_and_data", lambda db: app.delete_user_and_data(db, 2)),
+            ("delete_users_and_data", lambda db: app.delete_users_and_data(db, [1, 3])),
+        ]
+        failures = 0
+        try:
+            for name, mutate in steps:
+                with session_factory() as db:
+                    mutate(db)
+                with session_factory() as db:
+                    incremental, rtree_in_step = _workshop_catalogue(db)
+                    app.rebuild_workshop_index(db)
+                    rebuilt, _ = _workshop_catalogue(db)
+                ok = incremental == rebuilt and rtree_in_step
+                failures += not ok
+                differing = len(set(incremental) ^ set(rebuilt))
+                print(f"[{'OK' if ok else 'GAGAL'}] {name}: {len(incremental)} bengkel, beda dari rebuild={differing}, "
+                      f"R*Tree sinkron={rtree_in_step}")
+        finally:
+            engine.dispose()
+    return 1 if failures else 0
+
+
+def cmd_find_workshops(args):
+    """Mencari bengkel dalam radius dan k-terdekat dari sebuah lokasi, beserta waktu query-nya."""
+    with app.SessionLocal() as db:
+        try:
+            started = time.perf_counter()
+            (lat, lng), within = app.search_nearby_workshops(db, args.location, args.radius)
+            within_ms = (time.perf_counter() - started) * 1000
+        except ValueError as e:
+            print(e)
+            return 1
+        started = time.perf_counter()
+        nearest = app.find_nearest_workshops(db, lat, lng, k=args.k)
+        nearest_ms = (time.perf_counter() - started) * 1000
+
+    print(f"Lokasi: {lat:.6f}, {lng:.6f}")
+    print(f"Dalam radius {args.radius} m: {len(within)} bengkel ({within_ms:.2f} ms)")
+    for workshop in within:
+        print(f"  {workshop['distance_m']:8.0f} m  {workshop['rating'] or '-':>3}  {workshop['name']}")
+    print(f"{args.k} terdekat ({nearest_ms:.2f} ms):")
+    for workshop in nearest:
+        print(f"  {workshop['distance_m']:8.0f} m  {workshop['rating'] or '-':>3}  {workshop['name']}")
+    return 0
+
+
+def _start_places_stand_in(delay_seconds):
+    """Server HTTP lokal berformat Google Places Nearby Search yang menghitung permintaan masuk."""
+    counter = {"requests": 0}
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with counter_lock:
+                counter["requests"] += 1
+            time.sleep(delay_seconds)
+            body = json.dumps({"status": "OK", "results": [
+                {"name": f"Bengkel Uji {i}", "vicinity": f"Jl. Uji No. {i}", "rating": 4.0 + i / 10,
+                 "geometry": {"location": {"lat": -6.175 + i / 1000, "lng": 106.865 + i / 1000}}}
+                for i in range(5)
+            ]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counter
+
+
+def cmd_bench_workshop_client(args):
+    """Menguji WorkshopLookupClient terhadap server pengganti lokal: penggabungan, cache memori, dan cache disk."""
+    server, counter = _start_places_stand_in(args.delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/nearbysearch/json"
+    disk_cache_path = os.path.join(tempfile.mkdtemp(prefix="motocare-places-"), "cache.db")
+    failures = 0
+
+    def check(label, expected_requests, elapsed):
+        nonlocal failures
+        ok = counter["requests"] == expected_requests
+        failures += not ok
+        print(f"[{'OK' if ok else 'GAGAL'}] {label}: permintaan ke server={counter['requests']} "
+              f"(harapan {expected_requests}), {elapsed * 1000:.1f} ms")
+
+    try:
+        client = app.WorkshopLookupClient(base_url=base_url, disk_cache_path=disk_cache_path)
+        threads = [
+            threading.Thread(target=client.lookup, args=("kunci-uji", -6.17511, 106.865036, 5000))
+            for _ in range(args.concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        check(f"{args.concurrency} pencarian identik bersamaan", 1, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        client.lookup("kunci-uji", -6.17549, 106.86521, 5000) # dibulatkan ke kunci yang sama
+        check("pencarian ulang dari titik berdekatan (cache memori)", 1, time.perf_counter() - started)
+
+        restarted = app.WorkshopLookupClient(base_url=base_url, disk_cache_path=disk_cache_path)
+        started = time.perf_counter()
+        restarted.lookup("kunci-uji", -6.17511, 106.865036, 5000)
+        check("klien baru setelah restart (cache disk)", 1, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        restarted.lookup("kunci-uji", -6.17511, 106.865036, 3000)
+        check("radius berbeda", 2, time.perf_counter() - started)
+        print(f"Statistik klien pertama: {client.stats()}; klien kedua: {restarted.stats()}")
+    finally:
+        server.shutdown()
+    return 1 if failures else 0
+
+
+def cmd_import_services(args):
+    """Mengimpor riwayat service dari file CSV/XLSX untuk motor milik satu pengguna."""
+    with app.SessionLocal() as db:
+        user = app.get_user_by_email(db, args.email)
+        if user is None:
+            print(f"Pengguna {args.email} tidak ditemukan.")
+            return 1
+        started = time.perf_counter()
+        with open(args.file, "rb") as file:
+            try:
+                report = app.import_services(
+                    db, user.id, app.iter_import_rows(file, args.file),
+                    default_motor_id=args.motor_id, batch_size=args.batch_size,
+                )
+            except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+                print(f"Impor dihentikan: {str(exc).rstrip('.')}. Baris yang sudah diimpor sebelumnya tetap tersimpan.")
+                return 1
+        elapsed = time.perf_counter() - started
+    rate = report["inserted"] / elapsed if elapsed else 0
+    print(f"Diimpor: {report['inserted']} baris dalam {elapsed:.2f} dtk ({rate:,.0f} baris/dtk)")
+    print(f"KM motor diperbarui: {report['motors_km_updated']}, baris gagal: {report['error_count']}")
+    for row_number, message in report["errors"][:args.show_errors]:
+        print(f"  baris {row_number}: {message}")
+    return 0 if not report["error_count"] else 2
+
+
+def cmd_export(args):
+    """Mengekspor data satu pengguna (atau seluruh database) ke arsip ZIP."""
+    with app.SessionLocal() as db:
+        owner_id = None
+        if args.email:
+            user = app.get_user_by_email(db, args.email)
+            if user is None:
+                print(f"Pengguna {args.email} tidak ditemukan.")
+                return 1
+            owner_id = user.id
+        started = time.perf_counter()
+        with open(args.output, "wb") as fileobj:
+            counts = app.write_export_archive(
+                db, fileobj, owner_id=owner_id, fmt=args.format,
+                include_photos=args.photos, chunk_size=args.chunk_size,
+            )
+        elapsed = time.perf_counter() - started
+    print(f"Ekspor selesai dalam {elapsed:.2f} dtk -> {args.output}")
+    print(", ".join(f"{name}={count}" for name, count in counts.items()))
+    return 0
+
+
+def cmd_send_outbox(args):
+    """Mengirim semua email outbox yang jatuh tempo (untuk cron atau pengujian dengan SMTP lokal)."""
+    total_sent = total_failed = 0
+    with app.SessionLocal() as db:
+        while True:
+            sent, failed = app.deliver_pending_emails(db, batch_size=args.batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < args.batch_size or failed:
+                break
+        counts = dict(db.query(app.EmailOutbox.status, app.func.count()).group_by(app.EmailOutbox.status).all())
+    print(f"Terkirim: {total_sent}, gagal (akan dicoba ulang/berhenti): {total_failed}")
+    print("Status outbox: " + ", ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+    return 0
+
+
+def cmd_send_digests(args):
+    """Job harian: antrekan digest pengingat per pemilik lalu kirim lewat outbox."""
+    today = datetime.datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    statuses = ("overdue", "due_soon") if args.include_due_soon else app.DIGEST_STATUSES
+    started = time.perf_counter()
+    with app.SessionLocal() as db:
+        queued = app.queue_reminder_digests(db, today=today, statuses=statuses, chunk_size=args.chunk_size, workers=args.workers)
+        print(f"Digest diantrekan: {queued} ({time.perf_counter() - started:.2f} dtk).")
+        if args.no_send:
+            return 0
+
+        total_sent = total_failed = 0
+        while True:
+            # Satu koneksi SMTP per batch; batch besar berarti satu koneksi untuk seluruh digest
+            sent, failed = app.deliver_pending_emails(db, batch_size=args.batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < args.batch_size or failed:
+                break
+    print(f"Terkirim: {total_sent}, gagal (akan dicoba ulang): {total_failed} ({time.perf_counter() - started:.2f} dtk total).")
+    return 0 if not total_failed else 2
+
+
+def _start_smtp_stand_in(fail_first=0):
+    """Server SMTP lokal minimal yang mencatat jumlah email diterima per penerima (header To).
+
+    fail_first email pertama ditolak dengan 451 (gagal sementara) agar jalur percobaan ulang teruji.
+    """
+    state = {"fail_remaining": fail_first, "rejected": 0}
+    delivered = Counter()
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(line.encode() + b"\r\n")
+
+        def accept_message(self, raw):
+            recipient = email.message_from_bytes(raw)["To"]
+            with lock:
+                if state["fail_remaining"] > 0:
+                    state["fail_remaining"] -= 1
+                    state["rejected"] += 1
+                    return False
+                delivered[recipient] += 1
+                return True
+
+        def handle(self):
+            self.reply("220 motocare-uji ESMTP")
+            data_lines = None
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                if data_lines is not None:
+                    if line.rstrip(b"\r\n") == b".":
+                        accepted = self.accept_message(b"".join(data_lines))
+                        data_lines = None
+                        self.reply("250 OK" if accepted else "451 Coba lagi nanti (uji)")
+                    else:
+                        data_lines.append(line[1:] if line.startswith(b"..") else line)
+                    continue
+                command = line[:4].upper()
+                if command in (b"EHLO", b"HELO"):
+                    self.reply("250 motocare-uji")
+                elif command == b"DATA":
+                    data_lines = []
+                    self.reply("354 Akhiri dengan <CRLF>.<CRLF>")
+                elif command == b"QUIT":
+                    self.reply("221 Sampai jumpa")
+                    return
+                else: # MAIL, RCPT, RSET, NOOP
+                    self.reply("250 OK")
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, delivered, state
+
+
+@contextmanager
+def _app_settings(**values):
+    """Mengganti sementara konstanta konfigurasi modul app (misalnya SMTP ke server pengganti lokal)."""
+    previous = {name: getattr(app, name) for name in values}
+    for name, value in values.items():
+        setattr(app, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(app, name, value)
+
+
+def _smtp_settings_for(server, **extra):
+    return dict(SMTP_SERVER="127.0.0.1", SMTP_PORT=server.server_address[1], SMTP_USE_TLS=False, SENDER_PASSWORD="", **extra)
+
+
+def _outbox_status_counts(db):
+    return dict(db.query(app.EmailOutbox.status, app.func.count()).group_by(app.EmailOutbox.status).all())
+
+
+def _drain_outbox_concurrently(session_factory, senders, batch_size):
+    """Mengosongkan outbox dengan EmailOutboxWorker dan beberapa pengirim ala send-outbox sekaligus.
+
+    Mengembalikan (daftar error, lama detik).
+    """
+    worker = app.EmailOutboxWorker(session_factory, poll_seconds=0.05)
+    errors = []
+
+    def sender():
+        try:
+            with session_factory() as db:
+                deadline = time.monotonic() + 60
+                while time.monotonic() < deadline:
+                    app.deliver_pending_emails(db, batch_size=batch_size)
+                    counts = _outbox_status_counts(db)
+                    if not counts.get("pending") and not counts.get("sending"):
+                        return
+        except Exception as e:
+            errors.append(repr(e))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=sender) for _ in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    worker.stop(timeout=30)
+    return errors, time.perf_counter() - started
+
+
+def cmd_check_outbox(args):
+    """Menjalankan worker outbox dan beberapa pengirim paralel terhadap server SMTP lokal (database sementara).
+
+    Diperiksa: setiap email terkirim tepat sekali walau worker dan send-outbox berjalan bersamaan,
+    email yang ditolak dicoba ulang dengan jeda, dan klaim yang habis kembali ke pending.
+    """
+    failures = 0
+
+    def check(label, ok, detail):
+        nonlocal failures
+        failures += not ok
+        print(f"[{'OK' if ok else 'GAGAL'}] {label}: {detail}")
+
+    with tempfile.TemporaryDirectory(prefix="motocare-outbox-") as workdir:
+        engine, session_factory = _scratch_session(workdir, 1, 0, 0)
+        try:
+            # 1. Worker + pengirim paralel: tidak ada email ganda, semua akhirnya terkirim
+            server, delivered, state = _start_smtp_stand_in(fail_first=args.fail_first)
+            with _app_settings(**_smtp_settings_for(server, OUTBOX_RETRY_BASE_SECONDS=0)):
+                with session_factory() as db:
+                    for i in range(args.messages):
+                        app.enqueue_email(db, f"pemilik{i}@motocare.local", f"uji-outbox-{i}", "Isi email uji.")
+
+                errors, elapsed = _drain_outbox_concurrently(session_factory, args.senders, args.batch_size)
+            server.shutdown()
+            server.server_close()
+
+            with session_factory() as db:
+                counts = _outbox_status_counts(db)
+                retried = db.query(app.EmailOutbox).filter(app.EmailOutbox.attempts > 1).count()
+            duplicates = sum(1 for count in delivered.values() if count > 1)
+            check(
+                f"worker + {args.senders} pengirim paralel", not errors and duplicates == 0
+                and len(delivered) == args.messages and counts == {"sent": args.messages},
+                f"diterima SMTP={sum(delivered.values())} unik={len(delivered)}/{args.messages} ganda={duplicates} "
+                f"status={counts} error={len(errors)} ({elapsed:.2f} dtk)",
+            )
+            check(
+                "penolakan 451 dicoba ulang", retried == state["rejected"] == args.fail_first,
+                f"ditolak={state['rejected']}, email dengan >1 percobaan={retried}",
+            )
+            for error in errors[:5]:
+                print(f"  {error}")
+
+            # 2. Jeda percobaan ulang: email yang ditolak tidak dikirim lagi sebelum jadwalnya
+            server, delivered, state = _start_smtp_stand_in(fail_first=1)
+            with _app_settings(**_smtp_settings_for(server)), session_factory() as db:
+                message_id = app.enqueue_email(db, "jeda@motocare.local", "uji-jeda", "Isi email uji.")
+                first = app.deliver_pending_emails(db)
+                message = db.get(app.EmailOutbox, message_id)
+                delay = (message.next_attempt_at - datetime.datetime.now()).total_seconds()
+                too_early = app.deliver_pending_emails(db)
+                on_time = app.deliver_pending_emails(db, now=message.next_attempt_at)
+            server.shutdown()
+            server.server_close()
+            check(
+                "jeda percobaan ulang", first == (0, 1) and too_early == (0, 0) and on_time == (1, 0)
+                and 0 < delay <= app.OUTBOX_RETRY_BASE_SECONDS and delivered == {"jeda@motocare.local": 1},
+                f"gagal={first}, sebelum jadwal={too_early}, sesuai jadwal={on_time}, jeda={delay:.0f} dtk",
+            )
+
+            # 3. Klaim milik pengirim yang mati: tidak disentuh selama berlaku, kembali ke pending setelah habis
+            server, delivered, state = _start_smtp_stand_in()
+            with _app_settings(**_smtp_settings_for(server)), session_factory() as db:
+                for i in range(3):
+                    app.enqueue_email(db, f"klaim{i}@motocare.local", f"uji-klaim-{i}", "Isi email uji.")
+                now = datetime.datetime.now()
+                app._claim_outbox_batch(db, 3, now) # pengirim ini "mati" sebelum mengirim
+                while_claimed = app.deliver_pending_emails(db, now=now)
+                after_lease = app.deliver_pending_emails(
+                    db, now=now + datetime.timedelta(seconds=app.OUTBOX_LEASE_SECONDS + 1)
+                )
+                counts = _outbox_status_counts(db)
+            server.shutdown()
+            server.server_close()
+            check(
+                "klaim kedaluwarsa", while_claimed == (0, 0) and after_lease == (3, 0)
+                and len(delivered) == 3 and max(delivered.values()) == 1,
+                f"selama klaim={while_claimed}, setelah habis={after_lease}, status={counts}",
+            )
+        finally:
+            engine.dispose()
+    return 1 if failures else 0
+
+
+def cmd_check_digests(args):
+    """Menjalankan job digest dua kali bersamaan lalu sekali lagi, kemudian mengirim hasilnya lewat
+    worker dan pengirim paralel ke server SMTP lokal (database sementara).
+
+    Diperiksa: satu baris reminder_digest_log dan satu email outbox per pemilik per hari, dan
+    setiap pemilik menerima digestnya tepat sekali.
+    """
+    # Cukup jauh ke depan agar setiap motor yang punya riwayat service sudah lewat jatuh tempo
+    today = datetime.date.today() + datetime.timedelta(days=args.days_ahead)
+    failures = 0
+
+    def check(label, ok, detail):
+        nonlocal failures
+        failures += not ok
+        print(f"[{'OK' if ok else 'GAGAL'}] {label}: {detail}")
+
+    with tempfile.TemporaryDirectory(prefix="motocare-digest-") as workdir:
+        engine, session_factory = _scratch_session(workdir, args.users, args.motors_per_user, args.services_per_motor)
+        try:
+            errors = []
+            queued = []
+
+            def run_job():
+                try:
+                    with session_factory() as db:
+                        queued.append(app.queue_reminder_digests(db, today=today, chunk_size=args.chunk_size))
+                except Exception as e:
+                    errors.append(repr(e))
+
+            # Cron dan admin menjalankan job bersamaan, lalu job diulang di hari yang sama
+            threads = [threading.Thread(target=run_job) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            run_job()
+
+            with session_factory() as db:
+                expected = dict(db.execute(
+                    app.select(app.User.id, app.User.email)
+                    .join(app.Motor, app.Motor.owner_id == app.User.id)
+                    .join(app.MotorDueStatus, app.MotorDueStatus.motor_id == app.Motor.id)
+                    .where(app.MotorDueStatus.status.in_(app.DIGEST_STATUSES))
+                    .distinct()
+                ).all())
+                logs_per_owner = dict(db.query(app.ReminderDigestLog.owner_id, app.func.count())
+                                      .filter(app.ReminderDigestLog.digest_date == today)
+                                      .group_by(app.ReminderDigestLog.owner_id).all())
+                outbox_total = db.query(app.EmailOutbox).count()
+            check(
+                "satu digest per pemilik per hari", not errors and bool(expected)
+                and sum(queued) == len(expected) == outbox_total
+                and set(logs_per_owner) == set(expected) and set(logs_per_owner.values()) == {1},
+                f"pemilik jatuh tempo={len(expected)}, diantrekan per job={queued}, log={sum(logs_per_owner.values())}, "
+                f"outbox={outbox_total}, error={len(errors)}",
+            )
+            for error in errors[:5]:
+                print(f"  {error}")
+
+            server, delivered, _ = _start_smtp_stand_in()
+            with _app_settings(**_smtp_settings_for(server)):
+                errors, elapsed = _drain_outbox_concurrently(session_factory, args.senders, args.batch_size)
+            server.shutdown()
+            server.server_close()
+            with session_factory() as db:
+                counts = _outbox_status_counts(db)
+            check(
+                f"pengiriman digest (worker + {args.senders} pengirim)", not errors
+                and set(delivered) == set(expected.values()) and set(delivered.values()) == {1}
+                and counts == {"sent": len(expected)},
+                f"diterima={sum(delivered.values())}, penerima unik={len(delivered)}/{len(expected)}, "
+                f"status={counts}, error={len(errors)} ({elapsed:.2f} dtk)",
+            )
+            for error in errors[:5]:
+                print(f"  {error}")
+        finally:
+            engine.dispose()
+    return 1 if failures else 0
+
+
+class _SimulatedRerun(Exception):
+    """Pengganti exception st.rerun()/st.stop() yang memotong skrip di tengah jalan."""
+
+
+def cmd_soak_sessions(args):
+    """Uji rendam get_db() pada database sementara: banyak rerun paralel, koneksi terbuka harus tetap datar."""
+    errors = []
+    samples = []
+    with tempfile.TemporaryDirectory(prefix="motocare-soak-") as workdir:
+        engine, _ = _scratch_session(workdir, 1, 1, 0)
+        user_id = motor_id = 1
+        pool = engine.pool
+
+        def rerun_loop(thread_index):
+            for i in range(args.reruns_per_thread):
+                try:
+                    with app.get_db() as db:
+                        app.get_user_count(db)
+                        app.get_motors_by_owner(db, user_id)
+                        app.get_service_reminders(db, user_id)
+                        if i % args.write_every == 0:
+                            app.create_new_service(db, motor_id, "2025-01-01", i + 1, "soak", 1000, "Bengkel Uji", "-")
+                        if i % 3 == thread_index % 3:
+                            # Sepertiga rerun dipotong di tengah, seperti st.rerun()/st.stop()
+                            raise _SimulatedRerun()
+                except _SimulatedRerun:
+                    pass
+                except Exception as e:
+                    errors.append(repr(e))
+
+        try:
+            with _app_sessions_bound_to(engine):
+                for round_number in range(1, args.rounds + 1):
+                    threads = [threading.Thread(target=rerun_loop, args=(i,)) for i in range(args.threads)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    samples.append((pool.checkedout(), pool.checkedin()))
+                    print(f"putaran {round_number:3d}: dipinjam={samples[-1][0]} menganggur={samples[-1][1]} "
+                          f"(pool_size={app.DB_POOL_SIZE}, max_overflow={app.DB_MAX_OVERFLOW})")
+        finally:
+            engine.dispose()
+
+    leaked = [checked_out for checked_out, _ in samples if checked_out]
+    open_counts = [checked_out + checked_in for checked_out, checked_in in samples]
+    print(f"Rerun: {args.rounds * args.threads * args.reruns_per_thread}, error: {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+    if leaked or max(open_counts) > max(open_counts[0], app.DB_POOL_SIZE):
+        print(f"GAGAL: koneksi tidak kembali ke pool (terbuka per putaran: {open_counts}).")
+        return 1
+    print(f"Koneksi terbuka tetap datar: {open_counts}")
+    return 1 if errors else 0
+
+
+def cmd_stress_writes(args):
+    """Uji beban penulisan paralel di database sementara: mencatat service dari banyak thread sambil membaca pengingat."""
+    errors = []
+    reads = [0]
+    stop_readers = threading.Event()
+
+    with tempfile.TemporaryDirectory(prefix="motocare-stress-") as workdir:
+        # Satu user dengan satu motor per penulis (ID motor 1..writers)
+        engine, session_factory = _scratch_session(workdir, 1, args.writers, 0)
+        user_id = 1
+        motor_ids = range(1, args.writers + 1)
+
+        def writer(motor_id):
+            with session_factory() as db:
+                for i in range(args.writes_per_writer):
+                    try:
+                        app.create_new_service(db, motor_id, "2025-01-01", i + 1, "stress", 1000, "Bengkel Uji", "-")
+                        app.update_motor_km(db, motor_id, i + 1)
+                    except Exception as e:
+                        errors.append(repr(e))
+
+        def reader():
+            with session_factory() as db:
+                while not stop_readers.is_set():
+                    try:
+                        app.get_service_reminders(db, user_id)
+                        db.rollback()
+                        reads[0] += 1
+                    except Exception as e:
+                        errors.append(repr(e))
+
+        readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+        writers = [threading.Thread(target=writer, args=(motor_id,)) for motor_id in motor_ids]
+        try:
+            for thread in readers:
+                thread.start()
+            started = time.perf_counter()
+            for thread in writers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            stop_readers.set()
+            for thread in readers:
+                thread.join()
+            engine.dispose()
+
+    total_writes = args.writers * args.writes_per_writer * 2
+    lock_errors = sum("database is locked" in error for error in errors)
+    print(f"Penulisan: {total_writes} dalam {elapsed:.2f} detik ({total_writes / elapsed:.0f} tulis/detik)")
+    print(f"Pembacaan pengingat paralel: {reads[0]}")
+    print(f"Error: {len(errors)} (database is locked: {lock_errors})")
+    for error in errors[:5]:
+        print(f"  {error}")
+    return 1 if errors else 0
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def cmd_bench_login(args):
+    """Mengukur latensi login (p50/p95) melalui pool hash pada beberapa tingkat konkurensi (database sementara)."""
+    email = "bench@motocare.local"
+    password = "rahasia-bench"
+
+    print(f"Metode hash: {app.PASSWORD_HASH_METHOD}, worker pool: {app.PASSWORD_HASH_WORKERS}")
+    with tempfile.TemporaryDirectory(prefix="motocare-login-") as workdir:
+        engine, session_factory = _scratch_session(workdir, 1, 0, 0)
+        try:
+            with session_factory() as db:
+                app.create_new_user(db, "bench", email, password, is_admin=False)
+
+            for concurrency in args.concurrency:
+                latencies = []
+                latencies_lock = threading.Lock()
+                per_thread = max(1, args.logins // concurrency)
+
+                def login_loop():
+                    with session_factory() as db:
+                        for _ in range(per_thread):
+                            started = time.perf_counter()
+                            assert app.authenticate_user(db, email, password) is not None
+                            elapsed = time.perf_counter() - started
+                            db.rollback()
+                            with latencies_lock:
+                                latencies.append(elapsed)
+
+                threads = [threading.Thread(target=login_loop) for _ in range(concurrency)]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                wall = time.perf_counter() - started
+
+                latencies.sort()
+                print(
+                    f"konkurensi={concurrency:3d} login={len(latencies):4d} "
+                    f"p50={_percentile(latencies, 0.50) * 1000:8.1f} ms "
+                    f"p95={_percentile(latencies, 0.95) * 1000:8.1f} ms "
+                    f"throughput={len(latencies) / wall:6.1f} login/detik"
+                )
+        finally:
+            engine.dispose()
+    return 0
+
+
+def cmd_generate_data(args):
+    """Membuat database SQLite sintetis untuk pengukuran."""
+    started = time.perf_counter()
+    engine = benchmarks.generate_database(
+        args.path, args.users, args.motors_per_user, args.services_per_motor,
+        photo_bytes=args.photo_bytes, photo_ratio=args.photo_ratio, seed=args.seed,
+    )
+    engine.dispose()
+    services = args.users * args.motors_per_user * args.services_per_motor
+    print(f"{args.path}: {args.users} user, {args.users * args.motors_per_user} motor, {services} service "
+          f"({os.path.getsize(args.path) / 1e6:.1f} MB) dalam {time.perf_counter() - started:.1f} dtk.")
+    return 0
+
+
+def cmd_bench_helpers(args):
+    """Menjalankan micro-benchmark helper database pada beberapa titik skala."""
+    try:
+        scales = [benchmarks.parse_scale(value) for value in args.scale or benchmarks.BENCH_DEFAULT_SCALES]
+    except ValueError as e:
+        print(e)
+        return 1
+    workdir = args.workdir or tempfile.mkdtemp(prefix="motocare-bench-")
+    report = benchmarks.run_benchmark_suite(
+        scales, workdir, calls=args.calls, photo_bytes=args.photo_bytes, seed=args.seed, keep=args.keep,
+    )
+
+    for entry in report["scales"]:
+        print(f"Skala {entry['label']} ({entry['db_bytes'] / 1e6:.1f} MB, dibuat dalam {entry['generate_seconds']:.1f} dtk)")
+        for name, result in entry["helpers"].items():
+            print(f"  {name:28s} p50={result['p50_ms']:8.2f} ms  p95={result['p95_ms']:8.2f} ms  "
+                  f"query/panggilan={result['queries_per_call']:5.1f}")
+    if args.output:
+        benchmarks.write_report(report, args.output)
+        print(f"Hasil ditulis ke {args.output}")
+
+    if args.compare:
+        regressions = benchmarks.compare_reports(benchmarks.read_report(args.compare), report)
+        for label, name, message in regressions:
+            print(f"[REGRESI] {label} {name}: {message}")
+        if regressions:
+            return 2
+        print(f"Tidak ada regresi dibanding {args.compare}.")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Perintah pemeliharaan MotoCare App.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Terapkan migrasi skema yang tertunda.")
+    migrate.add_argument("--to", type=int, help="Berhenti di versi skema ini.")
+    migrate.add_argument("--status", action="store_true", help="Tampilkan migrasi yang sudah/belum diterapkan.")
+    migrate.set_defaults(func=cmd_migrate)
+
+    check_indexes = subparsers.add_parser("check-indexes", help="Periksa rencana query helper dengan EXPLAIN QUERY PLAN.")
+    check_indexes.set_defaults(func=cmd_check_indexes)
+
+    check_reminder_queries = subparsers.add_parser("check-reminder-queries", help="Pastikan query pengingat tidak bertambah mengikuti jumlah motor.")
+    check_reminder_queries.add_argument("--motors", type=int, nargs="+", default=[5, 50], help="Jumlah motor per titik uji.")
+    check_reminder_queries.add_argument("--services-per-motor", type=int, default=3, help="Riwayat service per motor.")
+    check_reminder_queries.set_defaults(func=cmd_check_reminder_queries)
+
+    check_cache = subparsers.add_parser("check-cache", help="Pastikan setiap mutator menginvalidasi cache baca per user.")
+    check_cache.set_defaults(func=cmd_check_cache)
+
+    rebuild_stats = subparsers.add_parser("rebuild-stats", help="Hitung ulang agregat service per motor.")
+    rebuild_stats.add_argument("--motor-id", type=int, action="append", help="Batasi ke motor tertentu (boleh diulang).")
+    rebuild_stats.set_defaults(func=cmd_rebuild_stats)
+
+    rebuild_rollup = subparsers.add_parser("rebuild-rollup", help="Hitung ulang rollup biaya bulanan untuk analitik.")
+    rebuild_rollup.add_argument("--motor-id", type=int, action="append", help="Batasi ke motor tertentu (boleh diulang).")
+    rebuild_rollup.set_defaults(func=cmd_rebuild_rollup)
+
+    refresh_due_status = subparsers.add_parser("refresh-due-status", help="Perbarui status jatuh tempo semua motor (job harian).")
+    refresh_due_status.add_argument("--date", help="Tanggal acuan YYYY-MM-DD (default: hari ini).")
+    refresh_due_status.add_argument("--all", action="store_true", help="Hitung ulang semua motor, bukan hanya yang basi.")
+    refresh_due_status.add_argument("--chunk-size", type=int, default=app.DUE_STATUS_CHUNK_SIZE, help="Motor per transaksi.")
+    refresh_due_status.set_defaults(func=cmd_refresh_due_status)
+
+    forecast = subparsers.add_parser("forecast", help="Prakiraan jatuh tempo armada (NumPy).")
+    forecast.add_argument("--email", help="Batasi ke motor pengguna ini (default: semua motor).")
+    forecast.add_argument("--verify", action="store_true", help="Bandingkan tanggal/KM kalender dengan fungsi skalar.")
+    forecast.set_defaults(func=cmd_forecast)
+
+    migrate_photos = subparsers.add_parser("migrate-photos", help="Pindahkan foto Base64 lama ke penyimpanan foto.")
+    migrate_photos.add_argument("--batch-size", type=int, default=50, help="Jumlah foto per transaksi.")
+    migrate_photos.set_defaults(func=cmd_migrate_photos)
+
+    make_thumbnails = subparsers.add_parser("make-thumbnails", help="Buat thumbnail untuk foto lama.")
+    make_thumbnails.add_argument("--batch-size", type=int, default=50, help="Jumlah foto per transaksi.")
+    make_thumbnails.set_defaults(func=cmd_make_thumbnails)
+
+    gc_photos = subparsers.add_parser("gc-photos", help="Hapus file foto yang tidak dirujuk lagi.")
+    gc_photos.set_defaults(func=cmd_gc_photos)
+
+    rebuild_search = subparsers.add_parser("rebuild-search", help="Bangun ulang index teks penuh riwayat service.")
+    rebuild_search.set_defaults(func=cmd_rebuild_search)
+
+    search_services = subparsers.add_parser("search-services", help="Cari riwayat service seorang pengguna.")
+    search_services.add_argument("email", help="Email pengguna.")
+    search_services.add_argument("query", help="Kata kunci pencarian.")
+    search_services.add_argument("--page-size", type=int, default=app.SERVICE_SEARCH_PAGE_SIZE, help="Jumlah hasil.")
+    search_services.set_defaults(func=cmd_search_services)
+
+    check_search_pages = subparsers.add_parser("check-search-pages", help="Pastikan halaman pencarian stabil walau ada penulisan di antara halaman.")
+    check_search_pages.add_argument("--query", default="ganti oli")
+    check_search_pages.add_argument("--motors", type=int, default=4)
+    check_search_pages.add_argument("--services-per-motor", type=int, default=60)
+    check_search_pages.add_argument("--page-size", type=int, default=7)
+    check_search_pages.set_defaults(func=cmd_check_search_pages)
+
+    rebuild_workshops = subparsers.add_parser("rebuild-workshops", help="Bangun ulang katalog bengkel dan index spasialnya.")
+    rebuild_workshops.add_argument("--dataset", default=app.WORKSHOP_DATASET_PATH, help="Path CSV katalog bengkel bawaan.")
+    rebuild_workshops.set_defaults(func=cmd_rebuild_workshops)
+
+    check_workshops = subparsers.add_parser("check-workshops", help="Bandingkan katalog bengkel per penulisan dengan hasil rebuild.")
+    check_workshops.add_argument("--services-per-motor", type=int, default=20)
+    check_workshops.set_defaults(func=cmd_check_workshops)
+
+    find_workshops = subparsers.add_parser("find-workshops", help="Cari bengkel terdekat dari katalog lokal.")
+    find_workshops.add_argument("location", help="Nama kota/wilayah atau koordinat 'lat, lng'.")
+    find_workshops.add_argument("--radius", type=int, default=app.WORKSHOP_DEFAULT_RADIUS_M, help="Radius pencarian (meter).")
+    find_workshops.add_argument("-k", type=int, default=5, help="Jumlah bengkel terdekat yang ditampilkan.")
+    find_workshops.set_defaults(func=cmd_find_workshops)
+
+    bench_workshop_client = subparsers.add_parser("bench-workshop-client", help="Uji klien pencarian bengkel dengan server HTTP lokal.")
+    bench_workshop_client.add_argument("--concurrency", type=int, default=16, help="Jumlah pencarian identik bersamaan.")
+    bench_workshop_client.add_argument("--delay", type=float, default=0.2, help="Jeda balasan server pengganti (detik).")
+    bench_workshop_client.set_defaults(func=cmd_bench_workshop_client)
+
+    import_services = subparsers.add_parser("import-services", help="Impor riwayat service dari CSV/XLSX.")
+    import_services.add_argument("file", help="Path file .csv atau .xlsx.")
+    import_services.add_argument("--email", required=True, help="Email pemilik motor.")
+    import_services.add_argument("--motor-id", type=int, help="Motor tujuan untuk baris tanpa plate_number.")
+    import_services.add_argument("--batch-size", type=int, default=app.IMPORT_BATCH_SIZE, help="Baris per transaksi.")
+    import_services.add_argument("--show-errors", type=int, default=20, help="Jumlah error per baris yang ditampilkan.")
+    import_services.set_defaults(func=cmd_import_services)
+
+    export = subparsers.add_parser("export", help="Ekspor motor, service, dan jadwal ke arsip ZIP.")
+    export.add_argument("output", help="Path file .zip tujuan.")
+    export.add_argument("--email", help="Batasi ke data pengguna ini (default: seluruh database).")
+    export.add_argument("--format", choices=app.EXPORT_FORMATS, default="csv", help="Format file di dalam arsip.")
+    export.add_argument("--photos", action="store_true", help="Sertakan file foto service.")
+    export.add_argument("--chunk-size", type=int, default=app.EXPORT_CHUNK_SIZE, help="Baris per query.")
+    export.set_defaults(func=cmd_export)
+
+    send_outbox = subparsers.add_parser("send-outbox", help="Kirim email outbox yang jatuh tempo.")
+    send_outbox.add_argument("--batch-size", type=int, default=app.OUTBOX_BATCH_SIZE, help="Email per koneksi SMTP.")
+    send_outbox.set_defaults(func=cmd_send_outbox)
+
+    check_outbox = subparsers.add_parser("check-outbox", help="Uji worker outbox dan pengirim paralel terhadap server SMTP lokal.")
+    check_outbox.add_argument("--messages", type=int, default=200, help="Jumlah email uji.")
+    check_outbox.add_argument("--senders", type=int, default=3, help="Jumlah pengirim paralel selain worker.")
+    check_outbox.add_argument("--batch-size", type=int, default=20)
+    check_outbox.add_argument("--fail-first", type=int, default=5, help="Jumlah email pertama yang ditolak server (451).")
+    check_outbox.set_defaults(func=cmd_check_outbox)
+
+    check_digests = subparsers.add_parser("check-digests", help="Uji dedupe digest harian dan pengirimannya terhadap server SMTP lokal.")
+    check_digests.add_argument("--users", type=int, default=200)
+    check_digests.add_argument("--motors-per-user", type=int, default=2)
+    check_digests.add_argument("--services-per-motor", type=int, default=3)
+    check_digests.add_argument("--days-ahead", type=int, default=730, help="Tanggal job relatif terhadap hari ini.")
+    check_digests.add_argument("--chunk-size", type=int, default=25, help="Pemilik per chunk job digest.")
+    check_digests.add_argument("--senders", type=int, default=3, help="Jumlah pengirim paralel selain worker.")
+    check_digests.add_argument("--batch-size", type=int, default=20)
+    check_digests.set_defaults(func=cmd_check_digests)
+
+    send_digests = subparsers.add_parser("send-digests", help="Kirim email digest motor yang jatuh tempo (job harian).")
+    send_digests.add_argument("--date", help="Tanggal acuan YYYY-MM-DD (default: hari ini).")
+    send_digests.add_argument("--include-due-soon", action="store_true", help="Sertakan motor yang mendekati jatuh tempo.")
+    send_digests.add_argument("--chunk-size", type=int, default=app.DIGEST_OWNER_CHUNK, help="Pemilik per transaksi.")
+    send_digests.add_argument("--workers", type=int, default=app.DIGEST_RENDER_WORKERS, help="Thread render email.")
+    send_digests.add_argument("--batch-size", type=int, default=1000, help="Email per koneksi SMTP.")
+    send_digests.add_argument("--no-send", action="store_true", help="Hanya antrekan; pengiriman oleh worker outbox.")
+    send_digests.set_defaults(func=cmd_send_digests)
+
+    stress_writes = subparsers.add_parser("stress-writes", help="Uji beban penulisan paralel dan laporkan throughput.")
+    stress_writes.add_argument("--writers", type=int, default=16, help="Jumlah thread penulis.")
+    stress_writes.add_argument("--writes-per-writer", type=int, default=100, help="Jumlah service per penulis.")
+    stress_writes.add_argument("--readers", type=int, default=4, help="Jumlah thread pembaca paralel.")
+    stress_writes.set_defaults(func=cmd_stress_writes)
+
+    soak_sessions = subparsers.add_parser("soak-sessions", help="Uji rendam session per rerun; koneksi terbuka harus datar.")
+    soak_sessions.add_argument("--rounds", type=int, default=10, help="Jumlah putaran; pool diperiksa setiap akhir putaran.")
+    soak_sessions.add_argument("--threads", type=int, default=16, help="Sesi paralel per putaran.")
+    soak_sessions.add_argument("--reruns-per-thread", type=int, default=50, help="Rerun per sesi per putaran.")
+    soak_sessions.add_argument("--write-every", type=int, default=10, help="Satu rerun dari sekian rerun ikut menulis.")
+    soak_sessions.set_defaults(func=cmd_soak_sessions)
+
+    bench_login = subparsers.add_parser("bench-login", help="Ukur latensi login p50/p95 pada beberapa konkurensi.")
+    bench_login.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Tingkat konkurensi yang diuji.")
+    bench_login.add_argument("--logins", type=int, default=64, help="Jumlah login per tingkat konkurensi.")
+    bench_login.set_defaults(func=cmd_bench_login)
+
+    generate_data = subparsers.add_parser("generate-data", help="Buat database SQLite sintetis untuk pengukuran.")
+    generate_data.add_argument("path", help="Path file database (ditimpa jika sudah ada).")
+    generate_data.add_argument("--users", type=int, default=1000, help="Jumlah user.")
+    generate_data.add_argument("--motors-per-user", type=int, default=3, help="Motor per user.")
+    generate_data.add_argument("--services-per-motor", type=int, default=30, help="Service per motor.")
+    generate_data.add_argument("--photo-bytes", type=int, default=0, help="Ukuran foto sintetis (byte); 0 tanpa foto.")
+    generate_data.add_argument("--photo-ratio", type=float, default=0.2, help="Bagian service yang memiliki foto.")
+    generate_data.add_argument("--seed", type=int, default=0, help="Seed generator acak.")
+    generate_data.set_defaults(func=cmd_generate_data)
+
+    bench_helpers = subparsers.add_parser("bench-helpers", help="Ukur waktu dan jumlah query helper database.")
+    bench_helpers.add_argument("--scale", action="append", help="USERSxMOTORSxSERVICES (boleh diulang; default: BENCH_DEFAULT_SCALES).")
+    bench_helpers.add_argument("--calls", type=int, default=benchmarks.BENCH_SAMPLE_CALLS, help="Panggilan per helper.")
+    bench_helpers.add_argument("--photo-bytes", type=int, default=0, help="Ukuran foto sintetis (byte).")
+    bench_helpers.add_argument("--seed", type=int, default=0, help="Seed generator acak.")
+    bench_helpers.add_argument("--workdir", help="Folder database benchmark (default: folder sementara).")
+    bench_helpers.add_argument("--keep", action="store_true", help="Jangan hapus database benchmark setelah selesai.")
+    bench_helpers.add_argument("--output", help="Tulis hasil JSON ke path ini.")
+    bench_helpers.add_argument("--compare", help="Bandingkan dengan hasil JSON sebelumnya; exit 2 jika ada regresi.")
+    bench_helpers.set_defaults(func=cmd_bench_helpers)
+
+    return parser
+
+
+# Perintah yang tidak memakai skema database aplikasi saat ini: migrate mengatur skemanya
+# sendiri, perintah lainnya di sini bekerja di database sementara yang dimigrasi sendiri.
+COMMANDS_WITHOUT_MIGRATION = {
+    "migrate", "generate-data", "bench-helpers", "check-reminder-queries", "check-cache", "soak-sessions",
+    "stress-writes", "bench-login", "check-outbox",
+    "check-digests", "check-search-pages", "check-workshops",
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command not in COMMANDS_WITHOUT_MIGRATION:
+        # import app tidak memigrasi; perintah lain memakai skema terbaru secara eksplisit
+        for version, name in app.run_migrations(app.engine):
+            print(f"Diterapkan: {version:04d} {name}")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())